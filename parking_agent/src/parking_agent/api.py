@@ -4,18 +4,136 @@ Melbourne Parking Agent - Main API
 User-friendly parking spot finder with popular locations and GPS features
 """
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+import asyncio
 import json
-from .tools.parking_tool import MelbourneParkingTool
+import threading
+import time
+from . import (area, cache, changelog, clusters, forecast, frame, freshness, heatmap, history, metrics, nearest,
+               profiling, restrictions, shards, snapshot, spatial, streaming, tiles, tracing, tracking, walking,
+               watchlist)
+from .engine import ParkingEngine
+
+loop_lag_monitor = metrics.EventLoopLagMonitor()
+
+engine = ParkingEngine(cache=cache.create_cache(snapshot.DEFAULT_REFRESH_SECONDS), clusters=clusters.ClusterCache(),
+                       shards=shards.ShardIndex())
+# With a shared cache one instance per refresh interval calls the upstream API
+fetch = engine.cache.shared_fetch(engine.fetch_snapshot) if engine.cache.shared else engine.fetch_snapshot
+engine.store = snapshot.create_store(fetch)
+
+# First listener, so shard versions are current before anything caches results for a snapshot
+engine.store.add_listener(engine.shards.on_snapshot)
+
+stream_hub = streaming.StreamHub()
+
+change_log = changelog.ChangeLog()
+engine.store.add_listener(change_log.on_snapshot)
+
+history_store = history.create_history_store()
+
+def _record_history(previous, current):
+    # Every worker keeps its own rings; only the refresher writes disk segments
+    history_store.on_snapshot(previous, current, persist=getattr(engine.store, "is_refresher", True))
+
+engine.store.add_listener(_record_history)
+
+heatmap_cache = heatmap.HeatmapCache()
+engine.store.add_listener(heatmap_cache.on_snapshot)
+
+tile_cache = tiles.TileCache()
+engine.store.add_listener(tile_cache.on_snapshot)
+engine.store.add_listener(engine.clusters.on_snapshot)
+
+nearest_table = nearest.NearestTableCache()
+engine.store.add_listener(nearest_table.on_snapshot)
+engine.store.add_listener(freshness.observe_staleness)
+
+forecast_model = forecast.ForecastModel()
+
+def _update_forecast(previous, current):
+    if previous is None and not len(forecast_model.bays):
+        # Seed the week-hour tables from recorded history before applying live changes
+        forecast_model.load_history(history_store.transitions_by_bay(), current)
+    forecast_model.on_snapshot(previous, current)
+
+engine.store.add_listener(_update_forecast)
+
+watchlist_registry = watchlist.WatchlistRegistry()
+alert_dispatcher = watchlist.AlertDispatcher(watchlist_registry)
+engine.store.add_listener(alert_dispatcher.on_snapshot)
+
+tracking_registry = tracking.TrackingRegistry()
+engine.store.add_listener(tracking_registry.on_snapshot)
+
+# Popular locations are searched again after a refresh, on their own thread so the
+# listener thread is not held up, and only where a bay in the search area changed
+_warm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="parking-warm")
+_warm_lock = threading.Lock()
+_warm_queued = False
+# Location key -> shard token of its search area when it was last warmed
+_warm_tokens: Dict[str, Optional[str]] = {}
+WARM_RADIUS = 500
+
+def _warm_popular(previous, current):
+    global _warm_queued
+    with _warm_lock:
+        # A refresh landing while one is queued is covered by that run
+        if _warm_queued:
+            return
+        _warm_queued = True
+    _warm_executor.submit(_warm_changed_locations)
+
+def _warm_changed_locations():
+    global _warm_queued
+    with _warm_lock:
+        _warm_queued = False
+    current = engine.store.current()
+    if current is None:
+        return
+    try:
+        for key, location in POPULAR_LOCATIONS.items():
+            latitude, longitude = location["latitude"], location["longitude"]
+            token = engine.shards.token(current, current.grid.radius_bbox(latitude, longitude, WARM_RADIUS))
+            if token is not None and _warm_tokens.get(key) == token:
+                continue
+            engine.search(latitude, longitude, WARM_RADIUS)
+            _warm_tokens[key] = token
+    except Exception as e:
+        print(f"Warming popular locations failed: {e}")
+
+engine.store.add_listener(_warm_popular)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop_lag_monitor.start()
+    engine.restrictions = await asyncio.to_thread(restrictions.load_restrictions)
+    engine.streets = await asyncio.to_thread(walking.load_street_graph)
+    stream_hub.attach(engine.store, asyncio.get_running_loop())
+    engine.store.start()
+    yield
+    await engine.store.stop()
+    await loop_lag_monitor.stop()
+    alert_dispatcher.close()
+    _warm_executor.shutdown(wait=False)
+    # Only the refresher persists; writing the rings lets the next start continue from them
+    history_store.flush(include_rings=getattr(engine.store, "is_refresher", True))
+    tracing.tracer.shutdown()
 
 app = FastAPI(
     title="Melbourne Parking Agent",
     description="Find available parking spots in Melbourne using real-time sensor data",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
+_VALIDATE_STAGE = metrics.SEARCH_STAGE_SECONDS.labels("validate")
+
 # Popular Melbourne locations with coordinates
 POPULAR_LOCATIONS = {
     "melbourne_cbd": {
@@ -75,6 +193,58 @@ class ParkingRequest(BaseModel):
     longitude: float
     radius: int = 500
     location_name: str = ""
+    # Restriction filters (need PARKING_RESTRICTIONS_FILE or PARKING_RESTRICTIONS_URL)
+    min_duration: Optional[int] = None
+    accessible: Optional[bool] = None
+    at_time: Optional[str] = None
+    # "distance" (straight line) or "walking" (needs PARKING_STREET_GRAPH)
+    ranking: str = "distance"
+    # Radii for cumulative free-bay counts, and nearest bays to sample per ring
+    rings: Optional[list[int]] = None
+    ring_samples: int = 0
+    # One result per cluster of adjacent bays on the same block
+    group: bool = False
+    # Rank recently reported bays ahead of stale sensors; drop bays not reported within max_staleness seconds
+    prefer_fresh: bool = True
+    max_staleness: Optional[int] = None
+
+class WatchlistRequest(BaseModel):
+    latitude: float
+    longitude: float
+    radius: int = 200
+    target: str
+    label: str = ""
+
+class TrackRequest(BaseModel):
+    latitude: float
+    longitude: float
+    radius: int = 500
+    limit: int = 20
+
+class TrackPosition(BaseModel):
+    latitude: float
+    longitude: float
+
+class AreaRequest(BaseModel):
+    # A GeoJSON Polygon, MultiPolygon or Feature holding one
+    polygon: Optional[dict] = None
+    # Or street segments: lists of [longitude, latitude] points, buffered by width meters
+    segments: Optional[list[list[list[float]]]] = None
+    width: float = 20.0
+
+class RouteRequest(BaseModel):
+    # An encoded polyline (precision 5), or [longitude, latitude] points
+    polyline: Optional[str] = None
+    points: Optional[list[list[float]]] = None
+    width: float = 50.0
+
+class BayCluster(BaseModel):
+    # Free bays of the cluster within the search radius, and in the whole cluster
+    free_nearby: int
+    free: int
+    bays: int
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class ParkingSpot(BaseModel):
     bay_id: str
@@ -83,6 +253,15 @@ class ParkingSpot(BaseModel):
     status_time: str
     updated_time: str
     google_maps_link: str
+    restriction: str = ""
+    cluster: Optional[BayCluster] = None
+    age_seconds: Optional[int] = None
+    freshness: float = 0.0
+
+class AvailabilityRing(BaseModel):
+    radius: int
+    free: int
+    nearest: list[ParkingSpot] = []
 
 class ParkingResponse(BaseModel):
     status: str
@@ -91,6 +270,7 @@ class ParkingResponse(BaseModel):
     html_table: str
     message: str = ""
     search_location: str = ""
+    rings: Optional[list[AvailabilityRing]] = None
 
 @app.get("/", response_class=HTMLResponse)
 async def home():
@@ -604,30 +784,102 @@ async def home():
     </html>
     """
 
-@app.post("/parking", response_model=ParkingResponse)
-async def find_parking(request: ParkingRequest):
+@app.post("/parking", response_model=ParkingResponse,
+          responses={200: {"content": {frame.FRAME_MEDIA_TYPE: {}}}})
+async def find_parking(request: ParkingRequest, accept: str = Header(default="")):
+    """
+    Free bays nearest to a location. Send `Accept: application/vnd.parking.frame`
+    for a compact binary frame instead of JSON.
+    """
+    with tracing.tracer.trace("POST /parking", radius=request.radius):
+        # The search is synchronous; to_thread copies the trace context along
+        search = _find_parking_frame if frame.wants_frame(accept) else _find_parking
+        return await asyncio.to_thread(search, request)
+
+def _validate_search(request: ParkingRequest):
+    if not (-90 <= request.latitude <= 90):
+        raise HTTPException(status_code=400, detail="Latitude must be between -90 and 90")
+    if not (-180 <= request.longitude <= 180):
+        raise HTTPException(status_code=400, detail="Longitude must be between -180 and 180")
+    if not (50 <= request.radius <= 5000):
+        raise HTTPException(status_code=400, detail="Search radius must be between 50 and 5000 meters")
+    if request.ranking not in ("distance", "walking"):
+        raise HTTPException(status_code=400, detail="ranking must be distance or walking")
+    if request.ranking == "walking" and engine.streets is None:
+        raise HTTPException(status_code=400, detail="Walking ranking needs a street graph, which is not loaded")
+    if request.rings is not None:
+        if not (1 <= len(request.rings) <= 8) or not all(10 <= radius <= 5000 for radius in request.rings):
+            raise HTTPException(status_code=400, detail="rings must hold 1 to 8 radii between 10 and 5000 meters")
+        if not (0 <= request.ring_samples <= 10):
+            raise HTTPException(status_code=400, detail="ring_samples must be between 0 and 10")
+    if request.max_staleness is not None and not (60 <= request.max_staleness <= 604800):
+        raise HTTPException(status_code=400, detail="max_staleness must be between 60 and 604800 seconds")
+
+def _search_filters(request: ParkingRequest) -> Optional[restrictions.SearchFilters]:
+    """Restriction filters from the request, or None when it sets none"""
+    filters = restrictions.SearchFilters(request.min_duration, request.accessible)
+    if not filters.active:
+        return None
+    if engine.restrictions is None:
+        raise HTTPException(status_code=400, detail="Restriction filters need bay restriction data, which is not loaded")
+    if request.at_time:
+        at_time = snapshot.parse_timestamp(request.at_time)
+        if at_time != at_time:
+            raise HTTPException(status_code=400, detail="at_time must be an ISO-8601 time")
+        filters = filters._replace(at_time=at_time)
+    return filters
+
+def _find_parking_frame(request: ParkingRequest) -> Response:
+    _validate_search(request)
+    if request.rings is not None or request.group:
+        # A frame only has columns for the result bays
+        raise HTTPException(status_code=400, detail="rings and group are only available in JSON responses")
+    filters = _search_filters(request)
+    current = engine.current_snapshot()
+    if current is None:
+        raise HTTPException(status_code=503, detail="Parking data unavailable")
+    body = engine.search_frame(current, request.latitude, request.longitude, request.radius, filters,
+                               walking=request.ranking == "walking", prefer_fresh=request.prefer_fresh,
+                               max_staleness=request.max_staleness)
+    return Response(content=body, media_type=frame.FRAME_MEDIA_TYPE)
+
+def _parking_spot(spot: dict) -> ParkingSpot:
+    return ParkingSpot(
+        bay_id=spot['bay_id'],
+        status=spot['status'],
+        distance_meters=spot['distance_meters'],
+        status_time=spot['status_time'],
+        updated_time=spot['updated_time'],
+        google_maps_link=spot['google_maps_link'],
+        restriction=spot.get('restriction', ''),
+        cluster=spot.get('cluster'),
+        age_seconds=spot.get('age_seconds'),
+        freshness=spot.get('freshness', 0.0)
+    )
+
+def _find_parking(request: ParkingRequest) -> ParkingResponse:
     try:
         # Input validation
-        if not (-90 <= request.latitude <= 90):
-            raise HTTPException(status_code=400, detail="Latitude must be between -90 and 90")
-        if not (-180 <= request.longitude <= 180):
-            raise HTTPException(status_code=400, detail="Longitude must be between -180 and 180")
-        if not (50 <= request.radius <= 5000):
-            raise HTTPException(status_code=400, detail="Search radius must be between 50 and 5000 meters")
+        _validate_search(request)
+        filters = _search_filters(request)
 
         # Determine location name for display
         search_location = request.location_name if request.location_name else f"Coordinates ({request.latitude:.4f}, {request.longitude:.4f})"
 
-        # Use the parking tool directly
-        tool = MelbourneParkingTool()
-        result = tool._run(request.latitude, request.longitude, request.radius)
-
-        # Parse the result
-        result_data = json.loads(result)
+        # Use the search engine directly (no crewAI needed for HTTP searches)
+        result_data = engine.search(request.latitude, request.longitude, request.radius, filters,
+                                    walking=request.ranking == "walking", rings=request.rings,
+                                    ring_samples=request.ring_samples, group=request.group,
+                                    prefer_fresh=request.prefer_fresh, max_staleness=request.max_staleness)
 
         # Extract parking data and HTML table
         parking_spots = result_data.get('parking_spots', [])
         html_table = result_data.get('html_table', '')
+        rings = None
+        if 'rings' in result_data:
+            rings = [AvailabilityRing(radius=ring['radius'], free=ring['free'],
+                                      nearest=[_parking_spot(spot) for spot in ring.get('nearest', [])])
+                     for ring in result_data['rings']]
 
         if not parking_spots:
             return ParkingResponse(
@@ -636,33 +888,328 @@ async def find_parking(request: ParkingRequest):
                 parking_data=[],
                 html_table="",
                 message="No available spots within the search radius. Try expanding your search area.",
-                search_location=search_location
+                search_location=search_location,
+                rings=rings
             )
 
         # Format response
-        formatted_spots = []
-        for spot in parking_spots:
-            formatted_spots.append(ParkingSpot(
-                bay_id=spot['bay_id'],
-                status=spot['status'],
-                distance_meters=spot['distance_meters'],
-                status_time=spot['status_time'],
-                updated_time=spot['updated_time'],
-                google_maps_link=spot['google_maps_link']
-            ))
-
-        return ParkingResponse(
+        validate_started = time.perf_counter()
+        formatted_spots = [_parking_spot(spot) for spot in parking_spots]
+
+        response = ParkingResponse(
             status="success",
             found_spots=len(formatted_spots),
             parking_data=formatted_spots,
             html_table=html_table,
             message=f"Successfully found {len(formatted_spots)} parking spots",
-            search_location=search_location
+            search_location=search_location,
+            rings=rings
         )
+        validate_ended = time.perf_counter()
+        _VALIDATE_STAGE.observe(validate_ended - validate_started)
+        tracing.record_span("validate", validate_started, validate_ended)
+        return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.get("/parking/nearest")
+async def nearest_free_bay(latitude: float, longitude: float):
+    """
+    The closest free bays to a point, from a lookup table built once per
+    snapshot. Outside the sensor area, in cells with no candidates and while
+    the table for a new snapshot is being built this falls back to a 2 km
+    search.
+    """
+    if not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    current = await asyncio.to_thread(engine.store.ensure)
+    if current is None:
+        raise HTTPException(status_code=503, detail="Parking data unavailable")
+    table = nearest_table.get(current)
+    found = table.nearest(current, latitude, longitude) if table is not None else None
+    if found is None:
+        found = await asyncio.to_thread(engine.nearest_free, current, latitude, longitude, 2000,
+                                        limit=nearest_table.k)
+    bays = ['%s,"distance_meters":%d}' % (streaming.bay_json(current, row)[:-1], distance) for distance, row in found]
+    body = '{"version":%d,"count":%d,"bays":[%s]}' % (current.version, len(bays), ",".join(bays))
+    return Response(content=body, media_type="application/json")
+
+@app.get("/parking/stream")
+async def stream_parking(bbox: str):
+    """
+    Server-Sent Events for a map viewport.
+
+    bbox is west,south,east,north. The first event ("snapshot") holds every bay
+    in the viewport; later "changes" events hold only bays whose status changed.
+    """
+    try:
+        viewport = spatial.parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return StreamingResponse(
+        streaming.stream_viewport(stream_hub, engine.store, viewport),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/parking/changes")
+async def parking_changes(since: Optional[str] = None):
+    """
+    Bays whose status changed since a snapshot version, for mirror clients.
+
+    Without `since` the response holds every bay. Poll again with the returned
+    `version` token ("<epoch>:<n>"). A 410 response means `since` is too old or
+    from another instance: reload without `since`.
+    """
+    if since is None:
+        snapshot = await asyncio.to_thread(engine.store.ensure)
+        if snapshot is None:
+            raise HTTPException(status_code=503, detail="Parking data unavailable")
+        changelog.CHANGES_REQUESTS.labels("full").inc()
+        return Response(content=changelog.full_state(snapshot), media_type="application/json")
+
+    try:
+        body = change_log.changes_since(since)
+    except changelog.ResyncRequired as e:
+        changelog.CHANGES_REQUESTS.labels("resync").inc()
+        return JSONResponse(status_code=410, content={
+            "resync": True,
+            "detail": str(e),
+            "version": e.version,
+            "oldest_version": e.oldest_version,
+        })
+    changelog.CHANGES_REQUESTS.labels("incremental").inc()
+    return Response(content=body, media_type="application/json")
+
+@app.get("/parking/forecast")
+async def parking_forecast(latitude: float, longitude: float, radius: int = 500,
+                           arrive_in: float = 20.0, arrival: Optional[str] = None):
+    """
+    Bays and areas ranked by predicted free probability at arrival.
+
+    Arrival is `arrive_in` minutes from now, or an ISO-8601 `arrival` time.
+    """
+    if not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    if not (50 <= radius <= 5000):
+        raise HTTPException(status_code=400, detail="Search radius must be between 50 and 5000 meters")
+    now = time.time()
+    arrival_time = snapshot.parse_timestamp(arrival) if arrival else now + arrive_in * 60
+    if arrival_time != arrival_time or not (now - 3600 <= arrival_time <= now + 7 * 86400):
+        raise HTTPException(status_code=400, detail="Arrival must be a time within the next 7 days")
+
+    current = await asyncio.to_thread(engine.store.ensure)
+    if current is None:
+        raise HTTPException(status_code=503, detail="Parking data unavailable")
+    result = forecast_model.forecast(current, latitude, longitude, radius, arrival_time, now=now)
+    return {"version": current.version, "arrival": arrival_time, **result}
+
+@app.get("/parking/heatmap")
+async def parking_heatmap(zoom: int = 14, if_none_match: Optional[str] = Header(default=None)):
+    """
+    Free/occupied bay counts per grid cell for the whole city.
+
+    zoom 12-16 selects cells from 1600 m down to 100 m. Counts are aggregated
+    once per snapshot by the store listener and served as pre-serialized JSON
+    with a version ETag; while a new version is being aggregated the previous
+    one is served.
+    """
+    current = await asyncio.to_thread(engine.store.ensure)
+    if current is None:
+        raise HTTPException(status_code=503, detail="Parking data unavailable")
+    zoom = heatmap.clamp_zoom(zoom)
+    built = heatmap_cache.get(zoom)
+    if built is None:
+        raise HTTPException(status_code=503, detail="Heatmap is still being built")
+    version, body = built
+    etag = f'"heatmap-{version}-{zoom}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={int(snapshot.DEFAULT_REFRESH_SECONDS)}"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/parking/tiles/{z}/{x}/{y}.{fmt}")
+async def parking_tile(z: int, x: int, y: int, fmt: str, if_none_match: Optional[str] = Header(default=None)):
+    """
+    Every bay in an XYZ tile with its status, as GeoJSON (.geojson) or the
+    compact binary tile format (.bin). The ETag changes only when a bay in the
+    tile changes.
+    """
+    if fmt not in tiles.FORMATS:
+        raise HTTPException(status_code=404, detail="Tile format must be geojson or bin")
+    if not tiles.valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail=f"Tiles exist for zoom {tiles.MIN_ZOOM}-{tiles.MAX_ZOOM}")
+    current = await asyncio.to_thread(engine.store.ensure)
+    if current is None:
+        raise HTTPException(status_code=503, detail="Parking data unavailable")
+
+    version, body = tile_cache.get(current, fmt, z, x, y)
+    etag = f'"{fmt}-{z}-{x}-{y}-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=tiles.FORMATS[fmt], headers=headers)
+
+@app.post("/parking/area")
+async def parking_area(request: AreaRequest):
+    """
+    Free bays inside a polygon, or within `width` meters of street segments.
+
+    Polygon results are in bay order; segment results are nearest first with
+    their distance to the street.
+    """
+    if (request.polygon is None) == (request.segments is None):
+        raise HTTPException(status_code=400, detail="Give either polygon or segments")
+    try:
+        if request.polygon is not None:
+            kind, shape = "polygon", area.parse_polygon(request.polygon)
+        else:
+            if not (0 < request.width <= area.MAX_SEGMENT_WIDTH_METERS):
+                raise ValueError(f"width must be between 0 and {area.MAX_SEGMENT_WIDTH_METERS:g} meters")
+            kind, shape = "segments", area.parse_segments(request.segments)
+    except (ValueError, TypeError, IndexError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid area: {e}")
+
+    current = await asyncio.to_thread(engine.store.ensure)
+    if current is None:
+        raise HTTPException(status_code=503, detail="Parking data unavailable")
+    width = request.width if kind == "segments" else 0.0
+    # Off the event loop: large shapes take a while, and the cache may be a Redis round trip
+    body = await asyncio.to_thread(area.search, current, kind, shape, width, engine.cache, engine.shards)
+    return Response(content=body, media_type="application/json")
+
+@app.post("/parking/route")
+async def parking_route(request: RouteRequest):
+    """
+    Free bays within `width` meters of a driving route, in the order they are
+    passed, with their distance along the route (`route_meters`).
+    """
+    if (request.polyline is None) == (request.points is None):
+        raise HTTPException(status_code=400, detail="Give either polyline or points")
+    if not (0 < request.width <= area.MAX_SEGMENT_WIDTH_METERS):
+        raise HTTPException(status_code=400,
+                            detail=f"width must be between 0 and {area.MAX_SEGMENT_WIDTH_METERS:g} meters")
+    try:
+        route = area.parse_route(request.polyline, request.points)
+    except (ValueError, TypeError, IndexError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid route: {e}")
+
+    current = await asyncio.to_thread(engine.store.ensure)
+    if current is None:
+        raise HTTPException(status_code=503, detail="Parking data unavailable")
+    body = await asyncio.to_thread(area.search, current, "route", route, request.width, engine.cache, engine.shards)
+    return Response(content=body, media_type="application/json")
+
+@app.get("/parking/history/{bay_id}")
+async def bay_history(bay_id: int, since: float = 0, until: Optional[float] = None):
+    """Status transitions of one bay (kerbsideid) as [epoch seconds, status] pairs, oldest first"""
+    transitions = await asyncio.to_thread(history_store.history, bay_id, since, until)
+    return {
+        "bay_id": str(bay_id),
+        "transitions": [[epoch, snapshot.STATUS_NAMES[status]] for epoch, status in transitions],
+    }
+
+@app.post("/parking/track")
+async def start_tracking(request: TrackRequest):
+    """
+    Start a tracking session for a moving user. Send position updates to
+    PUT /parking/track/{session_id}; each returns the nearest free bays, with
+    `changed` false when the ranking is the same as in the previous response.
+    """
+    if not (-90 <= request.latitude <= 90) or not (-180 <= request.longitude <= 180):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    if not (tracking.MIN_RADIUS_METERS <= request.radius <= tracking.MAX_RADIUS_METERS):
+        raise HTTPException(status_code=400, detail=f"Tracking radius must be between {tracking.MIN_RADIUS_METERS} "
+                                                    f"and {tracking.MAX_RADIUS_METERS} meters")
+    current = await asyncio.to_thread(engine.store.ensure)
+    if current is None:
+        raise HTTPException(status_code=503, detail="Parking data unavailable")
+    try:
+        session = tracking_registry.create(current, request.latitude, request.longitude, request.radius,
+                                           max(1, min(request.limit, tracking.MAX_LIMIT)))
+    except ValueError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return Response(content=tracking_registry.response(session, current), media_type="application/json")
+
+@app.put("/parking/track/{session_id}")
+async def update_tracking(session_id: str, position: TrackPosition):
+    """
+    New position for a tracking session; only newly covered grid cells are
+    read. Sessions created by another worker (or expired) are taken over here.
+    """
+    if not (-90 <= position.latitude <= 90) or not (-180 <= position.longitude <= 180):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    current = await asyncio.to_thread(engine.store.ensure)
+    if current is None:
+        raise HTTPException(status_code=503, detail="Parking data unavailable")
+    try:
+        session = tracking_registry.move(session_id, current, position.latitude, position.longitude)
+    except ValueError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown tracking session")
+    return Response(content=tracking_registry.response(session, current), media_type="application/json")
+
+@app.delete("/parking/track/{session_id}")
+async def stop_tracking(session_id: str):
+    if not tracking_registry.remove(session_id):
+        raise HTTPException(status_code=404, detail="Unknown tracking session")
+    return {"status": "removed", "session_id": session_id}
+
+def require_single_worker():
+    """Watchlists live in one process; with workers sharing a snapshot file a request may land on another"""
+    if isinstance(engine.store, snapshot.SharedSnapshotStore):
+        raise HTTPException(status_code=501, detail="Watchlists need a single worker (PARKING_SNAPSHOT_PATH unset)")
+
+def _watchlist_secret(authorization: str) -> str:
+    secret = watchlist.secret_from_header(authorization)
+    if secret is None:
+        raise HTTPException(status_code=401, detail="Send the subscription secret as 'Authorization: Bearer <secret>'")
+    return secret
+
+@app.post("/watchlist", dependencies=[Depends(require_single_worker)])
+async def add_watchlist(request: WatchlistRequest, authorization: str = Header(default="")):
+    """
+    Save a location to be alerted when a bay frees up within its radius.
+
+    target is "webhook:https://..." (alerts are POSTed as JSON, allowed hosts
+    only) or "queue:<name>" (alerts are collected for GET /watchlist/queues/<name>).
+    The response holds the subscription's `secret`, generated by the server and
+    needed to delete it or read its queue; send the secret of a live
+    subscription as a bearer token here to add to the same owner.
+    """
+    if not (-90 <= request.latitude <= 90) or not (-180 <= request.longitude <= 180):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    try:
+        sub, secret = watchlist_registry.add(request.latitude, request.longitude, request.radius,
+                                             request.target, request.label,
+                                             watchlist.secret_from_header(authorization))
+    except OverflowError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {**sub.to_dict(), "secret": secret}
+
+@app.delete("/watchlist/{subscription_id}", dependencies=[Depends(require_single_worker)])
+async def remove_watchlist(subscription_id: int, authorization: str = Header(default="")):
+    removed = watchlist_registry.remove(subscription_id, _watchlist_secret(authorization))
+    if removed is None:
+        raise HTTPException(status_code=404, detail="Unknown watchlist subscription")
+    if not removed:
+        raise HTTPException(status_code=403, detail="Wrong secret for this subscription")
+    return {"status": "removed", "id": subscription_id}
+
+@app.get("/watchlist/queues/{name}", dependencies=[Depends(require_single_worker)])
+async def drain_watchlist_queue(name: str, limit: int = 100, authorization: str = Header(default="")):
+    """Pop pending alert batches for a queue target of the subscriptions owning the secret"""
+    return {"messages": alert_dispatcher.drain(name, _watchlist_secret(authorization), max(1, min(limit, 1000)))}
+
 @app.get("/health")
 async def health_check():
     return {
@@ -672,6 +1219,46 @@ async def health_check():
         "version": "2.0.0"
     }
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics in the text exposition format"""
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+def require_debug_token(authorization: str = Header(default="")):
+    """Guard for the debug endpoints; they do not exist unless a token is configured"""
+    if profiling.debug_token() is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiling.check_token(authorization):
+        raise HTTPException(status_code=401, detail="Invalid debug token")
+
+async def _run_capture(func, *args):
+    """Run a profiling capture off the event loop, one at a time per worker"""
+    if not profiling.capture_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile capture is already running")
+    try:
+        return await asyncio.to_thread(func, *args)
+    finally:
+        profiling.capture_lock.release()
+
+@app.get("/debug/profile", response_class=PlainTextResponse, dependencies=[Depends(require_debug_token)])
+async def debug_cpu_profile(seconds: float = 10.0, interval_ms: float = 5.0):
+    """Sampling CPU profile of this worker as folded stacks"""
+    return await _run_capture(profiling.sample_cpu, seconds, max(interval_ms, 1.0) / 1000.0)
+
+@app.get("/debug/heap", response_class=PlainTextResponse, dependencies=[Depends(require_debug_token)])
+async def debug_heap_snapshot(seconds: float = profiling.DEFAULT_HEAP_SECONDS, top: int = 50,
+                              format: str = "folded"):
+    """tracemalloc snapshot as folded stacks weighted by bytes, or a top-N text report"""
+    try:
+        return await _run_capture(profiling.memory_snapshot, seconds, top, format == "folded")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/debug/tasks", response_class=PlainTextResponse, dependencies=[Depends(require_debug_token)])
+async def debug_coroutine_stacks(format: str = "text"):
+    """Stacks of all pending coroutines on this worker's event loop"""
+    return profiling.coroutine_stacks(folded=format == "folded")
+
 @app.get("/locations")
 async def get_locations():
     """Get all popular locations"""
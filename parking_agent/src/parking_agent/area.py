@@ -0,0 +1,343 @@
+"""
+Melbourne Parking Agent - Area Search
+Free bays inside a GeoJSON polygon, along street segments or along a driving route.
+
+Candidates come from the snapshot's grid index over the shape's bounding box.
+For polygons, grid cells crossed by the boundary are found by walking every
+edge, clipped to the cells that hold bays so a continent-sized shape costs no
+more than one covering the city; the bays in all other cells are inside or outside together, so one
+point-in-polygon test of the cell centre settles the whole cell and only bays
+in boundary cells are tested one by one. Street segments are buffered by a
+width in meters and tested with a flat-earth point-to-segment distance; only
+bays in the grid cells around each segment are visited. Route corridors work
+the same way and order bays by their position along the route.
+
+Results are cached by a hash of the normalized geometry, under the dependency
+token of the shards the shape covers (see shards.py) or the snapshot version.
+The cache holds the selection - kerbsideids with their distances - not the
+body: a shard token outlives snapshot versions, so the body, with its
+`version` and bay fields, is rendered from the current snapshot on every
+request. Only the geometry work is reused.
+"""
+
+import hashlib
+import json
+import math
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from parking_agent import metrics
+from parking_agent.snapshot import MISSING_BAY_ID, STATUS_FREE, Snapshot
+from parking_agent.spatial import (METERS_PER_DEGREE_LAT, METERS_PER_DEGREE_LON, Cell, GridIndex, points_bbox,
+                                   segment_distance_meters)
+from parking_agent.streaming import bay_json
+
+if TYPE_CHECKING:
+    from parking_agent.cache import ParkingCache
+    from parking_agent.shards import ShardIndex
+
+MAX_VERTICES = 10000
+MAX_SEGMENT_WIDTH_METERS = 200.0
+
+AREA_CELLS = metrics.Counter("parking_area_cells", "Grid cells resolved during area searches", ["kind"])
+
+# A ring is a list of (lat, lon) vertices, first == last not required
+Ring = List[Tuple[float, float]]
+
+
+def _ring(coordinates: Sequence) -> Ring:
+    ring = [(float(point[1]), float(point[0])) for point in coordinates]
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring.pop()
+    if len(ring) < 3:
+        raise ValueError("polygon rings need at least three distinct points")
+    return ring
+
+
+def parse_polygon(geometry: Dict[str, Any]) -> List[List[Ring]]:
+    """GeoJSON Polygon / MultiPolygon (or a Feature holding one) as [[outer, *holes], ...]"""
+    if geometry.get("type") == "Feature":
+        geometry = geometry.get("geometry") or {}
+    kind = geometry.get("type")
+    coordinates = geometry.get("coordinates")
+    if kind == "Polygon":
+        polygons = [coordinates]
+    elif kind == "MultiPolygon":
+        polygons = coordinates
+    else:
+        raise ValueError("geometry must be a GeoJSON Polygon or MultiPolygon")
+    parsed = [[_ring(ring) for ring in polygon] for polygon in polygons or ()]
+    if not parsed or sum(len(ring) for polygon in parsed for ring in polygon) > MAX_VERTICES:
+        raise ValueError(f"polygon must have between 3 and {MAX_VERTICES} vertices")
+    return parsed
+
+
+def parse_segments(segments: Sequence) -> List[Ring]:
+    """Street segments as lists of [lon, lat] points (GeoJSON LineString coordinates)"""
+    parsed = []
+    for line in segments:
+        points = [(float(point[1]), float(point[0])) for point in line]
+        if len(points) < 2:
+            raise ValueError("each street segment needs at least two points")
+        parsed.append(points)
+    if not parsed or sum(len(line) for line in parsed) > MAX_VERTICES:
+        raise ValueError(f"segments must have between 2 and {MAX_VERTICES} points")
+    return parsed
+
+
+def shape_hash(kind: str, shape: Any, width: float = 0.0) -> str:
+    """Stable hash of a parsed shape, used in cache keys"""
+    canonical = json.dumps([kind, width, shape], separators=(",", ":"))
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+def shape_bbox(kind: str, shape: Any, width: float = 0.0):
+    """Bounding box of a parsed shape, padded by the segment or corridor width"""
+    if kind == "polygon":
+        points = [point for rings in shape for point in rings[0]]
+    elif kind == "segments":
+        points = [point for line in shape for point in line]
+    else:
+        points = shape
+    return points_bbox(points, pad_meters=width)
+
+
+def point_in_rings(lat: float, lon: float, rings: List[Ring]) -> bool:
+    """Even-odd rule over all rings, so holes are excluded"""
+    inside = False
+    for ring in rings:
+        previous_lat, previous_lon = ring[-1]
+        for vertex_lat, vertex_lon in ring:
+            if (vertex_lat > lat) != (previous_lat > lat):
+                crossing = (previous_lon - vertex_lon) * (lat - vertex_lat) / (previous_lat - vertex_lat) + vertex_lon
+                if lon < crossing:
+                    inside = not inside
+            previous_lat, previous_lon = vertex_lat, vertex_lon
+    return inside
+
+
+def _clip(start: Tuple[float, float], end: Tuple[float, float], bbox) -> Optional[Tuple[Tuple[float, float], ...]]:
+    """Part of the segment inside the box (Liang-Barsky), or None when it misses the box"""
+    low, high = 0.0, 1.0
+    dlat, dlon = end[0] - start[0], end[1] - start[1]
+    for delta, offset in ((-dlat, start[0] - bbox[0]), (dlat, bbox[2] - start[0]),
+                          (-dlon, start[1] - bbox[1]), (dlon, bbox[3] - start[1])):
+        if delta == 0:
+            if offset < 0:
+                return None
+            continue
+        t = offset / delta
+        if delta < 0:
+            low = max(low, t)
+        else:
+            high = min(high, t)
+        if low > high:
+            return None
+    return ((start[0] + dlat * low, start[1] + dlon * low), (start[0] + dlat * high, start[1] + dlon * high))
+
+
+def boundary_cells(grid: GridIndex, rings: List[Ring]) -> Set[Cell]:
+    """
+    Cells crossed by any ring edge, plus their edge neighbours so corner clips
+    are included. Edges are walked only across the grid's occupied extent:
+    cells outside it hold no bays, so the walk is bounded by the size of the
+    sensor network rather than by the size of the shape.
+    """
+    extent = grid.occupied_bbox()
+    if extent is None:
+        return set()
+    # One cell of margin so cells just outside the extent still get their neighbours
+    extent = (extent[0] - grid.lat_step, extent[1] - grid.lon_step,
+              extent[2] + grid.lat_step, extent[3] + grid.lon_step)
+    step = min(grid.lat_step, grid.lon_step) / 4
+    cells: Set[Cell] = set()
+    for ring in rings:
+        previous = ring[-1]
+        for vertex in ring:
+            clipped = _clip(previous, vertex, extent)
+            previous = vertex
+            if clipped is None:
+                continue
+            (lat1, lon1), (lat2, lon2) = clipped
+            steps = max(1, int(max(abs(lat2 - lat1), abs(lon2 - lon1)) / step) + 1)
+            for i in range(steps + 1):
+                f = i / steps
+                cells.add(grid.cell_of(lat1 + (lat2 - lat1) * f, lon1 + (lon2 - lon1) * f))
+    padded = set(cells)
+    for r, c in cells:
+        padded.update(((r + 1, c), (r - 1, c), (r, c + 1), (r, c - 1)))
+    return padded
+
+
+def rows_in_polygon(snapshot: Snapshot, polygons: List[List[Ring]], free_only: bool = True) -> List[int]:
+    grid = snapshot.grid
+    lats, lons, status = snapshot.lats, snapshot.lons, snapshot.status
+    found: List[int] = []
+    for rings in polygons:
+        bbox = points_bbox(rings[0])
+        edge_cells = boundary_cells(grid, rings)
+        min_row, min_col = grid.cell_of(bbox[0], bbox[1])
+        max_row, max_col = grid.cell_of(bbox[2], bbox[3])
+        if grid.count_cells_in_bbox(bbox) > len(grid.cells):
+            cells = [(cell, bucket) for cell, bucket in grid.cells.items()
+                     if min_row <= cell[0] <= max_row and min_col <= cell[1] <= max_col]
+        else:
+            cells = [(cell, grid.cells[cell]) for cell in grid.cells_in_bbox(bbox) if cell in grid.cells]
+        interior = boundary = 0
+        for (r, c), bucket in cells:
+            if (r, c) in edge_cells:
+                boundary += 1
+                found.extend(row for row in bucket if point_in_rings(lats[row], lons[row], rings))
+            else:
+                interior += 1
+                # The boundary does not enter this cell: its centre decides for every bay in it
+                if point_in_rings((r + 0.5) * grid.lat_step, (c + 0.5) * grid.lon_step, rings):
+                    found.extend(bucket)
+        AREA_CELLS.labels("boundary").inc(boundary)
+        AREA_CELLS.labels("interior").inc(interior)
+    rows = sorted(set(found))
+    if free_only:
+        rows = [row for row in rows if status[row] == STATUS_FREE]
+    return rows
+
+
+def _line_hits(snapshot: Snapshot, line: Ring, width: float, free_only: bool) -> Dict[int, Tuple[float, float]]:
+    """{row: (distance meters, meters along the line)} for bays within `width` of a polyline"""
+    grid = snapshot.grid
+    lats, lons, status = snapshot.lats, snapshot.lons, snapshot.status
+    hits: Dict[int, Tuple[float, float]] = {}
+    along = 0.0
+    for (lat1, lon1), (lat2, lon2) in zip(line, line[1:]):
+        length = math.hypot((lat2 - lat1) * METERS_PER_DEGREE_LAT, (lon2 - lon1) * METERS_PER_DEGREE_LON)
+        # Only the cells around this segment are visited, never the whole snapshot
+        for row in grid.query_bbox(points_bbox(((lat1, lon1), (lat2, lon2)), pad_meters=width)):
+            if free_only and status[row] != STATUS_FREE:
+                continue
+            distance, t = segment_distance_meters(lats[row], lons[row], lat1, lon1, lat2, lon2)
+            if distance <= width and distance < hits.get(row, (math.inf,))[0]:
+                hits[row] = (distance, along + t * length)
+        along += length
+    return hits
+
+
+def rows_along_segments(snapshot: Snapshot, segments: List[Ring], width: float,
+                        free_only: bool = True) -> List[Tuple[float, int]]:
+    """(distance meters, row) of bays within `width` of any segment, nearest first"""
+    best: Dict[int, float] = {}
+    for line in segments:
+        for row, (distance, _along) in _line_hits(snapshot, line, width, free_only).items():
+            if distance < best.get(row, math.inf):
+                best[row] = distance
+    return sorted((distance, row) for row, distance in best.items())
+
+
+def rows_along_route(snapshot: Snapshot, route: Ring, width: float,
+                     free_only: bool = True) -> List[Tuple[float, float, int]]:
+    """(meters along the route, distance meters, row) of bays in the corridor, in driving order"""
+    hits = _line_hits(snapshot, route, width, free_only)
+    return sorted((along, distance, row) for row, (distance, along) in hits.items())
+
+
+def decode_polyline(encoded: str, precision: int = 5) -> Ring:
+    """(lat, lon) points of an encoded polyline (Google polyline algorithm)"""
+    points: Ring = []
+    factor = 10 ** precision
+    index = lat = lon = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                if index >= length:
+                    raise ValueError("truncated polyline")
+                byte = ord(encoded[index]) - 63
+                index += 1
+                if not 0 <= byte < 64:
+                    raise ValueError("invalid polyline character")
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lat / factor, lon / factor))
+    return points
+
+
+def parse_route(polyline: Optional[str] = None, points: Optional[Sequence] = None) -> Ring:
+    """A route from an encoded polyline or [lon, lat] points"""
+    route = decode_polyline(polyline) if polyline else parse_segments([points or []])[0]
+    if len(route) < 2:
+        raise ValueError("a route needs at least two points")
+    if len(route) > MAX_VERTICES:
+        raise ValueError(f"a route can have at most {MAX_VERTICES} points")
+    return route
+
+
+def area_response(snapshot: Snapshot, rows: Sequence[int], distances: Optional[Sequence[float]] = None,
+                  along: Optional[Sequence[float]] = None) -> bytes:
+    """Pre-serialized JSON body for an area or route search"""
+    if distances is None:
+        bays = [bay_json(snapshot, row) for row in rows]
+    elif along is None:
+        bays = ['%s,"distance_meters":%d}' % (bay_json(snapshot, row)[:-1], int(round(distance)))
+                for row, distance in zip(rows, distances)]
+    else:
+        bays = ['%s,"distance_meters":%d,"route_meters":%d}' % (
+                    bay_json(snapshot, row)[:-1], int(round(distance)), int(round(position)))
+                for row, distance, position in zip(rows, distances, along)]
+    return ('{"version":%d,"count":%d,"bays":[%s]}' % (snapshot.version, len(bays), ",".join(bays))).encode()
+
+
+Selection = Tuple[List[int], Optional[List[float]], Optional[List[float]]]
+
+
+def select(snapshot: Snapshot, kind: str, shape: Any, width: float = 0.0) -> Selection:
+    """(rows, distances, positions along the route) of an area search; the last two are None when not measured"""
+    if kind == "polygon":
+        return rows_in_polygon(snapshot, shape), None, None
+    if kind == "segments":
+        found = rows_along_segments(snapshot, shape, width)
+        return [row for _d, row in found], [d for d, _row in found], None
+    found = rows_along_route(snapshot, shape, width)
+    return [row for _a, _d, row in found], [d for _a, d, _row in found], [a for a, _d, _row in found]
+
+
+def encode_selection(snapshot: Snapshot, selection: Selection) -> Optional[bytes]:
+    """Selection by kerbsideid, rounded as served; None when a bay has no id to find it by later"""
+    rows, distances, along = selection
+    bay_ids = [snapshot.bay_ids[row] for row in rows]
+    if MISSING_BAY_ID in bay_ids:
+        return None
+    rounded = [[int(round(value)) for value in column] if column is not None else None
+               for column in (distances, along)]
+    return json.dumps([bay_ids, *rounded], separators=(",", ":")).encode()
+
+
+def decode_selection(snapshot: Snapshot, data: bytes) -> Optional[Selection]:
+    """Rows of the current snapshot for a cached selection; None if a bay has left it"""
+    bay_ids, distances, along = json.loads(data)
+    row_by_bay = snapshot.row_by_bay
+    rows = [row_by_bay.get(bay_id) for bay_id in bay_ids]
+    if None in rows:
+        return None
+    return rows, distances, along
+
+
+def search(snapshot: Snapshot, kind: str, shape: Any, width: float = 0.0,
+           cache: Optional["ParkingCache"] = None, shards: Optional["ShardIndex"] = None) -> bytes:
+    """Serialized area or route search, reusing a cached selection while the shards it covers are unchanged"""
+    if cache is None:
+        return area_response(snapshot, *select(snapshot, kind, shape, width))
+    digest = shape_hash(kind, shape, width)
+    bbox = shape_bbox(kind, shape, width)
+    scope = (shards.token(snapshot, bbox) if shards is not None else None) or snapshot.version
+    cached = cache.get_area(scope, digest)
+    selection = decode_selection(snapshot, cached) if cached is not None else None
+    if selection is None:
+        selection = select(snapshot, kind, shape, width)
+        encoded = encode_selection(snapshot, selection)
+        if encoded is not None:
+            cache.set_area(scope, digest, encoded)
+    return area_response(snapshot, *selection)
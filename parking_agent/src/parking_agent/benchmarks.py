@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+"""
+Melbourne Parking Agent - Benchmarks
+Micro-benchmarks for the per-refresh data structures, on synthetic data.
+
+    parking_bench watchlist --subscriptions 100000
+    parking_bench history --transitions 1000000
+    parking_bench encoding --queries 500
+    parking_bench walking --queries 200
+    parking_bench nearest --refreshes 5
+    parking_bench shards --churn 0.01
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from array import array
+from typing import Any, Callable, Dict, List
+
+from parking_agent.snapshot import STATUS_FREE, STATUS_OCCUPIED, Snapshot
+
+# Rough extent of the sensor network around the CBD
+AREA = (-37.850, 144.930, -37.795, 145.000)
+
+
+def synthetic_snapshot(bays: int, free_ratio: float = 0.4, seed: int = 1, version: int = 1,
+                       base: Snapshot = None, churn: float = 0.0) -> Snapshot:
+    """Random bays over the CBD; with `base`, flip the status of a `churn` fraction of its bays"""
+    rng = random.Random(seed)
+    if base is not None:
+        status = array('B', base.status)
+        for row in rng.sample(range(len(base)), int(len(base) * churn)):
+            status[row] = STATUS_OCCUPIED if status[row] == STATUS_FREE else STATUS_FREE
+        updated = array('d', (time.time(),) * len(base))
+        return Snapshot(version, time.time(), base.bay_ids, base.lats, base.lons, updated, updated, status)
+
+    now = time.time()
+    lats = array('d', (rng.uniform(AREA[0], AREA[2]) for _ in range(bays)))
+    lons = array('d', (rng.uniform(AREA[1], AREA[3]) for _ in range(bays)))
+    status = array('B', (STATUS_FREE if rng.random() < free_ratio else STATUS_OCCUPIED for _ in range(bays)))
+    stamps = array('d', (now - rng.uniform(0, 3600) for _ in range(bays)))
+    return Snapshot(version, now, array('q', range(1, bays + 1)), lats, lons, stamps, stamps, status)
+
+
+def measure_memory(build: Callable[[], Any]):
+    """Build something under tracemalloc; returns (object, MiB retained)"""
+    tracemalloc.start()
+    try:
+        result = build()
+        current, _peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, current / (1024 * 1024)
+
+
+def directory_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def bench_watchlist(args) -> Dict[str, Any]:
+    from parking_agent.watchlist import AlertDispatcher, WatchlistRegistry
+
+    rng = random.Random(args.seed)
+    base = synthetic_snapshot(args.bays, seed=args.seed)
+
+    def build():
+        registry = WatchlistRegistry(cell_meters=args.cell_meters, cooldown_seconds=0,
+                                     max_subscriptions=args.subscriptions)
+        owners: List[str] = []
+        for i in range(args.subscriptions):
+            # The first thousand subscriptions get fresh secrets; later ones join those owners
+            _sub, secret = registry.add(rng.uniform(AREA[0], AREA[2]), rng.uniform(AREA[1], AREA[3]),
+                                        rng.choice((100, 200, 300, 500)), f"queue:q{i % 1000}",
+                                        secret=owners[i % 1000] if i >= 1000 else None)
+            if i < 1000:
+                owners.append(secret)
+        return registry
+
+    started = time.perf_counter()
+    registry, memory_mib = measure_memory(build)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    dispatcher = AlertDispatcher(registry)
+    diffs = []
+    previous = base
+    for version in range(2, args.refreshes + 2):
+        current = synthetic_snapshot(0, seed=args.seed + version, version=version, base=previous, churn=args.churn)
+        diffs.append(current.diff(previous))
+        previous = current
+
+    match_ms: List[float] = []
+    alerts = 0
+    for diff in diffs:
+        started = time.perf_counter()
+        alerts += dispatcher.process(diff)
+        match_ms.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "subscriptions": args.subscriptions,
+        "bays": args.bays,
+        "freed_per_refresh": sum(len(d.freed_rows) for d in diffs) / len(diffs),
+        "index_build_ms": build_ms,
+        "index_memory_mib": memory_mib,
+        "match_ms_mean": sum(match_ms) / len(match_ms),
+        "match_ms_max": max(match_ms),
+        "alerts_per_refresh": alerts / len(diffs),
+    }
+
+
+def bench_history(args) -> Dict[str, Any]:
+    from parking_agent.history import HistoryStore
+
+    # Bays flip status at random, one refresh of transitions every 30 seconds
+    rng = random.Random(args.seed)
+    per_refresh = max(1, int(args.bays * args.churn))
+    epoch = int(time.time()) - args.transitions // per_refresh * 30
+    status = [1 + (rng.random() < 0.6) for _ in range(args.bays)]
+    events = []
+    for i in range(args.transitions):
+        if i % per_refresh == 0:
+            epoch += 30
+        bay = rng.randrange(args.bays)
+        status[bay] = 3 - status[bay]
+        events.append((1000 + bay, epoch + rng.randrange(30), status[bay]))
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = HistoryStore(directory, ring_size=args.ring_size, segment_entries=args.segment_entries)
+        started = time.perf_counter()
+        for bay_id, ts, code in events:
+            store.record(bay_id, ts, code)
+        store.flush()
+        write_seconds = time.perf_counter() - started
+        segments = len(list(store.segments()))
+        disk_bytes = directory_bytes(directory)
+
+        started = time.perf_counter()
+        history = store.history(1000, since=0)
+        query_ms = (time.perf_counter() - started) * 1000
+
+    def replay():
+        memory_store = HistoryStore(None, ring_size=args.ring_size)
+        for bay_id, ts, code in events:
+            memory_store.record(bay_id, ts, code, persist=False)
+        return memory_store
+
+    _store, memory_mib = measure_memory(replay)
+    spilled = max(1, args.transitions - min(args.transitions, args.bays * args.ring_size))
+    return {
+        "bays": args.bays,
+        "transitions": args.transitions,
+        "ring_size": args.ring_size,
+        "writes_per_second": args.transitions / write_seconds,
+        "ring_memory_mib": memory_mib,
+        "ring_bytes_per_entry": memory_mib * 1024 * 1024 / (args.bays * args.ring_size),
+        "segments": segments,
+        "disk_bytes_per_transition": disk_bytes / spilled,
+        "bay_history_entries": len(history),
+        "bay_query_ms": query_ms,
+    }
+
+
+def bench_encoding(args) -> Dict[str, Any]:
+    from parking_agent.engine import ParkingEngine
+    from parking_agent.frame import encode_frame
+
+    rng = random.Random(args.seed)
+    snapshot = synthetic_snapshot(args.bays, seed=args.seed)
+    engine = ParkingEngine()
+    queries = [(rng.uniform(AREA[0], AREA[2]), rng.uniform(AREA[1], AREA[3])) for _ in range(args.queries)]
+    results = [engine.nearest_free(snapshot, lat, lon, args.radius) for lat, lon in queries]
+
+    def encode_json_spots(candidates) -> bytes:
+        spots = [engine._spot(snapshot, row, distance) for distance, row in candidates]
+        return json.dumps({"parking_data": spots}).encode()
+
+    def encode_json_response(candidates) -> bytes:
+        spots = [engine._spot(snapshot, row, distance) for distance, row in candidates]
+        return json.dumps({"status": "success", "found_spots": len(spots), "parking_data": spots,
+                           "html_table": engine._generate_html_table(spots)}).encode()
+
+    def encode_binary(candidates) -> bytes:
+        return encode_frame(snapshot, candidates)
+
+    report: Dict[str, Any] = {
+        "queries": args.queries,
+        "mean_results": sum(len(r) for r in results) / len(results),
+    }
+    for name, encode in (("json_response", encode_json_response), ("json_spots", encode_json_spots),
+                         ("frame", encode_binary)):
+        started = time.perf_counter()
+        sizes = [len(encode(candidates)) for candidates in results]
+        elapsed = time.perf_counter() - started
+        report[f"{name}_bytes"] = sum(sizes) / len(sizes)
+        report[f"{name}_encode_us"] = elapsed / len(results) * 1e6
+    return report
+
+
+def synthetic_streets(spacing_meters: float, river_lat: float, bridge_every: int):
+    """Street grid over AREA cut east-west by a river crossed every `bridge_every` streets"""
+    from parking_agent.spatial import METERS_PER_DEGREE_LAT, METERS_PER_DEGREE_LON
+    from parking_agent.walking import StreetGraph
+
+    dlat, dlon = spacing_meters / METERS_PER_DEGREE_LAT, spacing_meters / METERS_PER_DEGREE_LON
+    rows = int((AREA[2] - AREA[0]) / dlat) + 1
+    cols = int((AREA[3] - AREA[1]) / dlon) + 1
+    nodes = {r * cols + c: (AREA[0] + r * dlat, AREA[1] + c * dlon) for r in range(rows) for c in range(cols)}
+    ways = [[r * cols + c for c in range(cols)] for r in range(rows)]
+    for c in range(cols):
+        column = [r * cols + c for r in range(rows)]
+        if c % bridge_every:
+            # No bridge: split the north-south street at the river
+            south = [node for node in column if nodes[node][0] < river_lat]
+            ways.extend((south, column[len(south):]))
+        else:
+            ways.append(column)
+    return StreetGraph.from_ways(nodes, ways)
+
+
+def bench_walking(args) -> Dict[str, Any]:
+    from parking_agent.engine import ParkingEngine
+
+    rng = random.Random(args.seed)
+    snapshot = synthetic_snapshot(args.bays, seed=args.seed)
+    started = time.perf_counter()
+    streets = synthetic_streets(args.spacing, (AREA[0] + AREA[2]) / 2, args.bridge_every)
+    build_ms = (time.perf_counter() - started) * 1000
+    straight = ParkingEngine()
+    walking = ParkingEngine(streets=streets)
+    queries = [(rng.uniform(AREA[0], AREA[2]), rng.uniform(AREA[1], AREA[3])) for _ in range(args.queries)]
+
+    started = time.perf_counter()
+    baseline = [straight.nearest_free(snapshot, lat, lon, args.radius) for lat, lon in queries]
+    straight_ms = (time.perf_counter() - started) * 1000 / len(queries)
+    started = time.perf_counter()
+    ranked = [walking.nearest_free(snapshot, lat, lon, args.radius, walking=True) for lat, lon in queries]
+    walking_ms = (time.perf_counter() - started) * 1000 / len(queries)
+    reordered = sum(1 for a, b in zip(baseline, ranked) if [row for _d, row in a] != [row for _d, row in b])
+    return {
+        "graph_nodes": len(streets),
+        "graph_edges": len(streets.targets) // 2,
+        "graph_build_ms": build_ms,
+        "queries": args.queries,
+        "straight_search_ms": straight_ms,
+        "walking_search_ms": walking_ms,
+        "rerank_overhead_ms": walking_ms - straight_ms,
+        "reordered_queries": reordered,
+    }
+
+
+def bench_nearest(args) -> Dict[str, Any]:
+    from parking_agent.engine import ParkingEngine
+    from parking_agent.nearest import NearestTable
+
+    rng = random.Random(args.seed)
+    snapshot = synthetic_snapshot(args.bays, seed=args.seed)
+    builds = []
+    for version in range(2, args.refreshes + 2):
+        snapshot = synthetic_snapshot(args.bays, seed=args.seed + version, version=version, base=snapshot,
+                                      churn=args.churn)
+        started = time.perf_counter()
+        table = NearestTable(snapshot, args.cell_meters, args.k)
+        builds.append(time.perf_counter() - started)
+
+    engine = ParkingEngine()
+    queries = [(rng.uniform(AREA[0], AREA[2]), rng.uniform(AREA[1], AREA[3])) for _ in range(args.queries)]
+    started = time.perf_counter()
+    looked_up = [table.nearest(snapshot, lat, lon) for lat, lon in queries]
+    lookup_us = (time.perf_counter() - started) / len(queries) * 1e6
+    started = time.perf_counter()
+    exact = [engine.nearest_free(snapshot, lat, lon, 5000, limit=1) for lat, lon in queries]
+    search_us = (time.perf_counter() - started) / len(queries) * 1e6
+    pairs = [(found[0], truth[0]) for found, truth in zip(looked_up, exact) if found and truth]
+    return {
+        "cells": table.rows_count * table.cols_count,
+        "table_bytes": len(table.table) * table.table.itemsize + len(table.offsets) * table.offsets.itemsize,
+        "build_ms_mean": sum(builds) / len(builds) * 1000,
+        "build_ms_max": max(builds) * 1000,
+        "lookup_us": lookup_us,
+        "full_search_us": search_us,
+        # Bays at the same rounded distance are ties, not errors
+        "exact_nearest_ratio": sum(1 for found, truth in pairs if found[0] == truth[0]) / len(pairs),
+        "max_extra_meters": max(found[0] - truth[0] for found, truth in pairs),
+    }
+
+
+def bench_shards(args) -> Dict[str, Any]:
+    from parking_agent import metrics
+    from parking_agent.cache import InProcessCache, ParkingCache
+    from parking_agent.engine import ParkingEngine
+    from parking_agent.shards import ShardIndex
+    from parking_agent.snapshot import SnapshotStore
+
+    rng = random.Random(args.seed)
+    locations = [(rng.uniform(AREA[0], AREA[2]), rng.uniform(AREA[1], AREA[3])) for _ in range(args.locations)]
+    # Version 0: the store numbers each snapshot as it installs it
+    series = [synthetic_snapshot(args.bays, seed=args.seed, version=0)]
+    for step in range(1, args.refreshes + 1):
+        series.append(synthetic_snapshot(args.bays, seed=args.seed + step, version=0, base=series[-1],
+                                         churn=args.churn))
+
+    hits = metrics.CACHE_REQUESTS.labels("search", "hit")
+    misses = metrics.CACHE_REQUESTS.labels("search", "miss")
+    report: Dict[str, Any] = {"locations": args.locations, "refreshes": args.refreshes}
+    for name, shards in (("version", None), ("shards", ShardIndex(args.precision))):
+        pending = iter(series)
+        store = SnapshotStore(lambda: next(pending))
+        if shards is not None:
+            store.add_listener(shards.on_snapshot)
+        engine = ParkingEngine(store, ParkingCache(InProcessCache(100000), 30.0), shards=shards)
+        store.refresh()
+        before = hits.value, misses.value
+        started = time.perf_counter()
+        for _ in range(args.refreshes):
+            store.refresh()
+            for lat, lon in locations:
+                engine.search(lat, lon, args.radius, prefer_fresh=False)
+        elapsed = time.perf_counter() - started
+        hit, miss = hits.value - before[0], misses.value - before[1]
+        report[f"{name}_hit_ratio"] = hit / ((hit + miss) or 1)
+        report[f"{name}_search_ms"] = elapsed * 1000 / (args.refreshes * len(locations))
+    return report
+
+
+BENCHMARKS = {
+    "watchlist": bench_watchlist,
+    "history": bench_history,
+    "encoding": bench_encoding,
+    "walking": bench_walking,
+    "nearest": bench_nearest,
+    "shards": bench_shards,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parking agent micro-benchmarks")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--bays", type=int, default=5000, help="Bays in the synthetic snapshot")
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+
+    watch = sub.add_parser("watchlist", help="Match snapshot diffs against many saved locations")
+    watch.add_argument("--subscriptions", type=int, default=100000)
+    watch.add_argument("--cell-meters", type=float, default=400.0)
+    watch.add_argument("--churn", type=float, default=0.1, help="Fraction of bays changing per refresh")
+    watch.add_argument("--refreshes", type=int, default=10)
+
+    hist = sub.add_parser("history", help="Record bay status transitions into the occupancy history")
+    hist.add_argument("--transitions", type=int, default=1000000)
+    hist.add_argument("--ring-size", type=int, default=64)
+    hist.add_argument("--segment-entries", type=int, default=100000)
+    hist.add_argument("--churn", type=float, default=0.1, help="Fraction of bays changing per refresh")
+
+    enc = sub.add_parser("encoding", help="Compare JSON and binary frame encodings of search results")
+    enc.add_argument("--queries", type=int, default=500)
+    enc.add_argument("--radius", type=int, default=1000)
+
+    walk = sub.add_parser("walking", help="Re-rank search results by street-graph walking distance")
+    walk.add_argument("--queries", type=int, default=200)
+    walk.add_argument("--radius", type=int, default=500)
+    walk.add_argument("--spacing", type=float, default=80.0, help="Street spacing in meters")
+    walk.add_argument("--bridge-every", type=int, default=10, help="River bridges every N streets")
+
+    near = sub.add_parser("nearest", help="Build the nearest-free-bay table and compare lookups with searches")
+    near.add_argument("--refreshes", type=int, default=5)
+    near.add_argument("--churn", type=float, default=0.1, help="Fraction of bays changing per refresh")
+    near.add_argument("--cell-meters", type=float, default=50.0)
+    near.add_argument("--k", type=int, default=3)
+    near.add_argument("--queries", type=int, default=1000)
+
+    shard = sub.add_parser("shards", help="Search cache hit ratio keyed by snapshot version vs shard versions")
+    shard.add_argument("--refreshes", type=int, default=20)
+    shard.add_argument("--churn", type=float, default=0.01, help="Fraction of bays changing per refresh")
+    shard.add_argument("--locations", type=int, default=200, help="Distinct locations searched each refresh")
+    shard.add_argument("--radius", type=int, default=300)
+    shard.add_argument("--precision", type=int, default=7, help="Geohash precision of the shards")
+
+    args = parser.parse_args()
+    result = BENCHMARKS[args.benchmark](args)
+    for key, value in result.items():
+        print(f"{key:>24}: {value:.2f}" if isinstance(value, float) else f"{key:>24}: {value}")
+
+
+if __name__ == "__main__":
+    main()
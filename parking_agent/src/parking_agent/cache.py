@@ -0,0 +1,359 @@
+"""
+Melbourne Parking Agent - Cache Backends
+Shared cache for bay snapshots and search responses across instances.
+
+Two backends implement the same small interface: InProcessCache (an LRU dict,
+used by default and as the local stand-in for Redis) and RedisCache (a minimal
+RESP client over a plain socket, so no extra dependency is needed). Values are
+zlib-compressed and keys carry a schema version plus the snapshot version (or
+a shard dependency token, see shards.py), so entries never need explicit
+invalidation.
+
+With PARKING_CACHE_URL=redis://host:6379/0 a fleet of instances shares one
+upstream fetch per refresh interval: the first instance to claim the interval's
+fetch lock fetches and stores the snapshot, the others load it from the cache.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+from parking_agent import metrics
+from parking_agent.snapshot import Snapshot
+
+# Bump when the cached value layout changes so old entries are ignored
+SCHEMA_VERSION = 2
+KEY_PREFIX = f"parking:s{SCHEMA_VERSION}"
+
+# Responses scoped by shard tokens stay valid across refreshes; expire them after this many
+SCOPED_TTL_REFRESHES = 10
+
+# Values smaller than this are stored raw; compression would not pay off
+COMPRESS_MIN_BYTES = 256
+_RAW = b"r"
+_ZLIB = b"z"
+
+
+def encode_value(value: bytes) -> bytes:
+    if len(value) < COMPRESS_MIN_BYTES:
+        return _RAW + value
+    return _ZLIB + zlib.compress(value, 1)
+
+
+def decode_value(value: bytes) -> bytes:
+    kind, payload = value[:1], value[1:]
+    if kind == _ZLIB:
+        return zlib.decompress(payload)
+    return payload
+
+
+class CacheBackend:
+    """Byte-string key/value store with TTLs"""
+
+    name = "base"
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float):
+        raise NotImplementedError
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """Set only if the key does not exist; True when this call created it"""
+        raise NotImplementedError
+
+
+class InProcessCache(CacheBackend):
+    """LRU cache with per-entry expiry, local to this process"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._entries[key] = (time.monotonic() + ttl, value)
+            return True
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisCache(CacheBackend):
+    """Minimal Redis (RESP2) client; one socket per thread"""
+
+    name = "redis"
+
+    def __init__(self, url: str, timeout: float = 2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+            if self.password:
+                self._command("AUTH", self.password)
+            if self.db:
+                self._command("SELECT", str(self.db))
+        return conn
+
+    def _reset(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn[1].close()
+                conn[0].close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _pack(*args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    @staticmethod
+    def _read_reply(reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload
+        if kind == b"-":
+            raise RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(payload)
+            if count < 0:
+                return None
+            return [RedisCache._read_reply(reader) for _ in range(count)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def _command(self, *args):
+        sock, reader = self._connection()
+        try:
+            sock.sendall(self._pack(*args))
+            return self._read_reply(reader)
+        except (OSError, ConnectionError):
+            # Drop the broken socket; the next call reconnects
+            self._reset()
+            raise
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._command("SET", key, value, "PX", max(1, int(ttl * 1000)))
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return self._command("SET", key, value, "PX", max(1, int(ttl * 1000)), "NX") is not None
+
+
+class ParkingCache:
+    """Versioned, compressed snapshot and search-response cache over a backend"""
+
+    def __init__(self, backend: CacheBackend, refresh_seconds: float):
+        self.backend = backend
+        self.refresh_seconds = refresh_seconds
+        # Interval numbers depend only on the refresh period, so every instance derives the same epoch
+        self.fleet_epoch = zlib.crc32(f"{KEY_PREFIX}:interval:{refresh_seconds:g}".encode()) or 1
+
+    @property
+    def shared(self) -> bool:
+        """True when other instances see the same entries"""
+        return not isinstance(self.backend, InProcessCache)
+
+    def _get(self, key: str, cache: str) -> Optional[bytes]:
+        try:
+            value = self.backend.get(f"{KEY_PREFIX}:{key}")
+        except (OSError, RedisError) as e:
+            # A cache outage degrades to recomputing, never to failing requests
+            print(f"Cache get failed: {e}")
+            value = None
+        metrics.record_cache_lookup(cache, value is not None)
+        return decode_value(value) if value is not None else None
+
+    def _set(self, key: str, value: bytes, ttl: float):
+        try:
+            self.backend.set(f"{KEY_PREFIX}:{key}", encode_value(value), ttl)
+        except (OSError, RedisError) as e:
+            print(f"Cache set failed: {e}")
+
+    def _add(self, key: str, value: bytes, ttl: float) -> bool:
+        try:
+            return self.backend.add(f"{KEY_PREFIX}:{key}", value, ttl)
+        except (OSError, RedisError) as e:
+            print(f"Cache add failed: {e}")
+            # Without a working lock, fetch independently
+            return True
+
+    # Responses are scoped by a snapshot version (int) or by a shard dependency
+    # token (str, see shards.py) that stays valid across versions until one of
+    # the shards the response covers changes
+
+    @staticmethod
+    def _scope(version: Union[int, str]) -> str:
+        return version if isinstance(version, str) else f"v{version}"
+
+    def _response_ttl(self, version: Union[int, str]) -> float:
+        return self.refresh_seconds * (SCOPED_TTL_REFRESHES if isinstance(version, str) else 2)
+
+    # Search response fragments
+
+    @classmethod
+    def search_key(cls, version: Union[int, str], latitude: float, longitude: float, radius: int,
+                   variant: str = "") -> str:
+        key = f"{cls._scope(version)}:search:{latitude!r}:{longitude!r}:{radius}"
+        return f"{key}:{variant}" if variant else key
+
+    def get_search(self, version: Union[int, str], latitude: float, longitude: float, radius: int,
+                   variant: str = "") -> Optional[Dict[str, Any]]:
+        value = self._get(self.search_key(version, latitude, longitude, radius, variant), "search")
+        return json.loads(value) if value is not None else None
+
+    def set_search(self, version: Union[int, str], latitude: float, longitude: float, radius: int,
+                   result: Dict[str, Any], variant: str = ""):
+        self._set(self.search_key(version, latitude, longitude, radius, variant),
+                  json.dumps(result, separators=(",", ":")).encode(), ttl=self._response_ttl(version))
+
+    # Binary search frames (frame.py); they embed the snapshot version, so only version scopes
+
+    def get_frame(self, version: int, latitude: float, longitude: float, radius: int,
+                  variant: str = "") -> Optional[bytes]:
+        return self._get(f"v{version}:frame:{latitude!r}:{longitude!r}:{radius}:{variant}", "frame")
+
+    def set_frame(self, version: int, latitude: float, longitude: float, radius: int, body: bytes,
+                  variant: str = ""):
+        self._set(f"v{version}:frame:{latitude!r}:{longitude!r}:{radius}:{variant}", body,
+                  ttl=self._response_ttl(version))
+
+    # Area search selections (area.encode_selection), keyed by a hash of the shape
+
+    def get_area(self, version: Union[int, str], digest: str) -> Optional[bytes]:
+        return self._get(f"{self._scope(version)}:area:{digest}", "area")
+
+    def set_area(self, version: Union[int, str], digest: str, body: bytes):
+        self._set(f"{self._scope(version)}:area:{digest}", body, ttl=self._response_ttl(version))
+
+    # Snapshots shared across instances
+
+    def interval(self, now: Optional[float] = None) -> int:
+        """Refresh interval number; doubles as the fleet-wide snapshot version"""
+        return int((time.time() if now is None else now) // self.refresh_seconds)
+
+    def get_snapshot(self, interval: int) -> Optional[Snapshot]:
+        value = self._get(f"snapshot:{interval}", "snapshot")
+        return Snapshot.from_buffer(value) if value is not None else None
+
+    def latest_snapshot(self) -> Optional[Snapshot]:
+        pointer = self._get("snapshot:latest", "snapshot_latest")
+        return self.get_snapshot(int(pointer)) if pointer is not None else None
+
+    def put_snapshot(self, snapshot: Snapshot) -> Snapshot:
+        """
+        Store a snapshot as its interval's fleet version unless another
+        instance already stored one, and return the stored snapshot. The first
+        write wins, so one interval number never names two different fetches.
+        """
+        ttl = self.refresh_seconds * 4
+        if not self._add(f"snapshot:{snapshot.version}", encode_value(snapshot.to_bytes()), ttl):
+            stored = self.get_snapshot(snapshot.version)
+            if stored is not None:
+                return stored
+        self._set("snapshot:latest", str(snapshot.version).encode(), ttl)
+        return snapshot
+
+    def shared_fetch(self, fetch: Callable[[], Optional[Snapshot]],
+                     wait_seconds: float = 10.0, poll_seconds: float = 0.2) -> Callable[[], Optional[Snapshot]]:
+        """Wrap an upstream fetch so one instance per refresh interval calls it"""
+
+        def fetch_once() -> Optional[Snapshot]:
+            interval = self.interval()
+            snapshot = self.get_snapshot(interval)
+            if snapshot is not None:
+                return snapshot
+
+            if self._add(f"lock:fetch:{interval}", str(os.getpid()).encode(), ttl=self.refresh_seconds):
+                return publish(fetch(), interval)
+
+            # Another instance is fetching this interval; wait for it to publish
+            deadline = time.monotonic() + wait_seconds
+            while time.monotonic() < deadline:
+                time.sleep(poll_seconds)
+                snapshot = self.get_snapshot(interval)
+                if snapshot is not None:
+                    return snapshot
+            # It stalled: fetch here, but under the fleet numbering, so the
+            # version cannot collide with one another instance publishes
+            return publish(fetch(), interval) or self.latest_snapshot()
+
+        def publish(snapshot: Optional[Snapshot], interval: int) -> Optional[Snapshot]:
+            if snapshot is None:
+                return None
+            return self.put_snapshot(snapshot.with_version(interval, self.fleet_epoch))
+
+        return fetch_once
+
+
+def create_cache(refresh_seconds: float) -> ParkingCache:
+    """Redis-backed cache when PARKING_CACHE_URL is set, otherwise in-process"""
+    url = os.getenv("PARKING_CACHE_URL")
+    if not url:
+        return ParkingCache(InProcessCache(), refresh_seconds)
+    if urlparse(url).scheme != "redis":
+        raise ValueError(f"Unsupported PARKING_CACHE_URL {url!r}; expected redis://host:port/db")
+    return ParkingCache(RedisCache(url), refresh_seconds)
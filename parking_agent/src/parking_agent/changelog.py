@@ -0,0 +1,124 @@
+"""
+Melbourne Parking Agent - Changelog
+Bounded history of snapshot diffs for incremental sync clients.
+
+Each installed snapshot appends one entry to a ring: the version it replaced
+and the kerbsideids that changed status, moved, appeared or left the feed. A client
+that mirrors availability polls GET /parking/changes?since=<version> and gets
+the current state of only the bays touched after that version, so a poll costs
+O(changes) instead of O(dataset). Versions older than the ring (or never seen
+by this worker) are answered with a resync instruction; the client then
+reloads everything by calling the endpoint without `since`.
+
+Versions are exchanged as snapshot tokens, "<epoch>:<version>". Without a
+shared cache each instance numbers its own versions, so behind a load balancer
+a bare number from one instance would match an unrelated version on another;
+the epoch makes such a `since` unknown, which triggers a resync instead of a
+wrong delta.
+"""
+
+import itertools
+import os
+import threading
+from array import array
+from collections import deque
+from typing import Deque, NamedTuple, Optional, Set
+
+from parking_agent import metrics
+from parking_agent.snapshot import MISSING_BAY_ID, Snapshot
+from parking_agent.streaming import bay_json
+
+# At the default 30 s refresh this keeps an hour of changes
+DEFAULT_MAX_VERSIONS = int(os.getenv("PARKING_CHANGELOG_VERSIONS", "120"))
+
+CHANGES_REQUESTS = metrics.Counter("parking_changes_requests", "Incremental sync requests", ["result"])
+
+
+class ChangeEntry(NamedTuple):
+    # Snapshot tokens of the replaced and the new version
+    previous_version: str
+    version: str
+    # kerbsideids whose status or coordinates changed, or that are new in `version`
+    changed: array
+    # kerbsideids no longer in the feed at `version`
+    removed: array
+
+
+class ResyncRequired(Exception):
+    """The requested version is no longer (or was never) covered by the log"""
+
+    def __init__(self, since: str, oldest_version: Optional[str], version: Optional[str]):
+        super().__init__(f"version {since} is not covered by the changelog")
+        self.since = since
+        self.oldest_version = oldest_version
+        self.version = version
+
+
+class ChangeLog:
+    """Ring of per-version change sets, fed by SnapshotStore listeners"""
+
+    def __init__(self, max_versions: int = DEFAULT_MAX_VERSIONS):
+        self.entries: Deque[ChangeEntry] = deque(maxlen=max_versions)
+        self.snapshot: Optional[Snapshot] = None
+        self._lock = threading.Lock()
+
+    @property
+    def oldest_version(self) -> Optional[str]:
+        """Oldest `since` value that can still be answered incrementally"""
+        if self.entries:
+            return self.entries[0].previous_version
+        return self.snapshot.token if self.snapshot is not None else None
+
+    def on_snapshot(self, previous: Optional[Snapshot], current: Snapshot):
+        """Store listener: record the diff against the previously installed version"""
+        if previous is None:
+            with self._lock:
+                self.snapshot = current
+            return
+
+        diff = current.diff(previous)
+        bay_ids = current.bay_ids
+        rows = diff.changed_rows
+        if diff.moved:
+            rows = list(dict.fromkeys(itertools.chain(rows, (row for row, _lat, _lon in diff.moved))))
+        changed = array('q', (bay_ids[row] for row in rows if bay_ids[row] != MISSING_BAY_ID))
+        removed = array('q', (bay_id for bay_id, _lat, _lon in diff.removed))
+        with self._lock:
+            # A break in the chain of versions makes the older entries unusable
+            if self.snapshot is not None and self.snapshot.token != previous.token:
+                self.entries.clear()
+            self.entries.append(ChangeEntry(previous.token, current.token, changed, removed))
+            self.snapshot = current
+
+    def changes_since(self, since: str) -> str:
+        """JSON body with the current state of bays touched after the snapshot token `since`"""
+        with self._lock:
+            snapshot = self.snapshot
+            if snapshot is None:
+                raise ResyncRequired(since, None, None)
+            if since == snapshot.token:
+                return '{"version":"%s","since":"%s","bays":[],"removed":[]}' % (since, since)
+
+            entries = list(self.entries)
+            start = next((i for i, entry in enumerate(entries) if entry.previous_version == since), None)
+            if start is None:
+                raise ResyncRequired(since, self.oldest_version, snapshot.token)
+
+        changed: Set[int] = set()
+        removed: Set[int] = set()
+        for entry in entries[start:]:
+            changed.update(entry.changed)
+            removed.difference_update(entry.changed)
+            removed.update(entry.removed)
+            changed.difference_update(entry.removed)
+
+        rows = snapshot.row_by_bay
+        bays = [bay_json(snapshot, rows[bay_id]) for bay_id in changed if bay_id in rows]
+        return '{"version":"%s","since":"%s","bays":[%s],"removed":[%s]}' % (
+            snapshot.token, since, ",".join(bays), ",".join('"%d"' % bay_id for bay_id in removed))
+
+
+def full_state(snapshot: Snapshot) -> str:
+    """JSON body with every bay in the snapshot, the starting point for a mirror"""
+    bays = [bay_json(snapshot, row) for row in range(len(snapshot))]
+    return '{"version":"%s","since":null,"bays":[%s],"removed":[]}' % (snapshot.token, ",".join(bays))
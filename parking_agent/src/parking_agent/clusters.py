@@ -0,0 +1,177 @@
+"""
+Melbourne Parking Agent - Bay Clusters
+Groups of adjacent bays along the same stretch of kerb, precomputed per snapshot.
+
+The sensor feed carries no street segment id, so segments are recovered from
+positions: bays closer than LINK_METERS are joined (union-find over the grid
+index), and a join is refused when the merged group would span more than
+MAX_SPAN_METERS, which keeps a long street split into block-sized runs.
+Positions rarely change between refreshes, so the labels are reused for as
+long as the bay ids and coordinates are identical; only the per-cluster free
+counts are recomputed for each snapshot.
+
+Grouped searches collapse their nearest results to one entry per cluster: the
+nearest free bay, with the cluster's free counts and centroid.
+"""
+
+import threading
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from parking_agent import metrics
+from parking_agent.snapshot import Snapshot
+from parking_agent.spatial import METERS_PER_DEGREE_LAT, METERS_PER_DEGREE_LON, GridIndex
+
+LINK_METERS = 12.0
+MAX_SPAN_METERS = 120.0
+
+CLUSTER_BUILDS = metrics.Counter("parking_cluster_builds", "Bay cluster computations", ["result"])
+
+
+def cluster_labels(lats: Sequence[float], lons: Sequence[float]) -> array:
+    """Cluster number per row (-1 for rows without coordinates)"""
+    count = len(lats)
+    parent = list(range(count))
+    # Bounding box per root: [min_lat, min_lon, max_lat, max_lon]
+    boxes: Dict[int, List[float]] = {}
+    rows = [row for row in range(count) if lats[row] == lats[row]]
+    for row in rows:
+        boxes[row] = [lats[row], lons[row], lats[row], lons[row]]
+
+    def find(row: int) -> int:
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+        return row
+
+    max_dlat = MAX_SPAN_METERS / METERS_PER_DEGREE_LAT
+    max_dlon = MAX_SPAN_METERS / METERS_PER_DEGREE_LON
+    link2 = LINK_METERS * LINK_METERS
+    grid = GridIndex.from_points(lats, lons, rows, cell_meters=LINK_METERS)
+    # Visit bays in position order so long runs split at the same places every time
+    rows.sort(key=lambda row: (lats[row], lons[row]))
+    for row in rows:
+        lat, lon = lats[row], lons[row]
+        for other in grid.query_radius(lat, lon, LINK_METERS):
+            if other == row:
+                continue
+            dy = (lats[other] - lat) * METERS_PER_DEGREE_LAT
+            dx = (lons[other] - lon) * METERS_PER_DEGREE_LON
+            if dx * dx + dy * dy > link2:
+                continue
+            a, b = find(row), find(other)
+            if a == b:
+                continue
+            box_a, box_b = boxes[a], boxes[b]
+            merged = [min(box_a[0], box_b[0]), min(box_a[1], box_b[1]),
+                      max(box_a[2], box_b[2]), max(box_a[3], box_b[3])]
+            if merged[2] - merged[0] > max_dlat or merged[3] - merged[1] > max_dlon:
+                continue
+            parent[b] = a
+            boxes[a] = merged
+
+    labels = array('i', [-1]) * count
+    numbers: Dict[int, int] = {}
+    for row in rows:
+        root = find(row)
+        number = numbers.get(root)
+        if number is None:
+            number = numbers[root] = len(numbers)
+        labels[row] = number
+    return labels
+
+
+class Clusters:
+    """Cluster labels plus per-cluster centroids, sizes and free counts for one snapshot"""
+
+    def __init__(self, snapshot: Snapshot, labels: array, centroids: List[Tuple[float, float]], sizes: array):
+        self.version = snapshot.version
+        self.labels = labels
+        self.centroids = centroids
+        self.sizes = sizes
+        free = array('I', bytes(4 * len(sizes)))
+        for row in snapshot.free_rows:
+            label = labels[row]
+            if label >= 0:
+                free[label] += 1
+        self.free = free
+
+    @classmethod
+    def build(cls, snapshot: Snapshot, labels: Optional[array] = None) -> "Clusters":
+        if labels is None:
+            labels = cluster_labels(snapshot.lats, snapshot.lons)
+        clusters = max(labels, default=-1) + 1
+        sums = [[0.0, 0.0] for _ in range(clusters)]
+        sizes = array('I', bytes(4 * clusters))
+        lats, lons = snapshot.lats, snapshot.lons
+        for row, label in enumerate(labels):
+            if label >= 0:
+                sums[label][0] += lats[row]
+                sums[label][1] += lons[row]
+                sizes[label] += 1
+        centroids = [(lat / size, lon / size) for (lat, lon), size in zip(sums, sizes)]
+        return cls(snapshot, labels, centroids, sizes)
+
+    def group(self, candidates: Sequence[Tuple[int, int]], limit: int = 20) -> List[Tuple[int, int, int, int]]:
+        """
+        Collapse the `limit` nearest of the (distance, row) candidates, sorted
+        nearest first, into (distance, row, cluster, free in candidates) for the
+        nearest bay of each cluster. Counts cover every candidate, not just the
+        nearest `limit`.
+        """
+        labels = self.labels
+        grouped: List[List[int]] = []
+        position: Dict[int, int] = {}
+        for distance, row in candidates[:limit]:
+            label = labels[row]
+            if label < 0:
+                grouped.append([distance, row, label, 1])
+            elif label not in position:
+                position[label] = len(grouped)
+                grouped.append([distance, row, label, 0])
+        for _distance, row in candidates:
+            index = position.get(labels[row])
+            if index is not None:
+                grouped[index][3] += 1
+        return [tuple(entry) for entry in grouped]
+
+    def describe(self, label: int, free_nearby: int) -> Dict[str, object]:
+        if label < 0:
+            return {"free_nearby": free_nearby, "free": free_nearby, "bays": 1}
+        lat, lon = self.centroids[label]
+        return {
+            "free_nearby": free_nearby,
+            "free": self.free[label],
+            "bays": self.sizes[label],
+            "latitude": round(lat, 6),
+            "longitude": round(lon, 6),
+        }
+
+
+class ClusterCache:
+    """Clusters for the latest snapshot; labels are reused while bay positions are unchanged"""
+
+    def __init__(self):
+        self._clusters: Optional[Clusters] = None
+        self._positions: Optional[Tuple[bytes, bytes, bytes]] = None
+        self._lock = threading.Lock()
+
+    def on_snapshot(self, previous: Optional[Snapshot], current: Snapshot):
+        """Store listener: cluster the new version once"""
+        self.get(current)
+
+    def get(self, snapshot: Snapshot) -> Clusters:
+        clusters = self._clusters
+        if clusters is not None and clusters.version == snapshot.version:
+            return clusters
+        with self._lock:
+            clusters = self._clusters
+            if clusters is not None and clusters.version == snapshot.version:
+                return clusters
+            positions = (bytes(snapshot.bay_ids), bytes(snapshot.lats), bytes(snapshot.lons))
+            reuse = clusters is not None and positions == self._positions
+            clusters = Clusters.build(snapshot, clusters.labels if reuse else None)
+            CLUSTER_BUILDS.labels("reused" if reuse else "clustered").inc()
+            if self._clusters is None or snapshot.version >= self._clusters.version:
+                self._clusters, self._positions = clusters, positions
+            return clusters
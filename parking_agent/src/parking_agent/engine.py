@@ -0,0 +1,499 @@
+"""
+Melbourne Parking Agent - Search Engine
+Fetches Melbourne parking sensor data and ranks available bays by distance.
+
+This module must stay free of crewAI imports: the HTTP API loads it directly
+so that cold starts do not pull in the crewAI/LangChain/LiteLLM stack. The
+crewAI tool in tools/parking_tool.py is a thin adapter over ParkingEngine.
+"""
+
+import requests
+import math
+import time
+from bisect import bisect_right
+from datetime import datetime
+import pytz
+from typing import List, Dict, Any, Optional, Sequence, Tuple, TYPE_CHECKING
+from parking_agent import frame, freshness, metrics, tracing
+from parking_agent.clusters import MAX_SPAN_METERS
+from parking_agent.snapshot import Snapshot, SnapshotStore
+from parking_agent.walking import RERANK_CANDIDATES
+
+if TYPE_CHECKING:
+    from parking_agent.cache import ParkingCache
+    from parking_agent.clusters import ClusterCache
+    from parking_agent.restrictions import RestrictionIndex, SearchFilters
+    from parking_agent.shards import ShardIndex
+    from parking_agent.walking import StreetGraph
+
+# Pre-resolved metric series so the hot path skips label lookups
+_STAGE = {
+    stage: metrics.SEARCH_STAGE_SECONDS.labels(stage)
+    for stage in ("fetch", "filter", "distance", "sort", "walking", "convert", "html", "total")
+}
+
+MELBOURNE_TZ = pytz.timezone('Australia/Melbourne')
+
+class ParkingEngine:
+    """Parking spot search over Melbourne's on-street bay sensor feed"""
+
+    def __init__(self, store: Optional[SnapshotStore] = None, cache: Optional["ParkingCache"] = None,
+                 restrictions: Optional["RestrictionIndex"] = None, streets: Optional["StreetGraph"] = None,
+                 clusters: Optional["ClusterCache"] = None, shards: Optional["ShardIndex"] = None):
+        # Without a store every search fetches a fresh snapshot (CLI / crewAI tool)
+        self.store = store
+        # Optional response cache keyed by snapshot version and query
+        self.cache = cache
+        # Optional bay restrictions joined by kerbsideid, for filtered searches
+        self.restrictions = restrictions
+        # Optional street graph for ranking by walking distance
+        self.streets = streets
+        # Optional per-snapshot bay clusters, for grouped results
+        self.clusters = clusters
+        # Optional per-shard change versions, so cached results survive changes elsewhere
+        self.shards = shards
+
+    def fetch_snapshot(self) -> Optional[Snapshot]:
+        """Fetch the feed and build a columnar snapshot; None if the fetch failed"""
+        records = self._fetch_parking_data()
+        if not records:
+            return None
+        return Snapshot.from_records(records)
+
+    def current_snapshot(self) -> Optional[Snapshot]:
+        """Latest snapshot from the store, fetching synchronously if none is loaded yet"""
+        if self.store is None:
+            return self.fetch_snapshot()
+        return self.store.ensure()
+
+    def search(self, latitude: float, longitude: float, radius: int = 500,
+               filters: Optional["SearchFilters"] = None, walking: bool = False,
+               rings: Optional[Sequence[int]] = None, ring_samples: int = 0,
+               group: bool = False, prefer_fresh: bool = True,
+               max_staleness: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Find available parking spots near the given coordinates.
+
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            radius: Search radius in meters (default: 500)
+            filters: Optional restriction filters (needs restriction data)
+            walking: Rank by street-graph walking distance (needs a street graph)
+            rings: Optional radii for cumulative free-bay counts ("rings" in the result)
+            ring_samples: Nearest bays to include per ring
+            group: One result per cluster of adjacent bays (needs clusters)
+            prefer_fresh: Rank recently reported bays ahead of stale ones at similar distances
+            max_staleness: Only bays whose sensor reported within this many seconds
+
+        Returns:
+            Dict with status, message, parking_spots and html_table
+        """
+        try:
+            started = time.perf_counter()
+
+            # Latest snapshot of the Melbourne parking feed
+            snapshot = self.current_snapshot()
+            mark = self._observe_stage("fetch", started)
+
+            if not snapshot:
+                return {
+                    "status": "error",
+                    "message": "cant fetch parking data from API",
+                    "parking_spots": [],
+                    "html_table": ""
+                }
+            tracing.annotate("snapshot.version", snapshot.version)
+
+            filtered = filters is not None and filters.active and self.restrictions is not None
+            walking = walking and self.streets is not None
+            rings = sorted(set(rings)) if rings else None
+            group = group and self.clusters is not None
+            variant = self._variant(filters if filtered else None, walking, rings, ring_samples, group,
+                                    prefer_fresh, max_staleness)
+            scope = snapshot.version
+            if self.cache is not None:
+                # Sensor ages change with every fetch without showing in the diff, so
+                # freshness-ranked and staleness-filtered results stay per version
+                if self.shards is not None and not prefer_fresh and max_staleness is None:
+                    # Grouped results also report the free counts of whole clusters
+                    reach = max([radius, *(rings or ())]) + (MAX_SPAN_METERS if group else 0)
+                    scope = self.shards.token(snapshot, snapshot.grid.radius_bbox(latitude, longitude, reach)) or scope
+                cached = self.cache.get_search(scope, latitude, longitude, radius, variant)
+                if cached is not None and isinstance(scope, str):
+                    # A shard token outlives versions: keep the selection, re-read the bays
+                    cached = self._refresh_spots(snapshot, cached, filters.at_time if filtered else None)
+                if cached is not None:
+                    self._observe_stage("total", started)
+                    return cached
+
+            result = self._search_snapshot(snapshot, latitude, longitude, radius, started, mark,
+                                           filters if filtered else None, walking, rings, ring_samples, group,
+                                           prefer_fresh, max_staleness)
+            if self.cache is not None and result["status"] != "error":
+                self.cache.set_search(scope, latitude, longitude, radius, result, variant)
+            return result
+
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"API call failed: {str(e)}",
+                "parking_spots": [],
+                "html_table": ""
+            }
+
+    @staticmethod
+    def _variant(filters: Optional["SearchFilters"], walking: bool, rings: Optional[Sequence[int]],
+                 ring_samples: int, group: bool, prefer_fresh: bool, max_staleness: Optional[float]) -> str:
+        """Cache key suffix for the search options that change the result"""
+        return ":".join(part for part in (
+            filters.key() if filters is not None else "",
+            "walk" if walking else "",
+            f"rings{'-'.join(map(str, rings))}s{ring_samples}" if rings else "",
+            "group" if group else "",
+            "fresh" if prefer_fresh else "",
+            f"stale{max_staleness:g}" if max_staleness is not None else "",
+        ) if part)
+
+    def search_frame(self, snapshot: Snapshot, latitude: float, longitude: float, radius: int,
+                     filters: Optional["SearchFilters"] = None, walking: bool = False,
+                     prefer_fresh: bool = True, max_staleness: Optional[float] = None) -> bytes:
+        """
+        Binary frame (see frame.py) of the nearest free bays. Frames carry the
+        snapshot version in their header, so they are cached per version and
+        never under a shard token.
+        """
+        filters = filters if filters is not None and filters.active and self.restrictions is not None else None
+        walking = walking and self.streets is not None
+        variant = self._variant(filters, walking, None, 0, False, prefer_fresh, max_staleness)
+        if self.cache is not None:
+            cached = self.cache.get_frame(snapshot.version, latitude, longitude, radius, variant)
+            if cached is not None:
+                return cached
+        candidates = self.nearest_free(snapshot, latitude, longitude, radius, filters=filters, walking=walking,
+                                       prefer_fresh=prefer_fresh, max_staleness=max_staleness)
+        metrics.SEARCH_RESULTS.observe(len(candidates))
+        body = frame.encode_frame(snapshot, candidates)
+        if self.cache is not None:
+            self.cache.set_frame(snapshot.version, latitude, longitude, radius, body, variant)
+        return body
+
+    def nearest_free(self, snapshot: Snapshot, latitude: float, longitude: float, radius: int,
+                     limit: Optional[int] = 20, mark: Optional[float] = None,
+                     filters: Optional["SearchFilters"] = None, walking: bool = False,
+                     prefer_fresh: bool = False, max_staleness: Optional[float] = None) -> List[Tuple[int, int]]:
+        """
+        (distance meters, row) of the closest free bays within the radius, nearest
+        first; limit None keeps every bay in the radius. With `walking`, the
+        nearest straight-line candidates are re-ranked by walking distance over
+        the street graph. `prefer_fresh` blends the order with sensor age and
+        `max_staleness` drops bays whose sensor has not reported recently.
+        """
+        mark = time.perf_counter() if mark is None else mark
+        if filters is not None and self.restrictions is not None:
+            # Free bays allowed by the restriction filters, from precomputed masks
+            rows = self.restrictions.free_rows(snapshot, filters)
+        else:
+            # Filter for unoccupied spots only
+            rows = None if max_staleness is not None else snapshot.free_rows
+        if max_staleness is not None:
+            # Update-ordered index: a bisect instead of a pass over every free bay
+            rows = freshness.fresh_rows(snapshot, max_staleness, rows)
+
+        mark = self._observe_stage("filter", mark)
+
+        # Calculate distances and filter by radius
+        lats = snapshot.lats
+        lons = snapshot.lons
+        candidates = []
+        for row in rows:
+            distance = self._calculate_distance(latitude, longitude, lats[row], lons[row])
+            if distance <= radius:
+                candidates.append((int(round(distance)), row))
+        mark = self._observe_stage("distance", mark)
+
+        # Sort by distance (closest first) and limit to top 20 results
+        candidates.sort(key=lambda x: x[0])
+        if walking and self.streets is not None:
+            mark = self._observe_stage("sort", mark)
+            candidates = self.streets.rerank(latitude, longitude, candidates, lats, lons, radius,
+                                             RERANK_CANDIDATES if prefer_fresh else limit)
+            if prefer_fresh:
+                candidates = freshness.rank(snapshot, candidates)[:limit]
+            self._observe_stage("walking", mark)
+            return candidates
+        if prefer_fresh:
+            candidates = freshness.rank(snapshot, candidates)
+        candidates = candidates[:limit]
+        self._observe_stage("sort", mark)
+        return candidates
+
+    def _search_snapshot(self, snapshot: Snapshot, latitude: float, longitude: float, radius: int,
+                         started: float, mark: float, filters: Optional["SearchFilters"] = None,
+                         walking: bool = False, rings: Optional[Sequence[int]] = None,
+                         ring_samples: int = 0, group: bool = False, prefer_fresh: bool = True,
+                         max_staleness: Optional[float] = None) -> Dict[str, Any]:
+        """Rank the free bays of one snapshot by distance"""
+        at_time = filters.at_time if filters is not None else None
+        ring_counts = None
+        grouped = None
+        if rings or group:
+            # One sorted pass out to the widest ring serves every ring and the results
+            everything = self.nearest_free(snapshot, latitude, longitude, max([radius, *(rings or ())]),
+                                           limit=None, mark=mark, filters=filters, max_staleness=max_staleness)
+            if rings:
+                ring_counts = self._rings(snapshot, everything, rings, ring_samples, at_time)
+            candidates = [candidate for candidate in everything if candidate[0] <= radius]
+            if walking:
+                keep = len(candidates) if group else RERANK_CANDIDATES if prefer_fresh else 20
+                candidates = self.streets.rerank(latitude, longitude, candidates, snapshot.lats, snapshot.lons,
+                                                 radius, keep)
+            if prefer_fresh:
+                candidates = freshness.rank(snapshot, candidates)
+            if group:
+                clusters = self.clusters.get(snapshot)
+                grouped = clusters.group(candidates)
+                candidates = [(distance, row) for distance, row, _label, _free in grouped]
+            else:
+                candidates = candidates[:20]
+        else:
+            candidates = self.nearest_free(snapshot, latitude, longitude, radius, mark=mark, filters=filters,
+                                           walking=walking, prefer_fresh=prefer_fresh, max_staleness=max_staleness)
+        mark = time.perf_counter()
+
+        # Convert timestamps only for the spots we return
+        nearby_spots = [self._spot(snapshot, row, distance_meters, at_time) for distance_meters, row in candidates]
+        if grouped is not None:
+            for spot, (_distance, _row, label, free_nearby) in zip(nearby_spots, grouped):
+                spot['cluster'] = clusters.describe(label, free_nearby)
+        mark = self._observe_stage("convert", mark)
+        metrics.SEARCH_RESULTS.observe(len(nearby_spots))
+
+        if not nearby_spots:
+            _STAGE["total"].observe(mark - started)
+            result = {
+                "status": "no_results",
+                "message": "currently no available spots within the radius, consider expanding the search area.",
+                "parking_spots": [],
+                "html_table": ""
+            }
+            if ring_counts is not None:
+                result["rings"] = ring_counts
+            return result
+
+        # Generate HTML table
+        html_table = self._generate_html_table(nearby_spots)
+        mark = self._observe_stage("html", mark)
+        _STAGE["total"].observe(mark - started)
+
+        result = {
+            "status": "success",
+            "message": f"found {len(nearby_spots)} available parking spots",
+            "parking_spots": nearby_spots,
+            "html_table": html_table
+        }
+        if ring_counts is not None:
+            result["rings"] = ring_counts
+        return result
+
+    def _refresh_spots(self, snapshot: Snapshot, result: Dict[str, Any],
+                       at_time: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        A cached result with every spot rebuilt from `snapshot`, keeping its
+        distance and cluster; None when a spot cannot be found by its bay id.
+        Times, ages and restriction text are those of the current snapshot.
+        """
+        row_by_bay = snapshot.row_by_bay
+
+        def refresh(spots):
+            fresh = []
+            for spot in spots:
+                row = row_by_bay.get(int(spot['bay_id'])) if spot['bay_id'] != 'N/A' else None
+                if row is None:
+                    return None
+                updated = self._spot(snapshot, row, spot['distance_meters'], at_time)
+                if 'cluster' in spot:
+                    updated['cluster'] = spot['cluster']
+                fresh.append(updated)
+            return fresh
+
+        spots = refresh(result.get('parking_spots', []))
+        if spots is None:
+            return None
+        result = dict(result, parking_spots=spots)
+        if spots:
+            result['html_table'] = self._generate_html_table(spots)
+        if 'rings' in result:
+            rings = []
+            for ring in result['rings']:
+                if 'nearest' in ring:
+                    nearest = refresh(ring['nearest'])
+                    if nearest is None:
+                        return None
+                    ring = dict(ring, nearest=nearest)
+                rings.append(ring)
+            result['rings'] = rings
+        return result
+
+    def _rings(self, snapshot: Snapshot, candidates: List[Tuple[int, int]], rings: Sequence[int],
+               samples: int = 0, at_time: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Cumulative free counts per ascending radius from (distance, row) sorted nearest first"""
+        distances = [distance for distance, _row in candidates]
+        counts = []
+        start = 0
+        for radius in rings:
+            end = bisect_right(distances, radius)
+            ring: Dict[str, Any] = {"radius": radius, "free": end}
+            if samples:
+                # Nearest bays between the previous ring and this one
+                ring["nearest"] = [self._spot(snapshot, row, distance, at_time)
+                                   for distance, row in candidates[start:min(end, start + samples)]]
+            counts.append(ring)
+            start = end
+        return counts
+
+    def _spot(self, snapshot: Snapshot, row: int, distance_meters: int,
+              at_time: Optional[float] = None) -> Dict[str, Any]:
+        """Result dict for one snapshot row"""
+        spot_lat = snapshot.lats[row]
+        spot_lon = snapshot.lons[row]
+        age = freshness.age_seconds(snapshot, row)
+        spot = {
+            'bay_id': snapshot.bay_id(row),
+            'status': snapshot.status_name(row),
+            'distance_meters': distance_meters,
+            'status_time': self._format_melbourne_time(snapshot.status_ts[row]),
+            'updated_time': self._format_melbourne_time(snapshot.updated_ts[row]),
+            'age_seconds': None if age is None else int(age),
+            'freshness': round(freshness.score(age), 2),
+            'google_maps_link': f"https://www.google.com/maps/?q={spot_lat},{spot_lon}",
+            'latitude': spot_lat,
+            'longitude': spot_lon
+        }
+        if self.restrictions is not None:
+            spot['restriction'] = self.restrictions.describe(snapshot.bay_ids[row], at_time)
+        return spot
+
+    def _observe_stage(self, stage: str, since: float) -> float:
+        """Record the time spent in a search stage and return the new mark"""
+        now = time.perf_counter()
+        _STAGE[stage].observe(now - since)
+        tracing.record_span(stage, since, now)
+        return now
+
+    def _fetch_parking_data(self) -> List[Dict[str, Any]]:
+        """Fetch parking data from Melbourne API"""
+        started = time.perf_counter()
+        try:
+            # Melbourne parking API endpoint - sorted by most recent status timestamp for real-time data
+            url = "https://data.melbourne.vic.gov.au/api/explore/v2.1/catalog/datasets/on-street-parking-bay-sensors/records?limit=100&order_by=-status_timestamp"
+
+            headers = {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+            }
+
+            response = requests.get(url, headers=headers, timeout=30)
+            response.raise_for_status()
+            metrics.UPSTREAM_FETCH_SECONDS.labels("success").observe(time.perf_counter() - started)
+            metrics.UPSTREAM_FETCH_BYTES.observe(len(response.content))
+            tracing.annotate("upstream.bytes", len(response.content))
+
+            data = response.json()
+            records = data.get('results', [])
+            print(f"Fetched {len(records)} parking records")
+
+            # Extract the actual record data
+            parking_spots = []
+            for record in records:
+                if isinstance(record, dict):
+                    parking_spots.append(record)
+
+            tracing.annotate("upstream.records", len(parking_spots))
+            return parking_spots
+
+        except requests.RequestException as e:
+            metrics.UPSTREAM_FETCH_SECONDS.labels("error").observe(time.perf_counter() - started)
+            print(f"API request failed: {e}")
+            print(f"URL was: {url}")
+            return []
+        except Exception as e:
+            print(f"Data processing error: {e}")
+            return []
+
+    def _calculate_distance(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+        """
+        Calculate the distance between two points using the Haversine formula.
+        Returns distance in meters.
+        """
+        # Convert latitude and longitude from degrees to radians
+        lat1_rad = math.radians(lat1)
+        lon1_rad = math.radians(lon1)
+        lat2_rad = math.radians(lat2)
+        lon2_rad = math.radians(lon2)
+
+        # Haversine formula
+        dlat = lat2_rad - lat1_rad
+        dlon = lon2_rad - lon1_rad
+
+        a = (math.sin(dlat/2)**2 +
+             math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2)
+
+        c = 2 * math.asin(math.sqrt(a))
+
+        # Earth's radius in meters
+        earth_radius = 6371000
+
+        distance = earth_radius * c
+        return distance
+
+    def _format_melbourne_time(self, timestamp: float) -> str:
+        """Convert a Unix timestamp to Melbourne local time"""
+        if timestamp != timestamp:  # NaN: missing in the feed
+            return "N/A"
+        return datetime.fromtimestamp(timestamp, MELBOURNE_TZ).strftime('%Y-%m-%d %H:%M:%S %Z')
+
+    @staticmethod
+    def _cluster_note(spot: Dict[str, Any]) -> str:
+        cluster = spot.get('cluster')
+        if not cluster or cluster['free_nearby'] < 2:
+            return ""
+        return f" (+{cluster['free_nearby'] - 1} free on this block)"
+
+    def _generate_html_table(self, spots: List[Dict[str, Any]]) -> str:
+        """Generate HTML table for parking spots"""
+        if not spots:
+            return "<p>No parking spots found</p>"
+
+        html = """
+        <table>
+            <thead>
+                <tr>
+                    <th>Bay ID</th>
+                    <th>Status</th>
+                    <th>Distance</th>
+                    <th>Status Time</th>
+                    <th>Last Updated</th>
+                    <th>Google Maps</th>
+                </tr>
+            </thead>
+            <tbody>
+        """
+
+        for spot in spots:
+            html += f"""
+                <tr>
+                    <td>{spot['bay_id']}{self._cluster_note(spot)}</td>
+                    <td>{spot['status']}</td>
+                    <td>{spot['distance_meters']}m</td>
+                    <td>{spot['status_time']}</td>
+                    <td>{spot['updated_time']}</td>
+                    <td><a href="{spot['google_maps_link']}" target="_blank">🗺️ Maps</a></td>
+                </tr>
+            """
+
+        html += """
+            </tbody>
+        </table>
+        """
+
+        return html
\ No newline at end of file
@@ -0,0 +1,247 @@
+"""
+Melbourne Parking Agent - Occupancy Forecast
+Day-of-week / hour free-probability tables, kept per bay and per grid cell.
+
+For every bay the model accumulates, in each of the 168 local week hours, how
+many seconds the bay was observed free and how many it was observed at all.
+The tables are flat typed arrays (one row of 168 per bay or cell) updated
+incrementally: a status transition credits the time since the bay's previous
+transition to its previous status, and once an hour every bay is credited up
+to the hour boundary. A forecast is then a few array lookups per bay; no
+history is scanned at request time.
+
+The predicted free probability for an arrival time blends the bay's current
+status (decaying with the time until arrival) with its historical rate for
+that week hour, shrunk towards its grid cell's rate when the bay has little
+data of its own.
+"""
+
+import math
+import threading
+import time
+from array import array
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from parking_agent import metrics
+from parking_agent.engine import MELBOURNE_TZ
+from parking_agent.snapshot import MISSING_BAY_ID, STATUS_FREE, STATUS_UNKNOWN, Snapshot
+from parking_agent.spatial import GridIndex, haversine_meters
+
+WEEK_HOURS = 7 * 24
+
+# Seconds of observations at which a bay's own rate outweighs its cell's
+PRIOR_SECONDS = 1800.0
+# Minutes over which the current status stops being informative
+CURRENT_STATUS_DECAY_MINUTES = 30.0
+# Rate used before anything has been observed
+DEFAULT_FREE_RATE = 0.3
+# Longest stretch credited at once; older sensor timestamps add nothing new per week hour
+MAX_CREDIT_SECONDS = 7 * 86400.0
+
+FORECAST_UPDATE_SECONDS = metrics.Histogram(
+    "parking_forecast_update_seconds", "Time to fold one snapshot into the forecast tables")
+
+
+@lru_cache(maxsize=4096)
+def week_hour(hour_number: int) -> int:
+    """Local (Melbourne) week hour 0..167, Monday 00:00 first, of a Unix hour number"""
+    local = datetime.fromtimestamp(hour_number * 3600, MELBOURNE_TZ)
+    return local.weekday() * 24 + local.hour
+
+
+class RateTable:
+    """
+    Free / observed seconds per (key, week hour) in flat float arrays.
+
+    Writers hold the model lock; readers do not. A key is only published in
+    `keys` once its rows exist, so a reader that finds a slot can index it.
+    """
+
+    def __init__(self):
+        self.keys: Dict = {}
+        self.free = array('f')
+        self.observed = array('f')
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def slot(self, key) -> int:
+        slot = self.keys.get(key)
+        if slot is None:
+            slot = len(self.keys)
+            self.free.frombytes(bytes(self.free.itemsize * WEEK_HOURS))
+            self.observed.frombytes(bytes(self.observed.itemsize * WEEK_HOURS))
+            self.keys[key] = slot
+        return slot
+
+    def rate(self, slot: Optional[int], hour: int, prior: float, prior_seconds: float = PRIOR_SECONDS) -> float:
+        if slot is None:
+            return prior
+        i = slot * WEEK_HOURS + hour
+        return (self.free[i] + prior * prior_seconds) / (self.observed[i] + prior_seconds)
+
+
+class ForecastModel:
+    """Incrementally maintained week-hour occupancy rates for bays and grid cells"""
+
+    def __init__(self, cell_meters: float = 250.0):
+        self.grid = GridIndex(cell_meters)
+        self.bays = RateTable()
+        self.cells = RateTable()
+        # Per bay slot: cell slot, time and status of the last transition
+        self.bay_cell = array('I')
+        self.last_epoch = array('d')
+        self.last_status = array('B')
+        self._swept_hour = 0
+        self._lock = threading.Lock()
+
+    def _bay_slot(self, bay_id: int, lat: float, lon: float) -> int:
+        slot = self.bays.keys.get(bay_id)
+        if slot is None:
+            # Per-slot arrays first: forecast() reads bay_cell[slot] as soon as the bay key is published
+            self.bay_cell.append(self.cells.slot(self.grid.cell_of(lat, lon)))
+            self.last_epoch.append(0.0)
+            self.last_status.append(STATUS_UNKNOWN)
+            slot = self.bays.slot(bay_id)
+        return slot
+
+    def _credit(self, slot: int, until: float):
+        """Add the time since the bay's last transition to its last status"""
+        start = self.last_epoch[slot]
+        status = self.last_status[slot]
+        self.last_epoch[slot] = max(start, until)
+        if status == STATUS_UNKNOWN or until <= start:
+            return
+        start = max(start, until - MAX_CREDIT_SECONDS)
+        free = status == STATUS_FREE
+        bay_base = slot * WEEK_HOURS
+        cell_base = self.bay_cell[slot] * WEEK_HOURS
+        bays, cells = self.bays, self.cells
+        while start < until:
+            hour = int(start // 3600)
+            stop = min(until, (hour + 1) * 3600.0)
+            seconds = stop - start
+            k = week_hour(hour)
+            bays.observed[bay_base + k] += seconds
+            cells.observed[cell_base + k] += seconds
+            if free:
+                bays.free[bay_base + k] += seconds
+                cells.free[cell_base + k] += seconds
+            start = stop
+
+    def _transition(self, slot: int, epoch: float, status: int):
+        if self.last_epoch[slot]:
+            self._credit(slot, epoch)
+        else:
+            self.last_epoch[slot] = epoch
+        self.last_status[slot] = status
+
+    def observe(self, bay_id: int, lat: float, lon: float, transitions: Iterable[Tuple[float, int]]):
+        """Fold recorded (epoch, status) transitions of one bay into the tables, oldest first"""
+        with self._lock:
+            slot = self._bay_slot(bay_id, lat, lon)
+            for epoch, status in transitions:
+                self._transition(slot, epoch, status)
+
+    def sweep(self, now: float):
+        """Credit every bay up to `now`, so bays that never change still count"""
+        with self._lock:
+            for slot in range(len(self.bays)):
+                self._credit(slot, now)
+
+    def on_snapshot(self, previous: Optional[Snapshot], current: Snapshot):
+        """Store listener: apply the transitions in the diff, sweeping once per hour"""
+        started = time.perf_counter()
+        diff = current.diff(previous)
+        bay_ids, lats, lons = current.bay_ids, current.lats, current.lons
+        status, status_ts = current.status, current.status_ts
+        now = current.fetched_at
+        with self._lock:
+            for row in diff.changed_rows:
+                bay_id = bay_ids[row]
+                if bay_id == MISSING_BAY_ID:
+                    continue
+                slot = self._bay_slot(bay_id, lats[row], lons[row])
+                ts = status_ts[row]
+                self._transition(slot, min(ts, now) if ts == ts else now, status[row])
+            for bay_id, _lat, _lon in diff.removed:
+                # Out of the feed: stop crediting until it reappears
+                slot = self.bays.keys.get(bay_id)
+                if slot is not None:
+                    self._transition(slot, now, STATUS_UNKNOWN)
+        hour = int(now // 3600)
+        if hour > self._swept_hour:
+            self._swept_hour = hour
+            self.sweep(hour * 3600.0)
+        FORECAST_UPDATE_SECONDS.observe(time.perf_counter() - started)
+
+    def load_history(self, transitions_by_bay: Dict[int, List[Tuple[int, int]]], snapshot: Snapshot):
+        """Seed the tables from recorded history for the bays in `snapshot`"""
+        rows = snapshot.row_by_bay
+        for bay_id, transitions in transitions_by_bay.items():
+            row = rows.get(bay_id)
+            if row is not None and transitions:
+                self.observe(bay_id, snapshot.lats[row], snapshot.lons[row], transitions)
+
+    # Lookups
+
+    def free_probability(self, bay_slot: Optional[int], cell_slot: Optional[int], hour: int,
+                         current_free: Optional[bool], minutes_ahead: float) -> float:
+        cell_rate = self.cells.rate(cell_slot, hour, DEFAULT_FREE_RATE)
+        rate = self.bays.rate(bay_slot, hour, cell_rate)
+        if current_free is None:
+            return rate
+        weight = math.exp(-max(0.0, minutes_ahead) / CURRENT_STATUS_DECAY_MINUTES)
+        return weight * (1.0 if current_free else 0.0) + (1.0 - weight) * rate
+
+    def forecast(self, snapshot: Snapshot, latitude: float, longitude: float, radius: float,
+                 arrival: float, now: Optional[float] = None, limit: int = 20) -> Dict[str, List[Dict]]:
+        """Bays and grid cells within `radius`, ranked by free probability at `arrival`"""
+        now = time.time() if now is None else now
+        minutes_ahead = (arrival - now) / 60.0
+        hour = week_hour(int(arrival // 3600))
+        bay_keys, cell_keys = self.bays.keys, self.cells.keys
+        bay_cell = self.bay_cell
+        lats, lons, status, bay_ids = snapshot.lats, snapshot.lons, snapshot.status, snapshot.bay_ids
+
+        bays = []
+        for row in snapshot.grid.query_radius(latitude, longitude, radius):
+            distance = haversine_meters(latitude, longitude, lats[row], lons[row])
+            if distance > radius:
+                continue
+            bay_slot = bay_keys.get(bay_ids[row])
+            cell_slot = bay_cell[bay_slot] if bay_slot is not None else cell_keys.get(
+                self.grid.cell_of(lats[row], lons[row]))
+            code = status[row]
+            current_free = None if code == STATUS_UNKNOWN else code == STATUS_FREE
+            probability = self.free_probability(bay_slot, cell_slot, hour, current_free, minutes_ahead)
+            bays.append((probability, distance, row))
+        bays.sort(key=lambda b: (-b[0], b[1]))
+
+        areas = []
+        for cell in self.grid.cells_in_radius(latitude, longitude, radius):
+            cell_slot = cell_keys.get(cell)
+            if cell_slot is None:
+                continue
+            lat = (cell[0] + 0.5) * self.grid.lat_step
+            lon = (cell[1] + 0.5) * self.grid.lon_step
+            areas.append({
+                "latitude": round(lat, 6),
+                "longitude": round(lon, 6),
+                "free_probability": round(self.cells.rate(cell_slot, hour, DEFAULT_FREE_RATE), 3),
+                "distance_meters": int(round(haversine_meters(latitude, longitude, lat, lon))),
+            })
+        areas.sort(key=lambda a: -a["free_probability"])
+
+        return {
+            "bays": [{
+                "bay_id": snapshot.bay_id(row),
+                "free_probability": round(probability, 3),
+                "current_status": snapshot.status_name(row),
+                "distance_meters": int(round(distance)),
+                "google_maps_link": f"https://www.google.com/maps/?q={lats[row]},{lons[row]}",
+            } for probability, distance, row in bays[:limit]],
+            "areas": areas[:limit],
+        }
@@ -0,0 +1,124 @@
+"""
+Melbourne Parking Agent - Binary Search Frames
+Fixed-layout columnar encoding of search results for mobile and service clients.
+
+Sent instead of JSON when the request's Accept header names FRAME_MEDIA_TYPE
+with a q above 0 and no lower than JSON's. Frames hold only the result bays, so
+requests for rings or grouped results must use JSON. A frame carries only raw values - no key names, formatted times or map links:
+
+    header   magic "PKFRAM01", snapshot version u64, count u32, pad[4]   (24 bytes)
+    columns  bay_ids q[n], latitudes d[n], longitudes d[n], distances_m u32[n],
+             status_ts d[n], updated_ts d[n], status B[n]
+
+All values are little endian; timestamps are Unix seconds (NaN when the feed
+has none) and status codes are those of snapshot.STATUS_NAMES. Rows are in
+the order of the JSON results: blended with sensor freshness by default, and
+nearest first only with prefer_fresh off. Sort by the distances column when
+strict distance order is needed.
+"""
+
+import struct
+import sys
+from array import array
+from typing import Dict, List, Sequence, Tuple
+
+from parking_agent.snapshot import Snapshot
+
+FRAME_MEDIA_TYPE = "application/vnd.parking.frame"
+FRAME_MAGIC = b"PKFRAM01"
+FRAME_HEADER = struct.Struct("<8sQI4x")
+
+# (name, typecode) in wire order
+COLUMNS = (
+    ("bay_ids", 'q'),
+    ("latitudes", 'd'),
+    ("longitudes", 'd'),
+    ("distances", 'I'),
+    ("status_ts", 'd'),
+    ("updated_ts", 'd'),
+    ("status", 'B'),
+)
+
+
+def _accept_ranges(accept: str) -> List[Tuple[str, float]]:
+    """(media range, q) pairs of an Accept header; malformed q values count as 0"""
+    ranges = []
+    for item in (accept or "").split(","):
+        media_range, *params = item.split(";")
+        media_range = media_range.strip().lower()
+        if not media_range:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    q = 0.0
+        ranges.append((media_range, q))
+    return ranges
+
+
+def _quality(ranges: List[Tuple[str, float]], media_type: str) -> float:
+    """q given to media_type by its most specific matching range (0 when none match)"""
+    main = media_type.split("/")[0] + "/*"
+    best, specificity = 0.0, -1
+    for media_range, q in ranges:
+        rank = 2 if media_range == media_type else 1 if media_range == main else 0 if media_range == "*/*" else -1
+        if rank > specificity:
+            best, specificity = q, rank
+    return best
+
+
+def wants_frame(accept: str) -> bool:
+    """
+    True when the Accept header names FRAME_MEDIA_TYPE with q > 0 and ranks
+    it at least as high as JSON. Wildcards alone keep the JSON default.
+    """
+    ranges = _accept_ranges(accept)
+    if not any(media_range == FRAME_MEDIA_TYPE for media_range, _q in ranges):
+        return False
+    frame_q = _quality(ranges, FRAME_MEDIA_TYPE)
+    return frame_q > 0 and frame_q >= _quality(ranges, "application/json")
+
+
+def _little_endian(column: array) -> bytes:
+    if sys.byteorder != "little":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def encode_frame(snapshot: Snapshot, candidates: Sequence[Tuple[int, int]]) -> bytes:
+    """Frame for (distance meters, row) search results"""
+    rows = [row for _distance, row in candidates]
+    columns = (
+        array('q', (snapshot.bay_ids[row] for row in rows)),
+        array('d', (snapshot.lats[row] for row in rows)),
+        array('d', (snapshot.lons[row] for row in rows)),
+        array('I', (distance for distance, _row in candidates)),
+        array('d', (snapshot.status_ts[row] for row in rows)),
+        array('d', (snapshot.updated_ts[row] for row in rows)),
+        array('B', (snapshot.status[row] for row in rows)),
+    )
+    header = FRAME_HEADER.pack(FRAME_MAGIC, snapshot.version, len(rows))
+    return header + b"".join(_little_endian(column) for column in columns)
+
+
+def decode_frame(data: bytes) -> Dict[str, object]:
+    """Inverse of encode_frame: {"version", "count", <column name>: list}"""
+    magic, version, count = FRAME_HEADER.unpack_from(data, 0)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Not a parking frame")
+    decoded: Dict[str, object] = {"version": version, "count": count}
+    offset = FRAME_HEADER.size
+    for name, typecode in COLUMNS:
+        column = array(typecode)
+        size = column.itemsize * count
+        column.frombytes(data[offset:offset + size])
+        if sys.byteorder != "little":
+            column.byteswap()
+        decoded[name] = column.tolist()
+        offset += size
+    return decoded
@@ -0,0 +1,83 @@
+"""
+Melbourne Parking Agent - Sensor Freshness
+Staleness filters and freshness-aware ranking from the bays' last sensor update.
+
+Some sensors stop reporting while still showing their bay as free, so an
+"Unoccupied" bay last updated hours ago is often taken. Each snapshot orders
+its free rows by `lastupdated` once (Snapshot.free_by_update); a
+`max_staleness` filter is then one bisect for the cutoff and a slice of the
+rows updated after it, with no pass over the snapshot. Bays without a
+timestamp sort first and count as stale.
+
+The default ranking blends distance with age: bays updated within
+FRESH_SECONDS rank by distance alone, and every hour beyond that ranks a bay
+PENALTY_METERS_PER_HOUR further away, up to MAX_PENALTY_METERS. Ages are
+measured from the snapshot's fetch time; they change with every fetch without
+appearing in the snapshot diff, so results that depend on them are cached per
+snapshot version rather than by shard.
+"""
+
+from bisect import bisect_left
+from typing import List, Optional, Sequence, Tuple
+
+from parking_agent import metrics
+from parking_agent.snapshot import Snapshot
+
+FRESH_SECONDS = 900.0
+PENALTY_METERS_PER_HOUR = 150.0
+MAX_PENALTY_METERS = 450.0
+# Free bays older than this are reported as stale sensors
+STALE_SECONDS = 3600.0
+
+STALE_FREE_BAYS = metrics.Gauge(
+    "parking_stale_free_bays", "Free bays whose sensor has not reported for over an hour")
+
+
+def age_seconds(snapshot: Snapshot, row: int) -> Optional[float]:
+    """Seconds between the bay's last sensor update and the snapshot fetch; None when unknown"""
+    updated = snapshot.updated_ts[row]
+    if updated != updated:
+        return None
+    return max(0.0, snapshot.fetched_at - updated)
+
+
+def penalty_meters(age: Optional[float]) -> float:
+    """Extra meters a bay of this age is ranked as being away"""
+    if age is None:
+        return MAX_PENALTY_METERS
+    return min(MAX_PENALTY_METERS, max(0.0, age - FRESH_SECONDS) * PENALTY_METERS_PER_HOUR / 3600.0)
+
+
+def score(age: Optional[float]) -> float:
+    """Freshness from 1 (recent report) down to 0 (stale or unknown)"""
+    return 1.0 - penalty_meters(age) / MAX_PENALTY_METERS
+
+
+def fresh_rows(snapshot: Snapshot, max_staleness: float, rows: Optional[Sequence[int]] = None) -> Sequence[int]:
+    """
+    Free rows updated within max_staleness seconds of the fetch. Without
+    `rows` this is a slice of the update-ordered index; a given subset of free
+    rows (e.g. restriction-filtered) is checked against the same cutoff.
+    """
+    cutoff = snapshot.fetched_at - max_staleness
+    if rows is None:
+        ordered, times = snapshot.free_by_update
+        return ordered[bisect_left(times, cutoff):]
+    updated_ts = snapshot.updated_ts
+    return [row for row in rows if updated_ts[row] >= cutoff]
+
+
+def stale_count(snapshot: Snapshot, seconds: float = STALE_SECONDS) -> int:
+    """Free bays not updated within `seconds` of the fetch, including those without a timestamp"""
+    return bisect_left(snapshot.free_by_update[1], snapshot.fetched_at - seconds)
+
+
+def rank(snapshot: Snapshot, candidates: Sequence[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """(distance, row) candidates ordered by distance plus the age penalty, nearer first on ties"""
+    return sorted(candidates, key=lambda candidate: (
+        candidate[0] + penalty_meters(age_seconds(snapshot, candidate[1])), candidate[0]))
+
+
+def observe_staleness(previous: Optional[Snapshot], current: Snapshot):
+    """Store listener: report how many free bays come from stale sensors"""
+    STALE_FREE_BAYS.set(stale_count(current))
@@ -0,0 +1,114 @@
+"""
+Melbourne Parking Agent - Availability Heatmap
+Free/occupied counts per grid cell at several resolutions, built once per snapshot.
+
+The finest level counts bays per 100 m cell; each coarser level doubles the
+cell size and is summed from the level below by halving cell coordinates, so a
+whole snapshot is aggregated in one pass over its rows plus a pass per level
+over occupied cells. Every level is serialized to JSON by the store listener as
+soon as the snapshot is installed, and requests return those bytes unchanged.
+Requests never aggregate: until the listener has built a new version they get
+the previous one, labelled with the version it was built from.
+"""
+
+import json
+import threading
+from typing import Dict, Optional, Tuple
+
+from parking_agent.snapshot import STATUS_FREE, STATUS_OCCUPIED, Snapshot
+from parking_agent.spatial import GridIndex
+
+# Map zoom level -> cell size in meters; each step halves the cell
+ZOOM_CELL_METERS = {12: 1600, 13: 800, 14: 400, 15: 200, 16: 100}
+MIN_ZOOM = min(ZOOM_CELL_METERS)
+MAX_ZOOM = max(ZOOM_CELL_METERS)
+
+Counts = Dict[Tuple[int, int], list]
+
+
+def clamp_zoom(zoom: int) -> int:
+    return max(MIN_ZOOM, min(MAX_ZOOM, zoom))
+
+
+def aggregate(snapshot: Snapshot) -> Dict[int, Counts]:
+    """{zoom: {cell: [free, occupied]}} for every zoom level"""
+    finest = GridIndex(ZOOM_CELL_METERS[MAX_ZOOM])
+    lat_step, lon_step = finest.lat_step, finest.lon_step
+    counts: Counts = {}
+    lats, lons, status = snapshot.lats, snapshot.lons, snapshot.status
+    for row in range(len(snapshot)):
+        code = status[row]
+        if code != STATUS_FREE and code != STATUS_OCCUPIED:
+            continue
+        lat = lats[row]
+        if lat != lat:
+            continue
+        cell = (int(lat // lat_step), int(lons[row] // lon_step))
+        cell_counts = counts.get(cell)
+        if cell_counts is None:
+            cell_counts = counts[cell] = [0, 0]
+        cell_counts[code == STATUS_OCCUPIED] += 1
+
+    levels = {MAX_ZOOM: counts}
+    for zoom in range(MAX_ZOOM - 1, MIN_ZOOM - 1, -1):
+        coarser: Counts = {}
+        for (r, c), (free, occupied) in levels[zoom + 1].items():
+            cell = (r >> 1, c >> 1)
+            cell_counts = coarser.get(cell)
+            if cell_counts is None:
+                coarser[cell] = [free, occupied]
+            else:
+                cell_counts[0] += free
+                cell_counts[1] += occupied
+        levels[zoom] = coarser
+    return levels
+
+
+def serialize_level(version: int, zoom: int, counts: Counts) -> bytes:
+    """Compact JSON: cells as [south, west, north, east, free, occupied] rows"""
+    grid = GridIndex(ZOOM_CELL_METERS[zoom])
+    lat_step, lon_step = grid.lat_step, grid.lon_step
+    cells = [
+        [round(r * lat_step, 6), round(c * lon_step, 6),
+         round((r + 1) * lat_step, 6), round((c + 1) * lon_step, 6), free, occupied]
+        for (r, c), (free, occupied) in sorted(counts.items())
+    ]
+    return json.dumps({
+        "version": version,
+        "zoom": zoom,
+        "cell_meters": ZOOM_CELL_METERS[zoom],
+        "columns": ["south", "west", "north", "east", "free", "occupied"],
+        "cells": cells,
+    }, separators=(",", ":")).encode()
+
+
+class HeatmapCache:
+    """Pre-serialized heatmap levels for the current snapshot version"""
+
+    def __init__(self):
+        # (version, {zoom: body}), replaced as a whole so readers never see a mix
+        self.built: Optional[Tuple[int, Dict[int, bytes]]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> Optional[int]:
+        built = self.built
+        return built[0] if built is not None else None
+
+    def build(self, snapshot: Snapshot):
+        levels = {zoom: serialize_level(snapshot.version, zoom, counts)
+                  for zoom, counts in aggregate(snapshot).items()}
+        with self._lock:
+            if self.built is None or snapshot.version >= self.built[0]:
+                self.built = (snapshot.version, levels)
+
+    def on_snapshot(self, previous: Optional[Snapshot], current: Snapshot):
+        """Store listener: aggregate the new version once"""
+        self.build(current)
+
+    def get(self, zoom: int) -> Optional[Tuple[int, bytes]]:
+        """(version, body) of the newest built level; None before the first build"""
+        built = self.built
+        if built is None:
+            return None
+        return built[0], built[1][clamp_zoom(zoom)]
@@ -0,0 +1,452 @@
+"""
+Melbourne Parking Agent - Occupancy History
+Append-only record of bay status transitions, per kerbsideid.
+
+Recent transitions live in fixed-size ring buffers, one per bay, carved out of
+a few shared typed arrays (uint32 epoch seconds and a status byte per entry)
+so a bay costs a handful of bytes per transition rather than a Python object.
+When a ring is full the oldest entry is moved to a spill buffer, and full spill
+buffers are written to disk as compressed segments:
+
+    magic "PKHIST01", then zlib of
+        varint bays
+        per bay (ascending kerbsideid): varint kerbsideid delta, varint entries, varint block bytes
+        per bay, same order, a block of entries:
+            varint epoch delta (first entry relative to the segment start), status byte
+
+The table in front lets a single-bay query skip to its block without decoding
+the others.
+
+Segments are named history-<first epoch>-<last epoch>.seg, so range queries
+and retention only need the directory listing. Each process also keeps an index
+of the bays in every segment, read from the table (which only needs the
+front of the zlib stream inflated), so a single-bay query opens only the
+segments that overlap its time range and hold that bay.
+
+On shutdown the rings are written out too, and on startup each bay's last
+persisted status seeds its ring. The first snapshot after a restart then only
+records the bays whose status really changed while the process was down.
+"""
+
+import os
+import threading
+import time
+import zlib
+from array import array
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from parking_agent import metrics
+from parking_agent.snapshot import MISSING_BAY_ID, Snapshot
+
+SEGMENT_MAGIC = b"PKHIST01"
+
+DEFAULT_RING_SIZE = int(os.getenv("PARKING_HISTORY_RING", "64"))
+DEFAULT_RETENTION_DAYS = float(os.getenv("PARKING_HISTORY_RETENTION_DAYS", "28"))
+# Evicted entries buffered before a segment is written
+DEFAULT_SEGMENT_ENTRIES = 100000
+
+HISTORY_BAYS = metrics.Gauge("parking_history_bays", "Bays with recorded occupancy history")
+HISTORY_TRANSITIONS = metrics.Counter("parking_history_transitions", "Bay status transitions recorded")
+HISTORY_SEGMENTS_WRITTEN = metrics.Counter("parking_history_segments_written", "History segments written to disk")
+HISTORY_DROPPED = metrics.Counter(
+    "parking_history_dropped", "Transitions evicted from memory without a history directory to spill to")
+
+Transition = Tuple[int, int]
+
+# Seed status of a bay slot with nothing persisted
+NO_STATUS = 0xFF
+
+
+def _put_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_segment(start: int, bays: Dict[int, List[Transition]]) -> bytes:
+    """Delta-encode {bay_id: [(epoch, status), ...]} (epochs ascending, all >= start)"""
+    table = bytearray()
+    data = bytearray()
+    _put_varint(table, len(bays))
+    previous_bay = 0
+    for bay_id in sorted(bays):
+        entries = bays[bay_id]
+        block = bytearray()
+        previous_epoch = start
+        for epoch, status in entries:
+            _put_varint(block, epoch - previous_epoch)
+            block.append(status)
+            previous_epoch = epoch
+        _put_varint(table, bay_id - previous_bay)
+        _put_varint(table, len(entries))
+        _put_varint(table, len(block))
+        previous_bay = bay_id
+        data += block
+    return SEGMENT_MAGIC + zlib.compress(bytes(table + data), 6)
+
+
+def _decode_entries(body: bytes, pos: int, count: int, start: int) -> List[Transition]:
+    epoch = start
+    decoded = []
+    for _ in range(count):
+        delta, pos = _get_varint(body, pos)
+        epoch += delta
+        decoded.append((epoch, body[pos]))
+        pos += 1
+    return decoded
+
+
+def _decode_table(body: bytes) -> Tuple[List[Tuple[int, int, int]], int]:
+    """(bay_id, entries, block bytes) per bay and the offset of the first block; IndexError if truncated"""
+    count, pos = _get_varint(body, 0)
+    table = []
+    bay_id = 0
+    for _ in range(count):
+        delta, pos = _get_varint(body, pos)
+        entries, pos = _get_varint(body, pos)
+        length, pos = _get_varint(body, pos)
+        bay_id += delta
+        table.append((bay_id, entries, length))
+    return table, pos
+
+
+def segment_bays(data: bytes) -> FrozenSet[int]:
+    """Bays with entries in a segment, inflating only as much as the table needs"""
+    if data[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+        raise ValueError("Not a history segment")
+    inflater = zlib.decompressobj()
+    body = inflater.decompress(data[len(SEGMENT_MAGIC):], 4096)
+    while True:
+        try:
+            table, _pos = _decode_table(body)
+            return frozenset(bay_id for bay_id, _entries, _length in table)
+        except IndexError:
+            more = inflater.decompress(inflater.unconsumed_tail, max(4096, len(body)))
+            if not more:
+                raise ValueError("Truncated history segment")
+            body += more
+
+
+def decode_segment(data: bytes, start: int, only_bay: Optional[int] = None) -> Dict[int, List[Transition]]:
+    """Decode a segment; with `only_bay`, skip straight to that bay's block"""
+    if data[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+        raise ValueError("Not a history segment")
+    body = zlib.decompress(data[len(SEGMENT_MAGIC):])
+    table, pos = _decode_table(body)
+
+    bays: Dict[int, List[Transition]] = {}
+    for bay_id, entries, length in table:
+        if only_bay is None or bay_id == only_bay:
+            bays[bay_id] = _decode_entries(body, pos, entries, start)
+        pos += length
+    return bays
+
+
+class HistoryStore:
+    """Per-bay ring buffers of status transitions, spilling old entries to disk segments"""
+
+    def __init__(self, directory: Optional[str] = None, ring_size: int = DEFAULT_RING_SIZE,
+                 retention_days: float = DEFAULT_RETENTION_DAYS, segment_entries: int = DEFAULT_SEGMENT_ENTRIES):
+        self.directory = directory
+        self.ring_size = ring_size
+        self.retention_seconds = retention_days * 86400
+        self.segment_entries = segment_entries
+        self.slots: Dict[int, int] = {}
+        # Ring storage: bay slot s owns entries [s * ring_size, (s + 1) * ring_size)
+        self.epochs = array('I')
+        self.statuses = array('B')
+        self.heads = array('I')
+        self.counts = array('I')
+        # Last persisted transition per slot, compared against while the ring is empty
+        self.seed_epochs = array('I')
+        self.seed_statuses = array('B')
+        self._seeded = False
+        # Segment path -> (first epoch, last epoch, bays in it)
+        self._segment_index: Dict[str, Tuple[int, int, FrozenSet[int]]] = {}
+        self._index_lock = threading.Lock()
+        # Entries evicted from full rings, waiting to be written as a segment
+        self._spill_bays = array('q')
+        self._spill_epochs = array('I')
+        self._spill_statuses = array('B')
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def _slot(self, bay_id: int) -> int:
+        slot = self.slots.get(bay_id)
+        if slot is None:
+            slot = self.slots[bay_id] = len(self.slots)
+            self.epochs.frombytes(bytes(self.epochs.itemsize * self.ring_size))
+            self.statuses.frombytes(bytes(self.ring_size))
+            self.heads.append(0)
+            self.counts.append(0)
+            self.seed_epochs.append(0)
+            self.seed_statuses.append(NO_STATUS)
+        return slot
+
+    def record(self, bay_id: int, epoch: int, status: int, persist: bool = True) -> bool:
+        """Append a transition; returns False when the bay is already in that status"""
+        with self._lock:
+            recorded = self._record(bay_id, epoch, status, persist)
+            spill_full = len(self._spill_epochs) >= self.segment_entries
+        if spill_full:
+            self.flush()
+        return recorded
+
+    def _record(self, bay_id: int, epoch: int, status: int, persist: bool) -> bool:
+        size = self.ring_size
+        slot = self._slot(bay_id)
+        head, count = self.heads[slot], self.counts[slot]
+        base = slot * size
+        if count:
+            last = base + (head - 1) % size
+            if self.statuses[last] == status:
+                return False
+            # Sensor clocks are not monotonic across bays; keep each bay's own order
+            epoch = max(epoch, self.epochs[last])
+        elif self.seed_statuses[slot] != NO_STATUS:
+            if self.seed_statuses[slot] == status:
+                return False
+            epoch = max(epoch, self.seed_epochs[slot])
+
+        position = base + head
+        if count == size:
+            if persist and self.directory:
+                self._spill_bays.append(bay_id)
+                self._spill_epochs.append(self.epochs[position])
+                self._spill_statuses.append(self.statuses[position])
+            else:
+                HISTORY_DROPPED.inc()
+        else:
+            self.counts[slot] = count + 1
+        self.epochs[position] = epoch
+        self.statuses[position] = status
+        self.heads[slot] = (head + 1) % size
+        return True
+
+    def on_snapshot(self, previous: Optional[Snapshot], current: Snapshot, persist: bool = True):
+        """
+        Store listener: record the bays whose status changed. The first
+        snapshot is compared with each bay's last persisted status.
+        """
+        if previous is None and not self._seeded:
+            self.seed(current.bay_ids)
+        rows = current.diff(previous).changed_rows
+        bay_ids, status, status_ts = current.bay_ids, current.status, current.status_ts
+        fallback = int(current.fetched_at)
+        recorded = 0
+        with self._lock:
+            for row in rows:
+                bay_id = bay_ids[row]
+                if bay_id == MISSING_BAY_ID:
+                    continue
+                ts = status_ts[row]
+                recorded += self._record(bay_id, int(ts) if ts == ts else fallback, status[row], persist)
+            spill_full = len(self._spill_epochs) >= self.segment_entries
+        HISTORY_TRANSITIONS.inc(recorded)
+        HISTORY_BAYS.set(len(self.slots))
+        if spill_full:
+            self.flush()
+
+    def ring(self, bay_id: int) -> List[Transition]:
+        """In-memory transitions for one bay, oldest first"""
+        with self._lock:
+            slot = self.slots.get(bay_id)
+            if slot is None:
+                return []
+            size = self.ring_size
+            base, head, count = slot * size, self.heads[slot], self.counts[slot]
+            positions = [base + (head - count + i) % size for i in range(count)]
+            return [(self.epochs[p], self.statuses[p]) for p in positions]
+
+    def seed(self, bay_ids: Iterable[int]):
+        """
+        Load the last persisted transition of each bay, newest segments first,
+        so the first snapshot after a restart only records real changes.
+        """
+        self._seeded = True
+        latest: Dict[int, Transition] = {}
+        wanted = set(bay_ids)
+        wanted.discard(MISSING_BAY_ID)
+        for start, end, path, bays in sorted(self._indexed_segments(), key=lambda s: s[1], reverse=True):
+            # Segments overlap in time, so an older one can still hold a later transition of a found bay
+            if bays.isdisjoint(wanted) and not any(latest[b][0] < end for b in bays if b in latest):
+                continue
+            with open(path, "rb") as f:
+                decoded = decode_segment(f.read(), start)
+            for bay_id, entries in decoded.items():
+                if entries and (bay_id in wanted or bay_id in latest):
+                    known = latest.get(bay_id)
+                    if known is None or entries[-1][0] > known[0]:
+                        latest[bay_id] = entries[-1]
+                    wanted.discard(bay_id)
+        with self._lock:
+            for bay_id, (epoch, status) in latest.items():
+                slot = self._slot(bay_id)
+                if not self.counts[slot]:
+                    self.seed_epochs[slot], self.seed_statuses[slot] = epoch, status
+
+    # Disk segments
+
+    def flush(self, include_rings: bool = False) -> Optional[str]:
+        """
+        Write the spill buffer as one segment; returns its path. With
+        `include_rings` (on shutdown) the ring entries are moved to the segment
+        too and become each bay's seed, so a restart continues from them.
+        """
+        with self._lock:
+            if include_rings and self.directory:
+                self._spill_rings()
+            bays_col, epochs_col, statuses_col = self._spill_bays, self._spill_epochs, self._spill_statuses
+            if not epochs_col or not self.directory:
+                return None
+            self._spill_bays, self._spill_epochs, self._spill_statuses = array('q'), array('I'), array('B')
+
+        grouped: Dict[int, List[Transition]] = {}
+        for bay_id, epoch, status in zip(bays_col, epochs_col, statuses_col):
+            entries = grouped.get(bay_id)
+            if entries is None:
+                grouped[bay_id] = [(epoch, status)]
+            else:
+                entries.append((epoch, status))
+        start, end = min(epochs_col), max(epochs_col)
+        path = os.path.join(self.directory, f"history-{start}-{end}.seg")
+        suffix = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, f"history-{start}-{end}.{suffix}.seg")
+            suffix += 1
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(encode_segment(start, grouped))
+        os.replace(tmp_path, path)
+        with self._index_lock:
+            self._segment_index[path] = (start, end, frozenset(grouped))
+        HISTORY_SEGMENTS_WRITTEN.inc()
+        self.prune()
+        return path
+
+    def _spill_rings(self):
+        """Move every ring's entries to the spill buffer, oldest first (caller holds the lock)"""
+        size = self.ring_size
+        for bay_id, slot in self.slots.items():
+            count = self.counts[slot]
+            if not count:
+                continue
+            base, head = slot * size, self.heads[slot]
+            for i in range(count):
+                position = base + (head - count + i) % size
+                self._spill_bays.append(bay_id)
+                self._spill_epochs.append(self.epochs[position])
+                self._spill_statuses.append(self.statuses[position])
+            self.seed_epochs[slot], self.seed_statuses[slot] = self._spill_epochs[-1], self._spill_statuses[-1]
+            self.heads[slot] = self.counts[slot] = 0
+
+    def segments(self) -> List[Tuple[int, int, str]]:
+        """(first epoch, last epoch, path) of every segment on disk, in write order"""
+        if not self.directory:
+            return []
+        found = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith("history-") and name.endswith(".seg")):
+                continue
+            parts = name[len("history-"):-len(".seg")].split(".")
+            try:
+                start, end = (int(x) for x in parts[0].split("-"))
+                sequence = int(parts[1]) if len(parts) > 1 else 0
+            except ValueError:
+                continue
+            found.append((start, end, sequence, os.path.join(self.directory, name)))
+        found.sort()
+        return [(start, end, path) for start, end, _sequence, path in found]
+
+    def _indexed_segments(self) -> List[Tuple[int, int, str, FrozenSet[int]]]:
+        """(first epoch, last epoch, path, bays) of every segment, reading the tables of new ones"""
+        found = self.segments()
+        with self._index_lock:
+            index = self._segment_index
+            for path in set(index) - {path for _start, _end, path in found}:
+                del index[path]
+            missing = [(start, end, path) for start, end, path in found if path not in index]
+        for start, end, path in missing:
+            try:
+                with open(path, "rb") as f:
+                    bays = segment_bays(f.read())
+            except (FileNotFoundError, ValueError):
+                # Pruned meanwhile, or still being replaced; picked up on the next query
+                continue
+            with self._index_lock:
+                index[path] = (start, end, bays)
+        with self._index_lock:
+            return [(start, end, path, index[path][2]) for start, end, path in found if path in index]
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Delete segments entirely older than the retention window"""
+        horizon = (time.time() if now is None else now) - self.retention_seconds
+        removed = 0
+        for _start, end, path in self.segments():
+            if end < horizon:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def history(self, bay_id: int, since: float = 0, until: Optional[float] = None) -> List[Transition]:
+        """All retained transitions of one bay in [since, until], oldest first"""
+        until = time.time() if until is None else until
+        since = max(since, time.time() - self.retention_seconds)
+        transitions: List[Transition] = []
+        for start, end, path, bays in self._indexed_segments():
+            if end < since or start > until or bay_id not in bays:
+                continue
+            with open(path, "rb") as f:
+                transitions.extend(decode_segment(f.read(), start, only_bay=bay_id).get(bay_id, ()))
+        with self._lock:
+            spilled = [(e, s) for b, e, s in zip(self._spill_bays, self._spill_epochs, self._spill_statuses)
+                       if b == bay_id]
+        transitions.extend(spilled)
+        transitions.extend(self.ring(bay_id))
+        # Stable on epoch: equal timestamps keep the order they were recorded in
+        transitions.sort(key=lambda t: t[0])
+        return [t for t in transitions if since <= t[0] <= until]
+
+    def transitions_by_bay(self) -> Dict[int, List[Transition]]:
+        """Every retained transition of every bay, oldest first (for rebuilding derived tables)"""
+        since = time.time() - self.retention_seconds
+        bays: Dict[int, List[Transition]] = {}
+        for start, end, path in self.segments():
+            if end < since:
+                continue
+            with open(path, "rb") as f:
+                for bay_id, entries in decode_segment(f.read(), start).items():
+                    bays.setdefault(bay_id, []).extend(entries)
+        with self._lock:
+            for bay_id, epoch, status in zip(self._spill_bays, self._spill_epochs, self._spill_statuses):
+                bays.setdefault(bay_id, []).append((epoch, status))
+        for bay_id in list(self.slots):
+            bays.setdefault(bay_id, []).extend(self.ring(bay_id))
+        for entries in bays.values():
+            entries.sort(key=lambda t: t[0])
+        return bays
+
+
+def create_history_store() -> HistoryStore:
+    """History spilling to PARKING_HISTORY_DIR when set, otherwise memory only"""
+    return HistoryStore(directory=os.getenv("PARKING_HISTORY_DIR") or None)
@@ -0,0 +1,413 @@
+#!/usr/bin/env python
+"""
+Melbourne Parking Agent - Load Test Harness
+Drives the parking API with a configurable traffic mix and reports latency percentiles
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+# Endpoint catalog: name -> (method, path)
+ENDPOINTS = {
+    "parking": ("POST", "/parking"),
+    "batch": ("POST", "/parking/batch"),
+    "home": ("GET", "/"),
+}
+
+DEFAULT_MIX = "parking=8,batch=1,home=1"
+DEFAULT_RADII = [250, 500, 1000]
+BATCH_SIZE = 5
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """Parse a 'name=weight,name=weight' string into a dict"""
+    weights = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight) if weight else 1.0
+    return weights
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class WorkloadGenerator:
+    """Builds requests weighted by endpoint mix and popular location mix"""
+
+    def __init__(self, locations: Dict[str, Dict[str, Any]], endpoint_weights: Dict[str, float],
+                 location_weights: Optional[Dict[str, float]] = None, jitter_meters: float = 150.0,
+                 seed: Optional[int] = None):
+        self.rng = random.Random(seed)
+        self.endpoints = [name for name, weight in endpoint_weights.items() if weight > 0]
+        self.endpoint_weights = [endpoint_weights[name] for name in self.endpoints]
+
+        location_weights = location_weights or {}
+        self.location_keys = [key for key in locations if location_weights.get(key, 1.0) > 0]
+        self.location_weights = [location_weights.get(key, 1.0) for key in self.location_keys]
+        self.locations = locations
+        # Rough degrees-per-meter at Melbourne's latitude
+        self.jitter_degrees = jitter_meters / 111000.0
+
+    def _search_body(self) -> Dict[str, Any]:
+        key = self.rng.choices(self.location_keys, weights=self.location_weights)[0]
+        loc = self.locations[key]
+        return {
+            "latitude": loc["latitude"] + self.rng.uniform(-self.jitter_degrees, self.jitter_degrees),
+            "longitude": loc["longitude"] + self.rng.uniform(-self.jitter_degrees, self.jitter_degrees),
+            "radius": self.rng.choice(DEFAULT_RADII),
+            "location_name": loc.get("name", key),
+        }
+
+    def next_request(self) -> Tuple[str, str, str, Optional[Dict[str, Any]]]:
+        """Return (endpoint name, method, path, json body)"""
+        name = self.rng.choices(self.endpoints, weights=self.endpoint_weights)[0]
+        method, path = ENDPOINTS[name]
+        if name == "parking":
+            body = self._search_body()
+        elif name == "batch":
+            body = {"requests": [self._search_body() for _ in range(BATCH_SIZE)]}
+        else:
+            body = None
+        return name, method, path, body
+
+
+class InProcessClient:
+    """Minimal ASGI client that calls the FastAPI app without a network hop"""
+
+    def __init__(self, app):
+        self.app = app
+        self._lifespan_task = None
+        self._lifespan_queue = None
+        self._lifespan_events = None
+
+    async def start(self):
+        self._lifespan_queue = asyncio.Queue()
+        self._lifespan_events = asyncio.Queue()
+
+        async def receive():
+            return await self._lifespan_queue.get()
+
+        async def send(message):
+            await self._lifespan_events.put(message)
+
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}
+        self._lifespan_task = asyncio.create_task(self.app(scope, receive, send))
+        await self._lifespan_queue.put({"type": "lifespan.startup"})
+        message = await self._lifespan_events.get()
+        if message["type"] == "lifespan.startup.failed":
+            raise RuntimeError(f"App startup failed: {message.get('message', '')}")
+
+    async def stop(self):
+        if self._lifespan_task is None:
+            return
+        await self._lifespan_queue.put({"type": "lifespan.shutdown"})
+        await self._lifespan_events.get()
+        await self._lifespan_task
+
+    async def request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+        payload = json.dumps(body).encode() if body is not None else b""
+        path, _, query = path.partition("?")
+        headers = [(b"host", b"loadtest"), (b"content-length", str(len(payload)).encode())]
+        if body is not None:
+            headers.append((b"content-type", b"application/json"))
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": headers,
+            "client": ("127.0.0.1", 0),
+            "server": ("loadtest", 80),
+        }
+        sent = False
+        status = 0
+        chunks = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            # Block until the app is done; it never needs a second message
+            await asyncio.Event().wait()
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+
+class RemoteClient:
+    """HTTP client for a running server, using a thread pool of requests sessions"""
+
+    def __init__(self, base_url: str, concurrency: int, timeout: float = 30.0):
+        import requests
+        import threading
+
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._local = threading.local()
+        self._requests = requests
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._requests.Session()
+            self._local.session = session
+        return session
+
+    def _do_request(self, method: str, path: str, body: Optional[Dict[str, Any]]) -> Tuple[int, bytes]:
+        response = self._session().request(method, self.base_url + path, json=body, timeout=self.timeout)
+        return response.status_code, response.content
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        self._executor.shutdown(wait=False)
+
+    async def request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._do_request, method, path, body)
+
+
+class EndpointStats:
+    """Latency and error accumulator for a single endpoint"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.status_counts: Dict[str, int] = {}
+
+    def record(self, latency: float, status: str, ok: bool):
+        self.latencies.append(latency)
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        if not ok:
+            self.errors += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+        count = len(ordered)
+        return {
+            "requests": count,
+            "errors": self.errors,
+            "error_rate": (self.errors / count) if count else 0.0,
+            "throughput_rps": (count / elapsed) if elapsed > 0 else 0.0,
+            "p50_ms": percentile(ordered, 50) * 1000,
+            "p95_ms": percentile(ordered, 95) * 1000,
+            "p99_ms": percentile(ordered, 99) * 1000,
+            "mean_ms": (sum(ordered) / count * 1000) if count else 0.0,
+            "max_ms": (ordered[-1] * 1000) if count else 0.0,
+            "status_counts": self.status_counts,
+        }
+
+
+async def served_paths(client) -> Optional[set]:
+    """Ask the target which paths it serves via its OpenAPI schema"""
+    try:
+        status, content = await client.request("GET", "/openapi.json")
+        if status != 200:
+            return None
+        return set(json.loads(content).get("paths", {}).keys())
+    except Exception:
+        return None
+
+
+async def fetch_locations(client) -> Dict[str, Dict[str, Any]]:
+    """Load the popular locations mix from the target's /locations endpoint"""
+    status, content = await client.request("GET", "/locations")
+    if status != 200:
+        raise RuntimeError(f"GET /locations returned {status}")
+    return json.loads(content)["locations"]
+
+
+async def run_load(client, generator: WorkloadGenerator, duration: float, concurrency: int,
+                   rate: float = 0.0, max_requests: int = 0) -> Dict[str, Any]:
+    """
+    Drive the target until the duration or request budget is exhausted.
+
+    With rate > 0 requests arrive open-loop as a Poisson process (capped at
+    `concurrency` in flight); with rate == 0 `concurrency` workers send
+    back-to-back requests closed-loop.
+    """
+    stats: Dict[str, EndpointStats] = {name: EndpointStats() for name in generator.endpoints}
+    semaphore = asyncio.Semaphore(concurrency)
+    issued = 0
+    dropped = 0
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def budget_left() -> bool:
+        return time.perf_counter() < deadline and (not max_requests or issued < max_requests)
+
+    async def one_request():
+        name, method, path, body = generator.next_request()
+        began = time.perf_counter()
+        try:
+            status, content = await client.request(method, path, body)
+            ok = 200 <= status < 400
+            label = str(status)
+            if ok and name != "home":
+                # The API reports some failures in the body rather than the status code
+                ok = json.loads(content).get("status") != "error"
+        except Exception as e:
+            ok = False
+            label = type(e).__name__
+        stats[name].record(time.perf_counter() - began, label, ok)
+
+    async def guarded():
+        try:
+            await one_request()
+        finally:
+            semaphore.release()
+
+    tasks = []
+    if rate > 0:
+        next_arrival = start
+        while budget_left():
+            next_arrival += generator.rng.expovariate(rate)
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if semaphore.locked():
+                # Open-loop arrivals beyond the concurrency cap are shed, not queued
+                dropped += 1
+                continue
+            await semaphore.acquire()
+            issued += 1
+            tasks.append(asyncio.create_task(guarded()))
+    else:
+        async def worker():
+            nonlocal issued
+            while budget_left():
+                issued += 1
+                await one_request()
+
+        tasks = [asyncio.create_task(worker()) for _ in range(concurrency)]
+
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "elapsed_seconds": elapsed,
+        "concurrency": concurrency,
+        "target_rate_rps": rate,
+        "dropped_arrivals": dropped,
+        "endpoints": {name: s.summary(elapsed) for name, s in stats.items()},
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Render the load-test report as a text table"""
+    lines = [
+        f"Elapsed: {report['elapsed_seconds']:.1f}s  Concurrency: {report['concurrency']}  "
+        f"Target rate: {report['target_rate_rps'] or 'closed-loop'}  Dropped arrivals: {report['dropped_arrivals']}",
+        "",
+        f"{'endpoint':<10}{'reqs':>8}{'rps':>9}{'err%':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}",
+    ]
+    for name, s in report["endpoints"].items():
+        lines.append(
+            f"{name:<10}{s['requests']:>8}{s['throughput_rps']:>9.1f}{s['error_rate'] * 100:>7.1f}%"
+            f"{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+async def _main_async(args) -> Dict[str, Any]:
+    if args.url:
+        client = RemoteClient(args.url, args.concurrency, timeout=args.timeout)
+    else:
+        from parking_agent.api import app
+        client = InProcessClient(app)
+
+    await client.start()
+    try:
+        endpoint_weights = parse_weights(args.mix)
+        unknown = set(endpoint_weights) - set(ENDPOINTS)
+        if unknown:
+            raise SystemExit(f"Unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+
+        paths = await served_paths(client)
+        if paths is not None:
+            for name in list(endpoint_weights):
+                if ENDPOINTS[name][1] not in paths:
+                    print(f"Skipping {name}: {ENDPOINTS[name][1]} is not served by the target")
+                    endpoint_weights.pop(name)
+        if not endpoint_weights:
+            raise SystemExit("No endpoints left to drive")
+
+        locations = await fetch_locations(client)
+        location_weights = parse_weights(args.locations) if args.locations else None
+        generator = WorkloadGenerator(locations, endpoint_weights, location_weights,
+                                      jitter_meters=args.jitter, seed=args.seed)
+
+        return await run_load(client, generator, args.duration, args.concurrency,
+                              rate=args.rate, max_requests=args.requests)
+    finally:
+        await client.stop()
+
+
+def failed(report: Dict[str, Any], max_error_rate: float) -> bool:
+    """True when no request completed or any endpoint's error rate exceeds max_error_rate"""
+    endpoints = report["endpoints"].values()
+    if not any(s["requests"] for s in endpoints):
+        return True
+    return any(s["error_rate"] > max_error_rate for s in endpoints)
+
+
+def main() -> int:
+    """
+    Run a load test against a running server (--url) or the in-process app.
+    Exits nonzero when no request completed or the error rate is too high.
+    """
+    parser = argparse.ArgumentParser(description="Melbourne Parking API load test")
+    parser.add_argument("--url", help="Base URL of a running server; omit to drive the app in-process")
+    parser.add_argument("--duration", "-d", type=float, default=30.0, help="Test duration in seconds")
+    parser.add_argument("--requests", "-n", type=int, default=0, help="Stop after this many requests (0 = no limit)")
+    parser.add_argument("--concurrency", "-c", type=int, default=10, help="Maximum requests in flight")
+    parser.add_argument("--rate", "-r", type=float, default=0.0,
+                        help="Open-loop arrival rate in requests/second (0 = closed-loop)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Endpoint weights, e.g. parking=8,batch=1,home=1")
+    parser.add_argument("--locations", default="",
+                        help="Popular location weights, e.g. melbourne_cbd=5,southbank=1 (default: uniform)")
+    parser.add_argument("--jitter", type=float, default=150.0, help="Random offset around each location in meters")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout for --url mode")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for a reproducible mix")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--max-error-rate", type=float, default=0.01,
+                        help="Exit with status 1 if any endpoint's error rate is above this")
+    args = parser.parse_args()
+
+    report = asyncio.run(_main_async(args))
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    return 1 if failed(report, args.max_error_rate) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,8 +5,6 @@ import argparse
 from datetime import datetime
 from dotenv import load_dotenv
 
-from parking_agent.crew import ParkingAgent
-
 warnings.filterwarnings("ignore", category=SyntaxWarning, module="pysbd")
 
 # Load environment variables
@@ -39,6 +37,8 @@ def run():
         if args.radius:
             inputs['radius'] = args.radius
 
+    from parking_agent.crew import ParkingAgent
+
     try:
         print(f"Searching for parking spots within {inputs['radius']}m of ({inputs['latitude']}, {inputs['longitude']})...")
         result = ParkingAgent().crew().kickoff(inputs=inputs)
@@ -71,6 +71,8 @@ def train():
         'longitude': 144.9631,
         'radius': 500
     }
+    from parking_agent.crew import ParkingAgent
+
     try:
         ParkingAgent().crew().train(n_iterations=int(sys.argv[1]), filename=sys.argv[2], inputs=inputs)
 
@@ -81,6 +83,8 @@ def replay():
     """
     Replay the crew execution from a specific task.
     """
+    from parking_agent.crew import ParkingAgent
+
     try:
         ParkingAgent().crew().replay(task_id=sys.argv[1])
 
@@ -97,6 +101,8 @@ def test():
         'radius': 500
     }
 
+    from parking_agent.crew import ParkingAgent
+
     try:
         ParkingAgent().crew().test(n_iterations=int(sys.argv[1]), eval_llm=sys.argv[2], inputs=inputs)
 
@@ -0,0 +1,296 @@
+"""
+Melbourne Parking Agent - Metrics
+Prometheus-style counters, gauges and histograms for the parking service.
+
+Updates are plain attribute/list increments with no locking. Under the GIL
+these are cheap enough for the hot path; a rare lost increment when two
+threads race on the same series is an accepted trade-off for a scrape metric.
+"""
+
+import asyncio
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds (upstream fetches and search stages)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000, 5000)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    """Base class for a metric family with optional labels"""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values: str, **kwargs: str):
+        """Return the child series for the given label values"""
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            child = self._new_child()
+            # setdefault keeps the first child if two threads create one concurrently
+            child = self._children.setdefault(values, child)
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _series(self):
+        """Yield (label values, child) pairs to expose"""
+        if self.labelnames:
+            return list(self._children.items())
+        return [((), self)]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in self._series():
+            lines.extend(child._render_samples(self.name, self.labelnames, values))
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.value = 0.0
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        child = Counter.__new__(Counter)
+        child.value = 0.0
+        return child
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def _render_samples(self, name, labelnames, values):
+        return [f"{name}_total{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be computed at scrape time"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        child = Gauge.__new__(Gauge)
+        child.value = 0.0
+        child._function = None
+        return child
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """Compute the value lazily when scraped"""
+        self._function = function
+
+    def _render_samples(self, name, labelnames, values):
+        value = self._function() if self._function is not None else self.value
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(float(value))}"]
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; observe() is a bisect plus two increments"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        self._reset()
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _reset(self):
+        # One slot per bucket plus the +Inf overflow slot; cumulated at render time
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def _new_child(self):
+        child = Histogram.__new__(Histogram)
+        child.buckets = self.buckets
+        child._reset()
+        return child
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def time(self):
+        """Context manager observing the elapsed wall time in seconds"""
+        return _Timer(self)
+
+    def _render_samples(self, name, labelnames, values):
+        lines = []
+        cumulative = 0
+        counts = list(self.counts)
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            labels = _format_labels(labelnames + ("le",), values + (_format_value(float(bound)),))
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, values)
+        lines.append(f"{name}_sum{labels} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Registry:
+    """Collection of metric families rendered together"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upstream Melbourne open data API
+UPSTREAM_FETCH_SECONDS = Histogram(
+    "parking_upstream_fetch_seconds", "Latency of upstream parking sensor API fetches", ["outcome"])
+UPSTREAM_FETCH_BYTES = Histogram(
+    "parking_upstream_fetch_bytes", "Response size of upstream parking sensor API fetches", buckets=BYTES_BUCKETS)
+
+# Parking data snapshot
+SNAPSHOT_RECORDS = Gauge("parking_snapshot_records", "Number of bay records in the latest fetched snapshot")
+SNAPSHOT_TIMESTAMP = Gauge(
+    "parking_snapshot_timestamp_seconds", "Unix time of the newest sensor update in the latest snapshot")
+SNAPSHOT_AGE_SECONDS = Gauge(
+    "parking_snapshot_age_seconds", "Seconds since the newest sensor update in the latest snapshot")
+SNAPSHOT_AGE_SECONDS.set_function(
+    lambda: (time.time() - SNAPSHOT_TIMESTAMP.value) if SNAPSHOT_TIMESTAMP.value else 0.0)
+
+# Caches
+CACHE_REQUESTS = Counter("parking_cache_requests", "Cache lookups by cache and result", ["cache", "result"])
+CACHE_HIT_RATIO = Gauge("parking_cache_hit_ratio", "Cache hit ratio since process start", ["cache"])
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    """Count a cache lookup and expose its running hit ratio"""
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+    ratio = CACHE_HIT_RATIO.labels(cache)
+    if ratio._function is None:
+        hits = CACHE_REQUESTS.labels(cache, "hit")
+        misses = CACHE_REQUESTS.labels(cache, "miss")
+        ratio.set_function(lambda: hits.value / ((hits.value + misses.value) or 1.0))
+
+
+# Search pipeline
+SEARCH_STAGE_SECONDS = Histogram(
+    "parking_search_stage_seconds", "Latency of each parking search stage", ["stage"])
+SEARCH_RESULTS = Histogram(
+    "parking_search_results", "Number of parking spots returned per search", buckets=COUNT_BUCKETS)
+
+# Event loop health
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "parking_event_loop_lag_seconds", "Delay between a scheduled event loop wake-up and when it ran")
+EVENT_LOOP_LAG_MAX = Gauge(
+    "parking_event_loop_lag_max_seconds", "Largest event loop lag seen in the last monitoring window")
+
+
+class EventLoopLagMonitor:
+    """Background task that measures how late the event loop runs a timer"""
+
+    def __init__(self, interval: float = 0.5, window: int = 20):
+        self.interval = interval
+        self.window = window
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        worst = 0.0
+        ticks = 0
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            worst = max(worst, lag)
+            ticks += 1
+            if ticks >= self.window:
+                EVENT_LOOP_LAG_MAX.set(worst)
+                worst = 0.0
+                ticks = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,213 @@
+"""
+Melbourne Parking Agent - Nearest Free Bay Table
+Lookup table of the nearest free bays for every cell of a fine grid over the sensor area.
+
+Built once per snapshot by a multi-source breadth-first sweep: every cell
+holding free bays starts with its own bays, and each wave passes the
+candidates on to the neighbouring cells. A cell keeps every bay within its
+k-th nearest distance (from its centre) plus one cell diagonal, and only
+re-enters the next wave with the bays it just gained, so the sweep stops once
+every list is stable or beyond MAX_METERS from any free bay. The result is a
+flat array of snapshot rows with per-cell offsets.
+
+A nearest-bay query is then an array slice: the point's cell gives its
+candidates, re-ranked by exact distance to the point. The result is exact.
+If bay b is among the k nearest to a point p, it is also among the k nearest
+to every point on the segment from b to p, and the centres of the cells that
+segment crosses are within half a cell diagonal of it. Measured from those
+centres, b is within two half-diagonals (one cell diagonal) of the k-th
+distance, so each cell on the way keeps b and passes it on, and p's own cell
+holds it.
+`parking_bench nearest` checks this against a full search. Cells beyond
+MAX_METERS of every free bay hold no candidates. Lookups there return None, so
+the caller falls back to a search.
+
+The table is built by the store listener on the refresh thread. Until it is
+built for the installed version, get() returns None rather than building it
+on the caller's thread.
+"""
+
+import math
+import threading
+import time
+from array import array
+from bisect import insort
+from typing import List, Optional, Tuple
+
+from parking_agent import metrics
+from parking_agent.snapshot import Snapshot
+from parking_agent.spatial import METERS_PER_DEGREE_LAT, METERS_PER_DEGREE_LON, haversine_meters
+
+CELL_METERS = 50.0
+NEAREST_K = 3
+MAX_METERS = 2000.0
+
+TABLE_BUILD_SECONDS = metrics.Histogram(
+    "parking_nearest_table_build_seconds", "Time to build the nearest-free-bay table for a snapshot")
+TABLE_QUERIES = metrics.Counter("parking_nearest_table_queries", "Nearest-bay table lookups", ["result"])
+
+
+class NearestTable:
+    """Nearest free rows per grid cell, as one flat array with per-cell offsets"""
+
+    def __init__(self, snapshot: Snapshot, cell_meters: float = CELL_METERS, k: int = NEAREST_K,
+                 max_meters: float = MAX_METERS):
+        self.version = snapshot.version
+        self.cell_meters = cell_meters
+        self.k = k
+        self.lat_step = cell_meters / METERS_PER_DEGREE_LAT
+        self.lon_step = cell_meters / METERS_PER_DEGREE_LON
+        lats, lons = snapshot.lats, snapshot.lons
+        located = [row for row in range(len(snapshot)) if lats[row] == lats[row]]
+        if not located:
+            self.south = self.west = 0.0
+            self.rows_count = self.cols_count = 0
+            self.offsets = array('i', [0])
+            self.table = array('i')
+            return
+        # Cover every sensor, free or not, so any query inside the network hits the table
+        self.south = min(lats[row] for row in located) - self.lat_step
+        self.west = min(lons[row] for row in located) - self.lon_step
+        self.rows_count = int((max(lats[row] for row in located) - self.south) / self.lat_step) + 2
+        self.cols_count = int((max(lons[row] for row in located) - self.west) / self.lon_step) + 2
+        self.offsets, self.table = self._sweep(snapshot, max_meters)
+
+    def _sweep(self, snapshot: Snapshot, max_meters: float) -> Tuple[array, array]:
+        k, cols, rows_count = self.k, self.cols_count, self.rows_count
+        cell = self.cell_meters
+        # One cell diagonal (twice the half-diagonal) keeps the lists exact; the
+        # extra millimeter absorbs floating point rounding
+        slack = math.hypot(cell, cell) + 0.001
+        lats, lons = snapshot.lats, snapshot.lons
+        # Free bay positions in meters from the table's south-west corner
+        xs, ys = {}, {}
+        # Per cell: (distance to the centre, row) sorted, and the same rows as a set
+        best: List[Optional[List[Tuple[float, int]]]] = [None] * (rows_count * cols)
+        known: List[Optional[set]] = [None] * (rows_count * cols)
+        seeds = {}
+        for row in snapshot.free_rows:
+            if lats[row] != lats[row]:
+                continue
+            x = (lons[row] - self.west) * METERS_PER_DEGREE_LON
+            y = (lats[row] - self.south) * METERS_PER_DEGREE_LAT
+            r, c = int(y // cell), int(x // cell)
+            if 0 <= r < rows_count and 0 <= c < cols:
+                xs[row], ys[row] = x, y
+                seeds.setdefault(r * cols + c, []).append(row)
+
+        def bound(current: List[Tuple[float, int]]) -> float:
+            return (current[k - 1][0] if len(current) >= k else max_meters) + slack
+
+        def prune(current: List[Tuple[float, int]], members: set):
+            limit = bound(current)
+            while current[-1][0] > limit:
+                members.discard(current.pop()[1])
+
+        center_x = [(c + 0.5) * cell for c in range(cols)]
+        center_y = [(r + 0.5) * cell for r in range(rows_count)]
+        frontier = {}
+        for index, bays in seeds.items():
+            cx, cy = center_x[index % cols], center_y[index // cols]
+            current = best[index] = sorted((math.hypot(xs[b] - cx, ys[b] - cy), b) for b in bays)
+            members = known[index] = set(bays)
+            prune(current, members)
+            frontier[index] = [b for _d, b in current]
+
+        # Each wave only passes on the bays a cell gained in the previous wave
+        while frontier:
+            gained = {}
+            for index, bays in frontier.items():
+                r, c = divmod(index, cols)
+                for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+                    if nr < 0 or nc < 0 or nr >= rows_count or nc >= cols:
+                        continue
+                    neighbour = nr * cols + nc
+                    current, members = best[neighbour], known[neighbour]
+                    if current is None:
+                        current, members = best[neighbour], known[neighbour] = [], set()
+                    cx, cy = center_x[nc], center_y[nr]
+                    new = []
+                    for b in bays:
+                        if b in members:
+                            continue
+                        # The bound only shrinks, so a bay turned away here never qualifies later
+                        d = math.hypot(xs[b] - cx, ys[b] - cy)
+                        if d > bound(current):
+                            continue
+                        insort(current, (d, b))
+                        members.add(b)
+                        new.append(b)
+                    if new:
+                        prune(current, members)
+                        new = [b for b in new if b in members]
+                    if new:
+                        pending = gained.get(neighbour)
+                        if pending is None:
+                            gained[neighbour] = new
+                        else:
+                            pending.extend(b for b in new if b not in pending)
+            frontier = gained
+
+        offsets = array('i', [0]) * (rows_count * cols + 1)
+        table = array('i')
+        for index, bays in enumerate(best):
+            if bays:
+                table.extend(b for _d, b in bays)
+            offsets[index + 1] = len(table)
+        return offsets, table
+
+    def cell_index(self, lat: float, lon: float) -> Optional[int]:
+        r = math.floor((lat - self.south) / self.lat_step)
+        c = math.floor((lon - self.west) / self.lon_step)
+        if 0 <= r < self.rows_count and 0 <= c < self.cols_count:
+            return r * self.cols_count + c
+        return None
+
+    def nearest(self, snapshot: Snapshot, lat: float, lon: float) -> Optional[List[Tuple[int, int]]]:
+        """
+        (distance meters, row) of up to k free bays near the point, nearest first;
+        None when the point is outside the table or its cell has no candidates.
+        """
+        index = self.cell_index(lat, lon)
+        if index is None:
+            TABLE_QUERIES.labels("outside").inc()
+            return None
+        lats, lons = snapshot.lats, snapshot.lons
+        candidates = self.table[self.offsets[index]:self.offsets[index + 1]]
+        if not candidates:
+            TABLE_QUERIES.labels("empty").inc()
+            return None
+        TABLE_QUERIES.labels("hit").inc()
+        found = sorted((haversine_meters(lat, lon, lats[row], lons[row]), row) for row in candidates)
+        return [(int(round(distance)), row) for distance, row in found[:self.k]]
+
+
+class NearestTableCache:
+    """Nearest-bay table for the latest snapshot, rebuilt when one is installed"""
+
+    def __init__(self, cell_meters: float = CELL_METERS, k: int = NEAREST_K):
+        self.cell_meters = cell_meters
+        self.k = k
+        self.table: Optional[NearestTable] = None
+        self._lock = threading.Lock()
+
+    def build(self, snapshot: Snapshot) -> NearestTable:
+        started = time.perf_counter()
+        table = NearestTable(snapshot, self.cell_meters, self.k)
+        TABLE_BUILD_SECONDS.observe(time.perf_counter() - started)
+        with self._lock:
+            if self.table is None or snapshot.version >= self.table.version:
+                self.table = table
+        return table
+
+    def on_snapshot(self, previous: Optional[Snapshot], current: Snapshot):
+        """Store listener: build the table for the new version"""
+        self.build(current)
+
+    def get(self, snapshot: Snapshot) -> Optional[NearestTable]:
+        """Table for the snapshot's version; None while it is still being built"""
+        table = self.table
+        if table is None or table.version != snapshot.version:
+            TABLE_QUERIES.labels("building").inc()
+            return None
+        return table
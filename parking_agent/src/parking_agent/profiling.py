@@ -0,0 +1,157 @@
+"""
+Melbourne Parking Agent - Live Profiling
+Sampling CPU profiles, tracemalloc snapshots and coroutine stack dumps for a
+running worker. All outputs use the collapsed "frame;frame;frame count" format
+understood by flamegraph.pl, speedscope and inferno.
+
+The debug endpoints are disabled unless PARKING_DEBUG_TOKEN is set.
+"""
+
+import asyncio
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+MAX_PROFILE_SECONDS = 60.0
+# Heap capture window when tracemalloc is not already running (PYTHONTRACEMALLOC)
+DEFAULT_HEAP_SECONDS = 10.0
+
+# Only one capture at a time per worker; concurrent captures would skew each other
+capture_lock = threading.Lock()
+
+
+def debug_token() -> Optional[str]:
+    return os.getenv("PARKING_DEBUG_TOKEN") or None
+
+
+def check_token(authorization: str) -> bool:
+    """Validate an 'Authorization: Bearer <token>' header against PARKING_DEBUG_TOKEN"""
+    token = debug_token()
+    if token is None:
+        return False
+    scheme, _, supplied = authorization.partition(" ")
+    if scheme.lower() != "bearer":
+        return False
+    return hmac.compare_digest(supplied.strip().encode(), token.encode())
+
+
+def _frame_label(code) -> str:
+    module = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({module}:{code.co_firstlineno})"
+
+
+def _fold_frames(frame) -> List[str]:
+    """Walk a frame chain and return labels root-first"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def format_folded(stacks: Dict[str, int]) -> str:
+    lines = [f"{stack} {count}" for stack, count in sorted(stacks.items(), key=lambda x: -x[1])]
+    return "\n".join(lines) + "\n"
+
+
+def sample_cpu(seconds: float, interval: float = 0.005) -> str:
+    """
+    Sample the stacks of every other thread for `seconds` and return folded stacks.
+
+    Runs on a helper thread so the event loop keeps serving the traffic being
+    profiled; the GIL is released between samples.
+    """
+    seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+    own_id = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks: Counter = Counter()
+
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            labels = _fold_frames(frame)
+            if not labels:
+                continue
+            thread_name = names.get(thread_id) or f"thread-{thread_id}"
+            stacks[";".join([thread_name] + labels)] += 1
+        time.sleep(interval)
+
+    return format_folded(stacks)
+
+
+def _fold_traceback(traceback: Iterable) -> str:
+    # tracemalloc tracebacks are most-recent-first
+    labels = [f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in traceback]
+    labels.reverse()
+    return ";".join(labels)
+
+
+def memory_snapshot(seconds: float = DEFAULT_HEAP_SECONDS, top: int = 50, folded: bool = True,
+                    nframes: int = 25) -> str:
+    """
+    Take a tracemalloc snapshot of live allocations.
+
+    tracemalloc only sees allocations made while it runs. If it was started
+    at boot (PYTHONTRACEMALLOC=25) the snapshot covers the whole heap and
+    `seconds` is an optional wait. Otherwise it is started here, the
+    allocations made during `seconds` that are still alive are reported, and
+    it is stopped again; a zero window is rejected with ValueError because it
+    would report almost nothing. Folded output is weighted by bytes; text
+    output lists the `top` allocation sites.
+    """
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        if seconds <= 0:
+            raise ValueError("tracemalloc is not running; give a capture window in seconds")
+        tracemalloc.start(nframes)
+    try:
+        if seconds > 0:
+            time.sleep(min(seconds, MAX_PROFILE_SECONDS))
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+    finally:
+        if started_here:
+            tracemalloc.stop()
+
+    if folded:
+        stacks: Counter = Counter()
+        for stat in snapshot.statistics("traceback"):
+            stacks[_fold_traceback(stat.traceback)] += stat.size
+        return format_folded(stacks)
+
+    stats = snapshot.statistics("lineno")
+    total = sum(stat.size for stat in stats)
+    lines = [f"Total traced: {total / 1024:.1f} KiB in {sum(stat.count for stat in stats)} blocks", ""]
+    for stat in stats[:top]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:8} blocks  {frame.filename}:{frame.lineno}")
+    return "\n".join(lines) + "\n"
+
+
+def coroutine_stacks(folded: bool = False) -> str:
+    """Dump the stack of every pending task on the running event loop"""
+    tasks = asyncio.all_tasks()
+    if folded:
+        stacks: Counter = Counter()
+        for task in tasks:
+            labels = [_frame_label(frame.f_code) for frame in task.get_stack()]
+            stacks[";".join([task.get_name()] + labels)] += 1
+        return format_folded(stacks)
+
+    lines = [f"{len(tasks)} pending tasks", ""]
+    for task in tasks:
+        lines.append(f"Task {task.get_name()}: {task.get_coro()!r}")
+        for frame in task.get_stack():
+            lines.append(f"    {frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}")
+        lines.append("")
+    return "\n".join(lines)
@@ -0,0 +1,313 @@
+"""
+Melbourne Parking Agent - Bay Restrictions
+Ingests the city's bay restrictions dataset and filters search rows with bitmasks.
+
+Records are loaded once from a local JSON/CSV export (PARKING_RESTRICTIONS_FILE)
+or a JSON endpoint serving the same records (PARKING_RESTRICTIONS_URL). Each
+record describes up to six time-windowed rules for one bay, keyed by
+kerbsideid (bayid in older exports):
+
+    typedesc<i>, duration<i> (minutes), fromday<i> / today<i> (0 = Sunday),
+    starttime<i> / endtime<i> ("HH:MM:SS"), disabilityext<i>
+
+Rules are parsed into compact tuples per kerbsideid. For a snapshot the join is
+done once: each row gets the index of its bay's rule set. Filters are then
+evaluated per 15-minute week slot as Python-int bitmasks over snapshot rows
+(the maximum stay and disabled-only flag are computed for every row once per
+slot and threshold), so a filtered search ANDs a few integers with the free-bay
+mask instead of inspecting rules per record.
+"""
+
+import csv
+import io
+import json
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from parking_agent import metrics
+from parking_agent.engine import MELBOURNE_TZ
+from parking_agent.snapshot import MISSING_BAY_ID, Snapshot
+
+RULE_SLOTS = 6
+SLOT_MINUTES = 15
+# Stored in the duration column for bays with no time limit at the slot
+UNLIMITED = 0xFFFF
+
+RESTRICTED_BAYS = metrics.Gauge("parking_restricted_bays", "Bays with loaded restriction rules")
+
+
+class Rule(NamedTuple):
+    days: int          # bit d set for weekday d, 0 = Monday (datetime.weekday())
+    start: int         # minutes after midnight
+    end: int           # minutes after midnight, exclusive
+    duration: int      # maximum stay in minutes, UNLIMITED when none
+    disabled: bool     # disabled permit holders only
+    description: str
+
+
+class SearchFilters(NamedTuple):
+    """Restriction filters for a search; a None field is not filtered on"""
+    min_duration: Optional[int] = None
+    accessible: Optional[bool] = None
+    at_time: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.min_duration is not None or self.accessible is not None
+
+    def key(self) -> str:
+        """Cache key fragment: results only change with the filters and the 15-minute slot"""
+        return f"d{self.min_duration}:a{self.accessible}:s{week_slot(self.at_time)}"
+
+
+def week_slot(epoch: Optional[float] = None) -> Tuple[int, int]:
+    """(weekday 0 = Monday, 15-minute slot of the day) in Melbourne time"""
+    local = datetime.fromtimestamp(time.time() if epoch is None else epoch, MELBOURNE_TZ)
+    return local.weekday(), (local.hour * 60 + local.minute) // SLOT_MINUTES
+
+
+def _minutes(value: Any) -> Optional[int]:
+    if not value:
+        return None
+    try:
+        parts = str(value).split(":")
+        return int(parts[0]) * 60 + int(parts[1])
+    except (ValueError, IndexError):
+        return None
+
+
+def _day_mask(from_day: Any, to_day: Any) -> int:
+    """Bitmask of datetime weekdays from the dataset's 0 = Sunday numbering"""
+    try:
+        first, last = int(from_day), int(to_day)
+    except (ValueError, TypeError):
+        return 0b1111111
+    mask = 0
+    day = first
+    for _ in range(7):
+        mask |= 1 << ((day + 6) % 7)
+        if day == last:
+            break
+        day = (day + 1) % 7
+    return mask
+
+
+def _flag(value: Any) -> bool:
+    return str(value).strip().lower() in ("1", "true", "yes", "y")
+
+
+def parse_rules(record: Dict[str, Any]) -> List[Rule]:
+    rules = []
+    for i in range(1, RULE_SLOTS + 1):
+        description = (record.get(f"typedesc{i}") or record.get(f"description{i}") or "").strip()
+        start, end = _minutes(record.get(f"starttime{i}")), _minutes(record.get(f"endtime{i}"))
+        if not description or start is None or end is None:
+            continue
+        try:
+            duration = int(float(record.get(f"duration{i}") or 0)) or UNLIMITED
+        except ValueError:
+            duration = UNLIMITED
+        disabled = _flag(record.get(f"disabilityext{i}")) or "disab" in description.lower()
+        rules.append(Rule(_day_mask(record.get(f"fromday{i}"), record.get(f"today{i}")),
+                          start, end if end > start else 24 * 60, min(duration, UNLIMITED), disabled, description))
+    return rules
+
+
+def _bay_id(record: Dict[str, Any]) -> int:
+    for key in ("kerbsideid", "bayid", "bay_id"):
+        try:
+            return int(record[key])
+        except (KeyError, ValueError, TypeError):
+            continue
+    return MISSING_BAY_ID
+
+
+def read_records(path: Optional[str] = None, url: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Restriction records from a JSON/CSV file or a JSON endpoint"""
+    if url:
+        import requests
+
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        yield from (data.get("results", []) if isinstance(data, dict) else data)
+        return
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if path.lower().endswith(".csv"):
+        yield from csv.DictReader(io.StringIO(text))
+        return
+    data = json.loads(text)
+    yield from (data.get("results", []) if isinstance(data, dict) else data)
+
+
+class _SlotMasks:
+    __slots__ = ("durations", "disabled", "by_duration")
+
+    def __init__(self, durations: array, disabled: int):
+        self.durations = durations
+        self.disabled = disabled
+        self.by_duration: Dict[int, int] = {}
+
+
+class RestrictionIndex:
+    """Rules per kerbsideid plus per-snapshot, per-slot bitmasks over rows"""
+
+    def __init__(self, rules: Dict[int, Tuple[Rule, ...]], max_slots: int = 64):
+        self.rules = rules
+        self.max_slots = max_slots
+        # Rule sets deduplicated: most bays on a street share the same signage
+        self._rule_sets: List[Tuple[Rule, ...]] = []
+        self._set_of_bay: Dict[int, int] = {}
+        seen: Dict[Tuple[Rule, ...], int] = {}
+        for bay_id, bay_rules in rules.items():
+            index = seen.get(bay_rules)
+            if index is None:
+                index = seen[bay_rules] = len(self._rule_sets)
+                self._rule_sets.append(bay_rules)
+            self._set_of_bay[bay_id] = index
+        self._joined: Optional[Tuple[int, array]] = None
+        self._slots: "OrderedDict[Tuple[int, int, int], _SlotMasks]" = OrderedDict()
+        self._lock = threading.Lock()
+        RESTRICTED_BAYS.set(len(rules))
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    @classmethod
+    def from_records(cls, records) -> "RestrictionIndex":
+        rules: Dict[int, Tuple[Rule, ...]] = {}
+        for record in records:
+            bay_id = _bay_id(record)
+            if bay_id != MISSING_BAY_ID:
+                rules[bay_id] = tuple(parse_rules(record))
+        return cls(rules)
+
+    def _join(self, snapshot: Snapshot) -> array:
+        """Rule-set index per snapshot row (-1 for bays without restrictions)"""
+        joined = self._joined
+        if joined is not None and joined[0] == snapshot.version:
+            return joined[1]
+        set_of_bay = self._set_of_bay
+        column = array('i', (set_of_bay.get(bay_id, -1) for bay_id in snapshot.bay_ids))
+        self._joined = (snapshot.version, column)
+        return column
+
+    @staticmethod
+    def _active(rules: Tuple[Rule, ...], weekday: int, minute: int) -> List[Rule]:
+        bit = 1 << weekday
+        return [rule for rule in rules if rule.days & bit and rule.start <= minute < rule.end]
+
+    def _slot_masks(self, snapshot: Snapshot, slot: Tuple[int, int]) -> _SlotMasks:
+        key = (snapshot.version,) + slot
+        with self._lock:
+            masks = self._slots.get(key)
+            if masks is not None:
+                self._slots.move_to_end(key)
+                return masks
+
+        weekday, quarter = slot
+        minute = quarter * SLOT_MINUTES
+        # Evaluate each distinct rule set once, then broadcast to rows
+        per_set = []
+        for rules in self._rule_sets:
+            active = self._active(rules, weekday, minute)
+            per_set.append((min((rule.duration for rule in active), default=UNLIMITED),
+                            any(rule.disabled for rule in active)))
+        durations = array('H', bytes(2 * len(snapshot)))
+        disabled = 0
+        for row, index in enumerate(self._join(snapshot)):
+            if index < 0:
+                durations[row] = UNLIMITED
+                continue
+            duration, disabled_only = per_set[index]
+            durations[row] = duration
+            if disabled_only:
+                disabled |= 1 << row
+        masks = _SlotMasks(durations, disabled)
+        with self._lock:
+            self._slots[key] = masks
+            while len(self._slots) > self.max_slots:
+                self._slots.popitem(last=False)
+        return masks
+
+    def mask(self, snapshot: Snapshot, filters: SearchFilters) -> int:
+        """Bitmask of rows allowed by the filters (all rows when no filter is set)"""
+        everything = (1 << len(snapshot)) - 1
+        if not filters.active:
+            return everything
+        masks = self._slot_masks(snapshot, week_slot(filters.at_time))
+        allowed = everything
+        if filters.accessible is True:
+            allowed &= masks.disabled
+        elif filters.accessible is False:
+            allowed &= ~masks.disabled
+        if filters.min_duration is not None:
+            duration_mask = masks.by_duration.get(filters.min_duration)
+            if duration_mask is None:
+                wanted = filters.min_duration
+                duration_mask = 0
+                for row, duration in enumerate(masks.durations):
+                    if duration >= wanted:
+                        duration_mask |= 1 << row
+                masks.by_duration[wanted] = duration_mask
+            allowed &= duration_mask
+        return allowed
+
+    def free_rows(self, snapshot: Snapshot, filters: SearchFilters) -> List[int]:
+        """Free rows that pass the filters, in row order"""
+        return rows_of(free_mask(snapshot) & self.mask(snapshot, filters))
+
+    def describe(self, bay_id: int, at_time: Optional[float] = None) -> str:
+        """Descriptions of the rules in force for a bay at a time"""
+        rules = self.rules.get(bay_id)
+        if not rules:
+            return ""
+        weekday, quarter = week_slot(at_time)
+        return "; ".join(rule.description for rule in self._active(rules, weekday, quarter * SLOT_MINUTES))
+
+
+_free_masks: "OrderedDict[int, int]" = OrderedDict()
+
+
+def free_mask(snapshot: Snapshot) -> int:
+    """Bitmask of the snapshot's free rows (cached for the last few versions)"""
+    mask = _free_masks.get(snapshot.version)
+    if mask is None:
+        mask = 0
+        for row in snapshot.free_rows:
+            mask |= 1 << row
+        _free_masks[snapshot.version] = mask
+        while len(_free_masks) > 4:
+            _free_masks.popitem(last=False)
+    return mask
+
+
+def rows_of(mask: int) -> List[int]:
+    """Set bit positions of a mask, ascending"""
+    rows = []
+    while mask:
+        low = mask & -mask
+        rows.append(low.bit_length() - 1)
+        mask ^= low
+    return rows
+
+
+def load_restrictions() -> Optional[RestrictionIndex]:
+    """Ingest PARKING_RESTRICTIONS_FILE or PARKING_RESTRICTIONS_URL; None when neither is set"""
+    path = os.getenv("PARKING_RESTRICTIONS_FILE")
+    url = os.getenv("PARKING_RESTRICTIONS_URL")
+    if not path and not url:
+        return None
+    try:
+        index = RestrictionIndex.from_records(read_records(path=path, url=url))
+    except (OSError, ValueError) as e:
+        print(f"Could not load bay restrictions: {e}")
+        return None
+    print(f"Loaded restrictions for {len(index)} bays")
+    return index
@@ -0,0 +1,131 @@
+"""
+Melbourne Parking Agent - Snapshot Shards
+Per-geohash-cell change versions, so cached answers depend only on the area they cover.
+
+The snapshot is partitioned into geohash cells (precision 7 by default, about
+150 m x 150 m; PARKING_SHARD_PRECISION). Each shard carries the snapshot
+version in which one of its bays last changed status, appeared, left the
+feed or moved in or out, maintained from the snapshot diff. A cached response
+is keyed by a dependency token: a digest of the versions of the shards
+covering its area.
+When a new snapshot only changes bays elsewhere in the city, the token - and
+so the cache entry - stays valid.
+
+If a version is missed (the diff chain breaks), every shard is reset to the
+new version, which only costs cache misses.
+"""
+
+import hashlib
+import os
+import threading
+from typing import Dict, List, Optional
+
+from parking_agent import metrics
+from parking_agent.snapshot import Snapshot
+from parking_agent.spatial import BBox
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+DEFAULT_PRECISION = int(os.getenv("PARKING_SHARD_PRECISION", "7"))
+
+SHARDS_CHANGED = metrics.Counter("parking_shards_changed", "Snapshot shards whose bays changed")
+SHARDS_TRACKED = metrics.Gauge("parking_shards_tracked", "Snapshot shards with a change since the last reset")
+
+
+def geohash(lat: float, lon: float, precision: int = DEFAULT_PRECISION) -> str:
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = value = 0
+    return "".join(chars)
+
+
+def cell_degrees(precision: int = DEFAULT_PRECISION):
+    """(lat, lon) size of a geohash cell in degrees"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def covering(bbox: BBox, precision: int = DEFAULT_PRECISION) -> List[str]:
+    """Geohash cells overlapping a bounding box"""
+    dlat, dlon = cell_degrees(precision)
+    first_row = int((bbox[0] + 90.0) // dlat)
+    last_row = int((bbox[2] + 90.0) // dlat)
+    first_col = int((bbox[1] + 180.0) // dlon)
+    last_col = int((bbox[3] + 180.0) // dlon)
+    return [geohash((r + 0.5) * dlat - 90.0, (c + 0.5) * dlon - 180.0, precision)
+            for r in range(first_row, last_row + 1) for c in range(first_col, last_col + 1)]
+
+
+class ShardIndex:
+    """Last-changed snapshot version per shard, advanced from snapshot diffs"""
+
+    def __init__(self, precision: int = DEFAULT_PRECISION):
+        self.precision = precision
+        self.versions: Dict[str, int] = {}
+        # Version every shard is at unless it changed since
+        self.epoch = 0
+        self.version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def on_snapshot(self, previous: Optional[Snapshot], current: Snapshot):
+        """Store listener: bump the shards of the bays that changed"""
+        if previous is None or self.version != previous.version:
+            with self._lock:
+                self.versions.clear()
+                self.epoch = self.version = current.version
+            SHARDS_TRACKED.set(0)
+            return
+
+        diff = current.diff(previous)
+        changed = set()
+        lats, lons = current.lats, current.lons
+        for row in diff.changed_rows:
+            if lats[row] == lats[row]:
+                changed.add(geohash(lats[row], lons[row], self.precision))
+        for _bay_id, lat, lon in diff.removed:
+            if lat == lat:
+                changed.add(geohash(lat, lon, self.precision))
+        # A bay that moved leaves its old shard and enters its new one, whatever its status
+        for row, lat, lon in diff.moved:
+            if lat == lat:
+                changed.add(geohash(lat, lon, self.precision))
+            if lats[row] == lats[row]:
+                changed.add(geohash(lats[row], lons[row], self.precision))
+        with self._lock:
+            for shard in changed:
+                self.versions[shard] = current.version
+            self.version = current.version
+            tracked = len(self.versions)
+        SHARDS_CHANGED.inc(len(changed))
+        SHARDS_TRACKED.set(tracked)
+
+    def token(self, snapshot: Snapshot, bbox: BBox) -> Optional[str]:
+        """
+        Cache scope for an answer computed from `snapshot` over `bbox`; None when
+        the index does not describe this snapshot version (use the version instead).
+        """
+        shards = covering(bbox, self.precision)
+        with self._lock:
+            if self.version != snapshot.version:
+                return None
+            epoch, versions = self.epoch, self.versions
+            parts = [f"{epoch}"]
+            parts.extend(f"{shard}{versions.get(shard, epoch)}" for shard in shards)
+        return "s" + hashlib.sha1(":".join(parts).encode()).hexdigest()[:20]
@@ -0,0 +1,517 @@
+#!/usr/bin/env python
+"""
+Melbourne Parking Agent - Bay Snapshots
+Columnar snapshots of the bay sensor feed, refreshed in the background.
+
+A Snapshot holds one fetch of the feed as parallel typed columns. In a single
+process the SnapshotStore keeps the latest one in memory. With several uvicorn
+workers per container, SharedSnapshotStore publishes each version as a flat
+binary file in /dev/shm (or PARKING_SNAPSHOT_PATH): one process holds the
+refresher lock and writes new versions, every worker maps the file read-only
+and builds its Snapshot directly over the mapped pages, so the container keeps
+one copy of the data and all workers switch to a new version atomically.
+
+File layout (little endian, 8-byte aligned):
+
+    header   magic, version, count, fetched_at, newest_update, epoch   (64 bytes)
+    columns  bay_ids q[n], lats d[n], lons d[n], status_ts d[n], updated_ts d[n], status B[n]
+"""
+
+import argparse
+import asyncio
+import math
+import mmap
+import os
+import secrets
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime
+from functools import cached_property
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from parking_agent import metrics
+from parking_agent.spatial import GridIndex
+
+# Status codes stored in the status column
+STATUS_UNKNOWN = 0
+STATUS_FREE = 1
+STATUS_OCCUPIED = 2
+STATUS_NAMES = {STATUS_UNKNOWN: "Unknown", STATUS_FREE: "Unoccupied", STATUS_OCCUPIED: "Present"}
+STATUS_CODES = {"Unoccupied": STATUS_FREE, "Present": STATUS_OCCUPIED}
+
+MISSING_BAY_ID = -1
+
+MAGIC = b"PKSNAP01"
+HEADER = struct.Struct("<8sQQddQ")
+HEADER_SIZE = 64
+
+DEFAULT_REFRESH_SECONDS = float(os.getenv("PARKING_REFRESH_SECONDS", "30"))
+
+
+def new_epoch() -> int:
+    return secrets.randbits(48) or 1
+
+
+# Epoch of the versions numbered by this process. Version numbers only mean
+# something within one epoch: two instances both at "version 42" hold unrelated
+# snapshots unless their epochs match as well.
+LOCAL_EPOCH = new_epoch()
+
+SNAPSHOT_VERSION = metrics.Gauge("parking_snapshot_version", "Version of the snapshot this worker is serving")
+
+
+def parse_timestamp(value: Optional[str]) -> float:
+    """ISO-8601 string to Unix seconds; NaN when missing or malformed"""
+    if not value:
+        return math.nan
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except (ValueError, TypeError):
+        return math.nan
+
+
+def _parse_bay_id(value: Any) -> int:
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return MISSING_BAY_ID
+
+
+class Snapshot:
+    """One immutable version of the bay sensor feed, stored column-wise"""
+
+    def __init__(self, version: int, fetched_at: float, bay_ids, lats, lons, status_ts, updated_ts, status,
+                 buffer=None, epoch: int = 0):
+        self.version = version
+        # Identifies the sequence `version` was numbered in (0 when not yet numbered)
+        self.epoch = epoch
+        self.fetched_at = fetched_at
+        self.bay_ids = bay_ids
+        self.lats = lats
+        self.lons = lons
+        self.status_ts = status_ts
+        self.updated_ts = updated_ts
+        self.status = status
+        # Keeps a mapped file alive for as long as the columns point into it
+        self._buffer = buffer
+        # Last diff computed against a previous version, shared by all listeners
+        self._diff: Optional["SnapshotDiff"] = None
+
+    def __len__(self) -> int:
+        return len(self.bay_ids)
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]], version: int = 0,
+                     fetched_at: Optional[float] = None) -> "Snapshot":
+        """Build a snapshot from raw API records, skipping records without a location"""
+        bay_ids, lats, lons = array('q'), array('d'), array('d')
+        status_ts, updated_ts, status = array('d'), array('d'), array('B')
+        for record in records:
+            location = record.get('location') or {}
+            lat = location.get('lat')
+            lon = location.get('lon')
+            if lat is None or lon is None:
+                continue
+            bay_ids.append(_parse_bay_id(record.get('kerbsideid')))
+            lats.append(float(lat))
+            lons.append(float(lon))
+            status_ts.append(parse_timestamp(record.get('status_timestamp')))
+            updated_ts.append(parse_timestamp(record.get('lastupdated')))
+            status.append(STATUS_CODES.get(record.get('status_description'), STATUS_UNKNOWN))
+        return cls(version, time.time() if fetched_at is None else fetched_at,
+                   bay_ids, lats, lons, status_ts, updated_ts, status)
+
+    @cached_property
+    def free_rows(self) -> List[int]:
+        """Row indices of unoccupied bays"""
+        return [row for row, code in enumerate(self.status) if code == STATUS_FREE]
+
+    @cached_property
+    def newest_update(self) -> float:
+        """Unix time of the most recent sensor update, 0 when unknown"""
+        return max((ts for ts in self.updated_ts if ts == ts), default=0.0)
+
+    @cached_property
+    def free_by_update(self) -> Tuple[array, array]:
+        """Free rows ordered by last sensor update, oldest first, and their update times (-inf when unknown)"""
+        updated_ts = self.updated_ts
+        times = sorted((updated_ts[row] if updated_ts[row] == updated_ts[row] else -math.inf, row)
+                       for row in self.free_rows)
+        return array('I', (row for _ts, row in times)), array('d', (ts for ts, _row in times))
+
+    @cached_property
+    def row_by_bay(self) -> Dict[int, int]:
+        """Map of kerbsideid to row"""
+        return {bay_id: row for row, bay_id in enumerate(self.bay_ids) if bay_id != MISSING_BAY_ID}
+
+    @cached_property
+    def grid(self) -> GridIndex:
+        """Spatial grid over all rows"""
+        return GridIndex.from_points(self.lats, self.lons)
+
+    def diff(self, previous: Optional["Snapshot"]) -> "SnapshotDiff":
+        """Bays that changed status, appeared or disappeared since `previous`"""
+        cached = self._diff
+        if cached is not None and cached.previous_version == (previous.version if previous else 0):
+            return cached
+
+        changed: List[int] = []
+        removed: List[tuple] = []
+        moved: List[tuple] = []
+        if previous is None:
+            changed = list(range(len(self)))
+        else:
+            previous_rows = previous.row_by_bay
+            previous_status, previous_lats, previous_lons = previous.status, previous.lats, previous.lons
+            status, lats, lons = self.status, self.lats, self.lons
+            for row, bay_id in enumerate(self.bay_ids):
+                previous_row = previous_rows.get(bay_id)
+                if previous_row is None:
+                    changed.append(row)
+                    continue
+                if previous_status[previous_row] != status[row]:
+                    changed.append(row)
+                if previous_lats[previous_row] != lats[row] or previous_lons[previous_row] != lons[row]:
+                    moved.append((row, previous_lats[previous_row], previous_lons[previous_row]))
+            current_rows = self.row_by_bay
+            for bay_id, previous_row in previous_rows.items():
+                if bay_id not in current_rows:
+                    removed.append((bay_id, previous.lats[previous_row], previous.lons[previous_row]))
+
+        diff = SnapshotDiff(previous.version if previous else 0, self, changed, removed, moved)
+        self._diff = diff
+        return diff
+
+    def bay_id(self, row: int) -> str:
+        bay_id = self.bay_ids[row]
+        return 'N/A' if bay_id == MISSING_BAY_ID else str(bay_id)
+
+    def status_name(self, row: int) -> str:
+        return STATUS_NAMES[self.status[row]]
+
+    @property
+    def token(self) -> str:
+        """Version qualified by its epoch ("<epoch>:<version>"), comparable across instances"""
+        return f"{self.epoch:x}:{self.version}"
+
+    def with_version(self, version: int, epoch: Optional[int] = None) -> "Snapshot":
+        return Snapshot(version, self.fetched_at, self.bay_ids, self.lats, self.lons,
+                        self.status_ts, self.updated_ts, self.status, self._buffer,
+                        self.epoch if epoch is None else epoch)
+
+    def to_bytes(self) -> bytes:
+        """Serialize into the shared file layout"""
+        parts = [HEADER.pack(MAGIC, self.version, len(self), self.fetched_at, self.newest_update, self.epoch)]
+        parts.append(b"\0" * (HEADER_SIZE - HEADER.size))
+        for column, typecode in ((self.bay_ids, 'q'), (self.lats, 'd'), (self.lons, 'd'),
+                                 (self.status_ts, 'd'), (self.updated_ts, 'd'), (self.status, 'B')):
+            parts.append(array(typecode, column).tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_buffer(cls, buffer) -> "Snapshot":
+        """Zero-copy snapshot over a buffer in the shared file layout (e.g. an mmap)"""
+        view = memoryview(buffer)
+        magic, version, count, fetched_at, _newest, epoch = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a parking snapshot file")
+
+        offset = HEADER_SIZE
+        columns = []
+        for typecode, width in (('q', 8), ('d', 8), ('d', 8), ('d', 8), ('d', 8), ('B', 1)):
+            columns.append(view[offset:offset + count * width].cast(typecode))
+            offset += count * width
+        return cls(version, fetched_at, *columns, buffer=buffer, epoch=epoch)
+
+
+class SnapshotDiff:
+    """Changes between two consecutive snapshot versions"""
+
+    def __init__(self, previous_version: int, snapshot: Snapshot, changed_rows: List[int], removed: List[tuple],
+                 moved: Optional[List[tuple]] = None):
+        self.previous_version = previous_version
+        self.version = snapshot.version
+        self.snapshot = snapshot
+        # Rows of `snapshot` whose status changed or that are new in this version
+        self.changed_rows = changed_rows
+        # (bay_id, lat, lon) of bays no longer present in the feed
+        self.removed = removed
+        # (row, previous lat, previous lon) of bays whose coordinates changed, whatever their status
+        self.moved = moved or []
+
+    def __len__(self) -> int:
+        return len(self.changed_rows) + len(self.removed)
+
+    @property
+    def freed_rows(self) -> List[int]:
+        """Changed rows that are now unoccupied"""
+        status = self.snapshot.status
+        return [row for row in self.changed_rows if status[row] == STATUS_FREE]
+
+
+def next_version(snapshot: Snapshot, previous: int) -> Optional[int]:
+    """
+    Version to install a fetched snapshot under, or None if it is already installed.
+
+    Snapshots fetched straight from upstream carry version 0 and get the next
+    local number; snapshots loaded from a shared cache keep their fleet-wide
+    version so every instance agrees on it. See version_epoch for the epoch
+    the returned version belongs to.
+    """
+    if snapshot.version and snapshot.version == previous:
+        return None
+    return snapshot.version if snapshot.version > previous else previous + 1
+
+
+def version_epoch(snapshot: Snapshot, version: int, local_epoch: int) -> int:
+    """Epoch of `version` as assigned by next_version: the snapshot's own when it kept its number"""
+    if snapshot.version and version == snapshot.version and snapshot.epoch:
+        return snapshot.epoch
+    return local_epoch
+
+
+def _record_snapshot_metrics(snapshot: Snapshot):
+    metrics.SNAPSHOT_RECORDS.set(len(snapshot))
+    SNAPSHOT_VERSION.set(snapshot.version)
+    if snapshot.newest_update:
+        metrics.SNAPSHOT_TIMESTAMP.set(snapshot.newest_update)
+
+
+class SnapshotStore:
+    """Holds the current snapshot for this process and refreshes it periodically"""
+
+    def __init__(self, fetch: Callable[[], Optional[Snapshot]], refresh_seconds: float = DEFAULT_REFRESH_SECONDS):
+        self.fetch = fetch
+        self.refresh_seconds = refresh_seconds
+        self._snapshot: Optional[Snapshot] = None
+        self._task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[Optional[Snapshot], Snapshot], None]] = []
+        # Serializes fetches so concurrent cold requests share one upstream call
+        self._refresh_lock = threading.Lock()
+
+    def current(self) -> Optional[Snapshot]:
+        return self._snapshot
+
+    def add_listener(self, listener: Callable[[Optional[Snapshot], Snapshot], None]):
+        """Call listener(previous, current) whenever a new version is installed"""
+        self._listeners.append(listener)
+
+    def _install(self, snapshot: Snapshot):
+        previous = self._snapshot
+        # A single reference assignment, so readers never see a half-built version
+        self._snapshot = snapshot
+        _record_snapshot_metrics(snapshot)
+        for listener in self._listeners:
+            try:
+                listener(previous, snapshot)
+            except Exception as e:
+                print(f"Snapshot listener failed: {e}")
+
+    def refresh(self) -> Optional[Snapshot]:
+        """Fetch a new version now; keeps the previous one if the fetch fails"""
+        with self._refresh_lock:
+            return self._refresh()
+
+    def ensure(self) -> Optional[Snapshot]:
+        """Current snapshot, fetching one first if none has been loaded yet"""
+        snapshot = self.current()
+        if snapshot is not None:
+            return snapshot
+        with self._refresh_lock:
+            return self.current() or self._refresh()
+
+    def _refresh(self) -> Optional[Snapshot]:
+        snapshot = self.fetch()
+        if snapshot is None:
+            return self._snapshot
+        version = next_version(snapshot, self._snapshot.version if self._snapshot else 0)
+        if version is not None:
+            self._install(snapshot.with_version(version, version_epoch(snapshot, version, LOCAL_EPOCH)))
+        return self._snapshot
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                print(f"Snapshot refresh failed: {e}")
+            await asyncio.sleep(self.refresh_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def default_shared_path() -> str:
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "parking_snapshot.bin")
+
+
+class SharedSnapshotStore(SnapshotStore):
+    """
+    Snapshot store shared by all worker processes in a container.
+
+    Whichever process holds the refresher lock fetches and publishes new
+    versions; every process maps the published file. If the refresher exits,
+    its lock is released and another worker takes over on its next tick.
+
+    Each worker watches the file from one background thread, which maps and
+    installs new versions, so snapshot listeners never run on request threads
+    and a version is installed once. current() only returns the reference.
+    """
+
+    def __init__(self, fetch: Callable[[], Optional[Snapshot]], path: Optional[str] = None,
+                 refresh_seconds: float = DEFAULT_REFRESH_SECONDS, check_seconds: float = 0.25):
+        super().__init__(fetch, refresh_seconds)
+        self.path = path or default_shared_path()
+        self.check_seconds = check_seconds
+        self._lock_fd: Optional[int] = None
+        self._mapped_inode: Optional[int] = None
+        # Serializes mapping and installing between the sync thread and the refresh loop
+        self._sync_lock = threading.Lock()
+        self._sync_stop = threading.Event()
+        self._sync_thread: Optional[threading.Thread] = None
+
+    @property
+    def is_refresher(self) -> bool:
+        return self._lock_fd is not None
+
+    def try_become_refresher(self) -> bool:
+        """Take the container-wide refresher lock without blocking"""
+        if self._lock_fd is not None:
+            return True
+        import fcntl
+
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def sync(self) -> Optional[Snapshot]:
+        """Map the published file if a newer version has been written"""
+        with self._sync_lock:
+            try:
+                inode = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                return self._snapshot
+            if inode == self._mapped_inode:
+                return self._snapshot
+
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            snapshot = Snapshot.from_buffer(mapped)
+            self._mapped_inode = inode
+            if self._snapshot is None or snapshot.version > self._snapshot.version:
+                self._install(snapshot)
+            return self._snapshot
+
+    def _sync_loop(self):
+        while not self._sync_stop.wait(self.check_seconds):
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Snapshot sync failed: {e}")
+
+    def _published_version(self) -> Tuple[int, int]:
+        """(version, epoch) of the published file, (0, 0) when there is none"""
+        try:
+            with open(self.path, "rb") as f:
+                header = HEADER.unpack(f.read(HEADER.size))
+            return header[1], header[5]
+        except (FileNotFoundError, struct.error):
+            return 0, 0
+
+    def publish(self, snapshot: Snapshot) -> Snapshot:
+        """Write a snapshot as the next version and atomically replace the shared file"""
+        published, epoch = self._published_version()
+        previous = max(published, self._snapshot.version if self._snapshot else 0)
+        version = next_version(snapshot, previous)
+        if version is None:
+            return self.sync()
+        # A refresher taking over keeps numbering in the epoch already published
+        epoch = version_epoch(snapshot, version, epoch or LOCAL_EPOCH)
+        data = snapshot.with_version(version, epoch).to_bytes()
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        # rename() is atomic: readers see either the old file or the complete new one
+        os.replace(tmp_path, self.path)
+        return self.sync()
+
+    def _refresh(self) -> Optional[Snapshot]:
+        if not self.try_become_refresher():
+            return self.sync()
+        snapshot = self.fetch()
+        if snapshot is None:
+            return self.sync()
+        return self.publish(snapshot)
+
+    def start(self):
+        super().start()
+        if self._sync_thread is None:
+            self._sync_stop.clear()
+            self._sync_thread = threading.Thread(target=self._sync_loop, name="parking-snapshot-sync", daemon=True)
+            self._sync_thread.start()
+
+    async def stop(self):
+        await super().stop()
+        if self._sync_thread is not None:
+            self._sync_stop.set()
+            await asyncio.to_thread(self._sync_thread.join, 5.0)
+            self._sync_thread = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+def create_store(fetch: Callable[[], Optional[Snapshot]]) -> SnapshotStore:
+    """Shared store when PARKING_SNAPSHOT_PATH is set (multi-worker), otherwise in-process"""
+    path = os.getenv("PARKING_SNAPSHOT_PATH")
+    if path:
+        return SharedSnapshotStore(fetch, path=None if path == "auto" else path)
+    return SnapshotStore(fetch)
+
+
+def main():
+    """
+    Run a dedicated refresher process that publishes snapshots for all workers.
+    """
+    from parking_agent.engine import ParkingEngine
+
+    parser = argparse.ArgumentParser(description="Publish parking snapshots to shared memory")
+    parser.add_argument("--path", default=os.getenv("PARKING_SNAPSHOT_PATH") or default_shared_path(),
+                        help="Shared snapshot file (default: /dev/shm/parking_snapshot.bin)")
+    parser.add_argument("--interval", type=float, default=DEFAULT_REFRESH_SECONDS, help="Seconds between fetches")
+    args = parser.parse_args()
+
+    store = SharedSnapshotStore(ParkingEngine().fetch_snapshot, path=args.path, refresh_seconds=args.interval)
+    while not store.try_become_refresher():
+        print(f"Another process is publishing to {args.path}; waiting for the refresher lock")
+        time.sleep(args.interval)
+
+    print(f"Publishing parking snapshots to {args.path} every {args.interval:.0f}s")
+    while True:
+        snapshot = store.refresh()
+        if snapshot is not None:
+            print(f"Published snapshot version {snapshot.version} ({len(snapshot)} bays)")
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
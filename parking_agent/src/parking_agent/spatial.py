@@ -0,0 +1,168 @@
+"""
+Melbourne Parking Agent - Spatial Index
+Uniform lat/lon grid used to find bays, viewports and subscriptions by area.
+
+Cells are roughly square in meters around Melbourne's latitude. A grid maps
+each cell (row, col) to a list of items: snapshot rows for bays, or
+subscription ids for viewports and watchlists. Queries enumerate the cells
+overlapping a box or circle and leave the exact geometry test to the caller.
+"""
+
+import math
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+EARTH_RADIUS_METERS = 6371000
+METERS_PER_DEGREE_LAT = 111320.0
+# Reference latitude for the longitude scale (Melbourne CBD)
+REFERENCE_LATITUDE = -37.8136
+# Flat-earth scale for longitudes around the reference latitude
+METERS_PER_DEGREE_LON = METERS_PER_DEGREE_LAT * math.cos(math.radians(REFERENCE_LATITUDE))
+
+Cell = Tuple[int, int]
+# (min_lat, min_lon, max_lat, max_lon)
+BBox = Tuple[float, float, float, float]
+
+
+def haversine_meters(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in meters"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    dlat = lat2_rad - lat1_rad
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+
+def parse_bbox(value: str) -> BBox:
+    """Parse a GeoJSON-order 'west,south,east,north' string into (min_lat, min_lon, max_lat, max_lon)"""
+    parts = [float(p) for p in value.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox must be west,south,east,north")
+    west, south, east, north = parts
+    if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+        raise ValueError("bbox must satisfy west <= east and south <= north within valid coordinates")
+    return south, west, north, east
+
+
+def bbox_contains(bbox: BBox, lat: float, lon: float) -> bool:
+    return bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3]
+
+
+def points_bbox(points: Iterable[Tuple[float, float]], pad_meters: float = 0.0) -> BBox:
+    """Bounding box of (lat, lon) points, optionally padded by a distance"""
+    lats, lons = zip(*points)
+    dlat = pad_meters / METERS_PER_DEGREE_LAT
+    dlon = pad_meters / METERS_PER_DEGREE_LON
+    return min(lats) - dlat, min(lons) - dlon, max(lats) + dlat, max(lons) + dlon
+
+
+def segment_distance_meters(lat: float, lon: float, lat1: float, lon1: float, lat2: float, lon2: float):
+    """
+    Flat-earth distance from a point to a segment, and the position of the
+    closest point along the segment (0..1). Accurate to well under a meter
+    across the city.
+    """
+    px, py = (lon - lon1) * METERS_PER_DEGREE_LON, (lat - lat1) * METERS_PER_DEGREE_LAT
+    sx, sy = (lon2 - lon1) * METERS_PER_DEGREE_LON, (lat2 - lat1) * METERS_PER_DEGREE_LAT
+    length2 = sx * sx + sy * sy
+    t = 0.0 if length2 == 0 else max(0.0, min(1.0, (px * sx + py * sy) / length2))
+    dx, dy = px - t * sx, py - t * sy
+    return math.sqrt(dx * dx + dy * dy), t
+
+
+class GridIndex:
+    """Uniform grid mapping cells to lists of items"""
+
+    def __init__(self, cell_meters: float = 100.0, ref_latitude: float = REFERENCE_LATITUDE):
+        self.cell_meters = cell_meters
+        self.lat_step = cell_meters / METERS_PER_DEGREE_LAT
+        self.lon_step = cell_meters / (METERS_PER_DEGREE_LAT * math.cos(math.radians(ref_latitude)))
+        self.cells: Dict[Cell, List] = {}
+
+    @classmethod
+    def from_points(cls, lats: Sequence[float], lons: Sequence[float], rows: Optional[Iterable[int]] = None,
+                    cell_meters: float = 100.0) -> "GridIndex":
+        """Index point rows (e.g. snapshot rows) by cell"""
+        grid = cls(cell_meters)
+        cells = grid.cells
+        lat_step, lon_step = grid.lat_step, grid.lon_step
+        for row in (range(len(lats)) if rows is None else rows):
+            cell = (math.floor(lats[row] / lat_step), math.floor(lons[row] / lon_step))
+            bucket = cells.get(cell)
+            if bucket is None:
+                cells[cell] = [row]
+            else:
+                bucket.append(row)
+        return grid
+
+    def cell_of(self, lat: float, lon: float) -> Cell:
+        return math.floor(lat / self.lat_step), math.floor(lon / self.lon_step)
+
+    def cells_in_bbox(self, bbox: BBox) -> List[Cell]:
+        """All cells overlapping the box, whether or not they hold items"""
+        min_row, min_col = self.cell_of(bbox[0], bbox[1])
+        max_row, max_col = self.cell_of(bbox[2], bbox[3])
+        return [(r, c) for r in range(min_row, max_row + 1) for c in range(min_col, max_col + 1)]
+
+    def count_cells_in_bbox(self, bbox: BBox) -> int:
+        min_row, min_col = self.cell_of(bbox[0], bbox[1])
+        max_row, max_col = self.cell_of(bbox[2], bbox[3])
+        return (max_row - min_row + 1) * (max_col - min_col + 1)
+
+    def occupied_bbox(self) -> Optional[BBox]:
+        """Box spanned by the cells that hold items; None when the index is empty"""
+        if not self.cells:
+            return None
+        rows = [r for r, _c in self.cells]
+        cols = [c for _r, c in self.cells]
+        return (min(rows) * self.lat_step, min(cols) * self.lon_step,
+                (max(rows) + 1) * self.lat_step, (max(cols) + 1) * self.lon_step)
+
+    def radius_bbox(self, lat: float, lon: float, radius_meters: float) -> BBox:
+        """Bounding box of a circle, padded slightly for the flat-grid approximation"""
+        dlat = radius_meters * 1.01 / METERS_PER_DEGREE_LAT
+        dlon = radius_meters * 1.01 / (METERS_PER_DEGREE_LAT * max(0.01, math.cos(math.radians(lat))))
+        return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+    def cells_in_radius(self, lat: float, lon: float, radius_meters: float) -> List[Cell]:
+        return self.cells_in_bbox(self.radius_bbox(lat, lon, radius_meters))
+
+    def add(self, cell: Cell, item: Hashable):
+        bucket = self.cells.get(cell)
+        if bucket is None:
+            self.cells[cell] = [item]
+        else:
+            bucket.append(item)
+
+    def discard(self, cell: Cell, item: Hashable):
+        bucket = self.cells.get(cell)
+        if bucket is None:
+            return
+        try:
+            bucket.remove(item)
+        except ValueError:
+            return
+        if not bucket:
+            del self.cells[cell]
+
+    def items_in_cells(self, cells: Iterable[Cell]) -> Iterator:
+        get = self.cells.get
+        for cell in cells:
+            bucket = get(cell)
+            if bucket:
+                yield from bucket
+
+    def query_bbox(self, bbox: BBox) -> Iterator:
+        """Items in cells overlapping the box (a superset of the items inside it)"""
+        if self.count_cells_in_bbox(bbox) > len(self.cells):
+            # Large boxes: walking the occupied cells is cheaper than the range
+            min_row, min_col = self.cell_of(bbox[0], bbox[1])
+            max_row, max_col = self.cell_of(bbox[2], bbox[3])
+            for (r, c), bucket in self.cells.items():
+                if min_row <= r <= max_row and min_col <= c <= max_col:
+                    yield from bucket
+            return
+        yield from self.items_in_cells(self.cells_in_bbox(bbox))
+
+    def query_radius(self, lat: float, lon: float, radius_meters: float) -> Iterator:
+        return self.query_bbox(self.radius_bbox(lat, lon, radius_meters))
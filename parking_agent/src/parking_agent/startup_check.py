@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Melbourne Parking Agent - Startup Budget Check
+Fails when importing the HTTP API becomes slow or pulls in the crewAI stack.
+
+Run it in CI (see cloudbuild.yaml) or locally:
+
+    python -m parking_agent.startup_check --budget-ms 1500
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+TARGET_MODULE = "parking_agent.api"
+
+# Heavy agent-framework packages the HTTP API must never import at startup
+FORBIDDEN_PREFIXES = ("crewai", "langchain", "litellm", "openai", "chromadb")
+
+DEFAULT_BUDGET_MS = float(os.getenv("PARKING_STARTUP_BUDGET_MS", "1500"))
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure_import(module: str = TARGET_MODULE) -> Dict[str, Any]:
+    """Import `module` in a fresh interpreter and report wall time and loaded modules"""
+    result = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(module=module)],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    # The module may print at import time; the probe's JSON is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def check_startup(module: str = TARGET_MODULE, budget_ms: float = DEFAULT_BUDGET_MS,
+                  runs: int = 3) -> List[str]:
+    """Return a list of violations; empty when the startup budget holds"""
+    samples = [measure_import(module) for _ in range(max(1, runs))]
+    # Best of N filters out noisy neighbours on shared CI machines
+    best_ms = min(sample["seconds"] for sample in samples) * 1000
+    print(f"import {module}: best of {len(samples)} = {best_ms:.0f} ms (budget {budget_ms:.0f} ms)")
+
+    problems = []
+    if best_ms > budget_ms:
+        problems.append(f"import {module} took {best_ms:.0f} ms, over the {budget_ms:.0f} ms budget")
+
+    forbidden = [name for name in samples[0]["modules"]
+                 if name.split(".")[0] in FORBIDDEN_PREFIXES]
+    if forbidden:
+        roots = sorted({name.split(".")[0] for name in forbidden})
+        problems.append(f"import {module} loaded agent-framework packages: {', '.join(roots)}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the parking API import-time startup budget")
+    parser.add_argument("--module", default=TARGET_MODULE, help="Module to import")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Maximum import time")
+    parser.add_argument("--runs", type=int, default=3, help="Number of fresh-interpreter imports to time")
+    args = parser.parse_args()
+
+    problems = check_startup(args.module, args.budget_ms, args.runs)
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if problems:
+        sys.exit(1)
+    print("OK: startup budget holds")
+
+
+if __name__ == "__main__":
+    main()
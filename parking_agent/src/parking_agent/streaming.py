@@ -0,0 +1,204 @@
+"""
+Melbourne Parking Agent - Live Availability Stream
+Server-Sent Events of bay status changes inside a map viewport.
+
+Each connected client registers its bounding box in a grid index of
+subscriptions. When a new snapshot is installed, its diff against the previous
+version is computed once, each changed bay is looked up in the subscription
+grid, and every affected client receives a single message holding only the
+changes inside its viewport. A bay whose coordinates changed counts as a
+change where it now is, and as a removal for viewports that only held its old
+position. Per-bay JSON is encoded once per diff and shared
+by all clients, so the cost of a refresh grows with the number of changes and
+interested clients, not with the number of open connections.
+"""
+
+import asyncio
+import itertools
+import json
+import math
+from typing import AsyncIterator, Dict, List, Optional
+
+from parking_agent import metrics
+from parking_agent.snapshot import Snapshot, SnapshotDiff, SnapshotStore, STATUS_NAMES
+from parking_agent.spatial import BBox, GridIndex, bbox_contains
+
+HEARTBEAT_SECONDS = 15.0
+
+STREAM_CLIENTS = metrics.Gauge("parking_stream_clients", "Open Server-Sent Events connections")
+STREAM_MESSAGES = metrics.Counter("parking_stream_messages", "Change messages queued for stream clients")
+STREAM_RESETS = metrics.Counter("parking_stream_resets", "Stream clients resent full state after falling behind")
+
+
+def bay_json(snapshot: Snapshot, row: int) -> str:
+    """Compact JSON object for one bay"""
+    status_ts = snapshot.status_ts[row]
+    return json.dumps({
+        "bay_id": snapshot.bay_id(row),
+        "status": STATUS_NAMES[snapshot.status[row]],
+        "latitude": snapshot.lats[row],
+        "longitude": snapshot.lons[row],
+        "status_timestamp": None if math.isnan(status_ts) else status_ts,
+    }, separators=(",", ":"))
+
+
+def format_event(event: str, event_id: int, data: str) -> str:
+    return f"event: {event}\nid: {event_id}\ndata: {data}\n\n"
+
+
+class ViewportSubscription:
+    """One connected client and its pending messages"""
+
+    __slots__ = ("id", "bbox", "queue", "overflowed", "cells")
+
+    def __init__(self, subscription_id: int, bbox: BBox, max_queue: int):
+        self.id = subscription_id
+        self.bbox = bbox
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.overflowed = False
+        self.cells: List = []
+
+    def push(self, message: str):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Slow client: drop the backlog and resend full state when it catches up
+            self.overflowed = True
+
+
+class StreamHub:
+    """Fans snapshot diffs out to viewport subscriptions through a spatial index"""
+
+    def __init__(self, cell_meters: float = 250.0, max_queue: int = 64, max_cells: int = 1024):
+        self.index = GridIndex(cell_meters)
+        self.max_queue = max_queue
+        # Viewports spanning more cells than this are checked against every change instead
+        self.max_cells = max_cells
+        self.wide: Dict[int, ViewportSubscription] = {}
+        self.subscriptions: Dict[int, ViewportSubscription] = {}
+        self._ids = itertools.count(1)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def attach(self, store: SnapshotStore, loop: asyncio.AbstractEventLoop):
+        """Receive new snapshots from the store and deliver on `loop`"""
+        self._loop = loop
+        store.add_listener(self.on_snapshot)
+
+    def subscribe(self, bbox: BBox) -> ViewportSubscription:
+        sub = ViewportSubscription(next(self._ids), bbox, self.max_queue)
+        self.subscriptions[sub.id] = sub
+        if self.index.count_cells_in_bbox(bbox) > self.max_cells:
+            self.wide[sub.id] = sub
+        else:
+            sub.cells = self.index.cells_in_bbox(bbox)
+            for cell in sub.cells:
+                self.index.add(cell, sub)
+        STREAM_CLIENTS.set(len(self.subscriptions))
+        return sub
+
+    def unsubscribe(self, sub: ViewportSubscription):
+        self.subscriptions.pop(sub.id, None)
+        self.wide.pop(sub.id, None)
+        for cell in sub.cells:
+            self.index.discard(cell, sub)
+        STREAM_CLIENTS.set(len(self.subscriptions))
+
+    def on_snapshot(self, previous: Optional[Snapshot], current: Snapshot):
+        """Store listener; may run on the refresher thread"""
+        if not self.subscriptions or self._loop is None or previous is None:
+            return
+        diff = current.diff(previous)
+        if len(diff) or diff.moved:
+            self._loop.call_soon_threadsafe(self.fan_out, diff)
+
+    def _targets(self, lat: float, lon: float):
+        bucket = self.index.cells.get(self.index.cell_of(lat, lon))
+        if bucket:
+            yield from bucket
+        if self.wide:
+            yield from self.wide.values()
+
+    def fan_out(self, diff: SnapshotDiff):
+        """Queue one message per subscription with the changes inside its viewport"""
+        snapshot = diff.snapshot
+        lats, lons = snapshot.lats, snapshot.lons
+        changed: Dict[int, List[str]] = {}
+        removed: Dict[int, List[str]] = {}
+
+        rows = diff.changed_rows
+        if diff.moved:
+            rows = list(dict.fromkeys(itertools.chain(rows, (row for row, _lat, _lon in diff.moved))))
+        for row in rows:
+            lat, lon = lats[row], lons[row]
+            encoded = None
+            for sub in self._targets(lat, lon):
+                if bbox_contains(sub.bbox, lat, lon):
+                    if encoded is None:
+                        encoded = bay_json(snapshot, row)
+                    changed.setdefault(sub.id, []).append(encoded)
+
+        for bay_id, lat, lon in diff.removed:
+            for sub in self._targets(lat, lon):
+                if bbox_contains(sub.bbox, lat, lon):
+                    removed.setdefault(sub.id, []).append(json.dumps(str(bay_id)))
+
+        # A moved bay leaves the viewports that held only its old position
+        for row, old_lat, old_lon in diff.moved:
+            lat, lon = lats[row], lons[row]
+            for sub in self._targets(old_lat, old_lon):
+                if bbox_contains(sub.bbox, old_lat, old_lon) and not bbox_contains(sub.bbox, lat, lon):
+                    removed.setdefault(sub.id, []).append(json.dumps(snapshot.bay_id(row)))
+
+        for sub_id in changed.keys() | removed.keys():
+            sub = self.subscriptions.get(sub_id)
+            if sub is None:
+                continue
+            data = '{"version":%d,"bays":[%s],"removed":[%s]}' % (
+                diff.version, ",".join(changed.get(sub_id, ())), ",".join(removed.get(sub_id, ())))
+            sub.push(format_event("changes", diff.version, data))
+            STREAM_MESSAGES.inc()
+
+
+def viewport_state(snapshot: Snapshot, bbox: BBox) -> str:
+    """Full state of all bays inside a viewport as one SSE event"""
+    lats, lons = snapshot.lats, snapshot.lons
+    bays = [bay_json(snapshot, row) for row in snapshot.grid.query_bbox(bbox)
+            if bbox_contains(bbox, lats[row], lons[row])]
+    data = '{"version":%d,"bays":[%s]}' % (snapshot.version, ",".join(bays))
+    return format_event("snapshot", snapshot.version, data)
+
+
+async def stream_viewport(hub: StreamHub, store: SnapshotStore, bbox: BBox,
+                          heartbeat: float = HEARTBEAT_SECONDS) -> AsyncIterator[str]:
+    """SSE body: initial viewport state, then change messages and heartbeats"""
+    # Subscribe before reading the snapshot so no version falls between the two
+    sub = hub.subscribe(bbox)
+    try:
+        snapshot = store.current()
+        if snapshot is not None:
+            yield viewport_state(snapshot, bbox)
+
+        while True:
+            try:
+                message = await asyncio.wait_for(sub.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                if sub.overflowed:
+                    message = None
+                else:
+                    yield ": ping\n\n"
+                    continue
+
+            if sub.overflowed:
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                sub.overflowed = False
+                STREAM_RESETS.inc()
+                snapshot = store.current()
+                if snapshot is not None:
+                    yield viewport_state(snapshot, bbox)
+                continue
+            yield message
+    finally:
+        hub.unsubscribe(sub)
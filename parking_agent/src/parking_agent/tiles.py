@@ -0,0 +1,186 @@
+"""
+Melbourne Parking Agent - Map Tiles
+XYZ (web mercator) tiles of every bay and its status, as GeoJSON or a compact binary frame.
+
+Tiles are generated lazily on first request and cached with the snapshot
+version they were built from, which is also their ETag. When a new snapshot is
+installed, only cached tiles containing a bay whose status changed (or that
+appeared, left the feed, or moved out of or into the tile) are dropped; every other tile keeps its body and
+ETag, so map clients revalidate them with a 304.
+
+Binary tiles (little endian):
+
+    header   magic "PKTILE01", version u64, count u32, z u8, pad[3]   (24 bytes)
+    columns  bay_ids q[n], x u16[n], y u16[n], status B[n]
+
+x and y are the bay position inside the tile on a 0..65535 grid, west to east
+and north to south.
+"""
+
+import json
+import math
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from parking_agent import metrics
+from parking_agent.snapshot import STATUS_NAMES, Snapshot
+from parking_agent.spatial import bbox_contains
+
+MIN_ZOOM = 12
+MAX_ZOOM = 20
+TILE_MAGIC = b"PKTILE01"
+TILE_HEADER = struct.Struct("<8sQIB3x")
+TILE_EXTENT = 65535
+FORMATS = {"geojson": "application/geo+json", "bin": "application/vnd.parking.tile"}
+
+TILE_REQUESTS = metrics.Counter("parking_tile_requests", "Tile requests", ["result"])
+TILES_INVALIDATED = metrics.Counter("parking_tiles_invalidated", "Cached tiles dropped because their bays changed")
+
+TileKey = Tuple[int, int, int]
+
+
+def tile_of(lat: float, lon: float, zoom: int) -> Tuple[int, int]:
+    """XYZ tile containing a point"""
+    n = 1 << zoom
+    lat = max(-85.05112878, min(85.05112878, lat))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bbox(zoom: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """(min_lat, min_lon, max_lat, max_lon) of a tile"""
+    n = 1 << zoom
+
+    def lat_at(row: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return lat_at(y + 1), x / n * 360.0 - 180.0, lat_at(y), (x + 1) / n * 360.0 - 180.0
+
+
+def valid_tile(zoom: int, x: int, y: int) -> bool:
+    return MIN_ZOOM <= zoom <= MAX_ZOOM and 0 <= x < (1 << zoom) and 0 <= y < (1 << zoom)
+
+
+def _tile_rows(snapshot: Snapshot, bbox) -> list:
+    lats, lons = snapshot.lats, snapshot.lons
+    # Half-open on the north and east edges so a bay on a border belongs to one tile
+    return [row for row in snapshot.grid.query_bbox(bbox)
+            if bbox_contains(bbox, lats[row], lons[row]) and lats[row] != bbox[2] and lons[row] != bbox[3]]
+
+
+def encode_geojson(snapshot: Snapshot, zoom: int, x: int, y: int) -> bytes:
+    rows = _tile_rows(snapshot, tile_bbox(zoom, x, y))
+    lats, lons, status = snapshot.lats, snapshot.lons, snapshot.status
+    return json.dumps({
+        "type": "FeatureCollection",
+        "version": snapshot.version,
+        "features": [{
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lons[row], lats[row]]},
+            "properties": {"bay_id": snapshot.bay_id(row), "status": STATUS_NAMES[status[row]]},
+        } for row in rows],
+    }, separators=(",", ":")).encode()
+
+
+def encode_binary(snapshot: Snapshot, zoom: int, x: int, y: int) -> bytes:
+    bbox = tile_bbox(zoom, x, y)
+    rows = _tile_rows(snapshot, bbox)
+    n = 1 << zoom
+    lats, lons = snapshot.lats, snapshot.lons
+    xs, ys = array('H'), array('H')
+    for row in rows:
+        # Position in mercator units relative to the tile's north-west corner
+        fx = (lons[row] + 180.0) / 360.0 * n - x
+        fy = (1.0 - math.asinh(math.tan(math.radians(lats[row]))) / math.pi) / 2.0 * n - y
+        xs.append(min(TILE_EXTENT, max(0, int(fx * TILE_EXTENT))))
+        ys.append(min(TILE_EXTENT, max(0, int(fy * TILE_EXTENT))))
+    ids = array('q', (snapshot.bay_ids[row] for row in rows))
+    status = array('B', (snapshot.status[row] for row in rows))
+    header = TILE_HEADER.pack(TILE_MAGIC, snapshot.version, len(rows), zoom)
+    return b"".join((header, ids.tobytes(), xs.tobytes(), ys.tobytes(), status.tobytes()))
+
+
+ENCODERS = {"geojson": encode_geojson, "bin": encode_binary}
+
+
+class TileCache:
+    """Lazily built tiles, invalidated per tile from snapshot diffs"""
+
+    def __init__(self, max_tiles: int = 4096):
+        self.max_tiles = max_tiles
+        # (format, z, x, y) -> (version built from, body)
+        self._tiles: "OrderedDict[Tuple[str, int, int, int], Tuple[int, bytes]]" = OrderedDict()
+        # Cached tile keys per (z, x, y), for invalidation
+        self._by_tile: Dict[TileKey, set] = {}
+        self.version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def on_snapshot(self, previous: Optional[Snapshot], current: Snapshot):
+        """Store listener: drop the cached tiles whose bays changed"""
+        if previous is None:
+            with self._lock:
+                self._clear(current.version)
+            return
+
+        diff = current.diff(previous)
+        points = [(current.lats[row], current.lons[row]) for row in diff.changed_rows]
+        points.extend((lat, lon) for _bay_id, lat, lon in diff.removed)
+        # A moved bay leaves the tiles of its old position and enters those of its new one
+        for row, lat, lon in diff.moved:
+            points.append((lat, lon))
+            points.append((current.lats[row], current.lons[row]))
+        touched = set()
+        for lat, lon in points:
+            if lat != lat:
+                continue
+            for zoom in range(MIN_ZOOM, MAX_ZOOM + 1):
+                touched.add((zoom,) + tile_of(lat, lon, zoom))
+
+        with self._lock:
+            if self.version is not None and previous.version != self.version:
+                # Missed a version: the diff does not cover everything since the cached tiles
+                self._clear(current.version)
+                return
+            dropped = 0
+            for tile in touched & self._by_tile.keys():
+                for key in self._by_tile.pop(tile):
+                    if self._tiles.pop(key, None) is not None:
+                        dropped += 1
+            self.version = current.version
+        TILES_INVALIDATED.inc(dropped)
+
+    def _clear(self, version: int):
+        self._tiles.clear()
+        self._by_tile.clear()
+        self.version = version
+
+    def get(self, snapshot: Snapshot, fmt: str, zoom: int, x: int, y: int) -> Tuple[int, bytes]:
+        """(content version, body) of a tile, building it from `snapshot` if not cached"""
+        key = (fmt, zoom, x, y)
+        with self._lock:
+            cached = self._tiles.get(key)
+            if cached is not None and self.version == snapshot.version:
+                self._tiles.move_to_end(key)
+                TILE_REQUESTS.labels("hit").inc()
+                return cached
+
+        body = ENCODERS[fmt](snapshot, zoom, x, y)
+        entry = (snapshot.version, body)
+        TILE_REQUESTS.labels("miss").inc()
+        with self._lock:
+            # A tile built from an older version than the cache tracks would be stale
+            if self.version == snapshot.version:
+                self._tiles[key] = entry
+                self._by_tile.setdefault((zoom, x, y), set()).add(key)
+                while len(self._tiles) > self.max_tiles:
+                    (old_fmt, z, tx, ty), _ = self._tiles.popitem(last=False)
+                    keys = self._by_tile.get((z, tx, ty))
+                    if keys is not None:
+                        keys.discard((old_fmt, z, tx, ty))
+                        if not keys:
+                            del self._by_tile[(z, tx, ty)]
+        return entry
@@ -0,0 +1,234 @@
+"""
+Melbourne Parking Agent - Tracing
+Lightweight per-request span tracing exported as Zipkin v2 JSON.
+
+A trace is started per request with a head-sampling decision. Stages are
+recorded retroactively from perf_counter marks the pipeline already takes, so
+an unsampled request only pays for a context variable lookup per stage.
+Configuration comes from the environment:
+
+    PARKING_TRACE_SAMPLE_RATE  fraction of requests to trace (default 0.01)
+    PARKING_TRACE_SLOW_MS      also export any request slower than this (0 = off)
+    PARKING_TRACE_FILE         append spans as JSON lines to this file
+    PARKING_TRACE_ENDPOINT     POST span batches to a Zipkin-compatible collector,
+                               e.g. http://localhost:9411/api/v2/spans
+"""
+
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+SERVICE_NAME = "parking-agent"
+
+# Offset that turns perf_counter() readings into Unix time
+_EPOCH_OFFSET = time.time() - time.perf_counter()
+
+
+class Trace:
+    """Spans collected for one request"""
+
+    __slots__ = ("trace_id", "root_id", "sampled", "spans", "tags")
+
+    def __init__(self, sampled: bool):
+        self.trace_id = "%032x" % random.getrandbits(128)
+        self.root_id = "%016x" % random.getrandbits(64)
+        self.sampled = sampled
+        # (name, start perf_counter, end perf_counter, tags)
+        self.spans: List[tuple] = []
+        self.tags: Dict[str, str] = {}
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("parking_trace", default=None)
+
+
+class FileExporter:
+    """Append spans as JSON lines to a local file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Dict[str, Any]]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span) + "\n")
+
+
+class ZipkinExporter:
+    """POST span batches to a Zipkin v2 collector endpoint"""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def export(self, spans: List[Dict[str, Any]]):
+        import requests
+        requests.post(self.endpoint, json=spans, timeout=self.timeout)
+
+
+class BatchProcessor:
+    """Hands finished spans to exporters from a background thread"""
+
+    def __init__(self, exporters: List[Any], max_batch: int = 200, flush_interval: float = 2.0,
+                 max_queue: int = 10000):
+        self.exporters = exporters
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._worker, name="parking-trace-export", daemon=True)
+        self._thread.start()
+
+    def submit(self, spans: List[Dict[str, Any]]):
+        for span in spans:
+            try:
+                self._queue.put_nowait(span)
+            except queue.Full:
+                # Never block a request on the exporter
+                self.dropped += 1
+
+    def _worker(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    span = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if span is _STOP:
+                    stopping = True
+                    break
+                batch.append(span)
+            if batch:
+                self._export(batch)
+
+    def _export(self, batch: List[Dict[str, Any]]):
+        for exporter in self.exporters:
+            try:
+                exporter.export(batch)
+            except Exception as e:
+                print(f"Trace export failed: {e}")
+
+    def shutdown(self, timeout: float = 5.0):
+        """Export everything queued so far and stop the worker thread"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+
+_STOP = object()
+
+
+class Tracer:
+    """Starts traces, records stage spans and exports finished traces"""
+
+    def __init__(self, sample_rate: float = 0.0, slow_threshold: float = 0.0,
+                 processor: Optional[BatchProcessor] = None):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.processor = processor
+
+    @property
+    def enabled(self) -> bool:
+        return self.processor is not None and (self.sample_rate > 0 or self.slow_threshold > 0)
+
+    def shutdown(self):
+        if self.processor is not None:
+            self.processor.shutdown()
+
+    @contextmanager
+    def trace(self, name: str, **tags: Any):
+        """Root span for one request; yields the Trace or None when not collecting"""
+        if not self.enabled:
+            yield None
+            return
+        sampled = random.random() < self.sample_rate
+        if not sampled and self.slow_threshold <= 0:
+            yield None
+            return
+
+        trace = Trace(sampled)
+        for key, value in tags.items():
+            trace.tags[key] = str(value)
+        token = _current_trace.set(trace)
+        started = time.perf_counter()
+        try:
+            yield trace
+        except BaseException as e:
+            trace.tags["error"] = type(e).__name__
+            raise
+        finally:
+            ended = time.perf_counter()
+            _current_trace.reset(token)
+            if trace.sampled or (ended - started) >= self.slow_threshold > 0:
+                self.processor.submit(self._to_zipkin(trace, name, started, ended))
+
+    def _to_zipkin(self, trace: Trace, name: str, started: float, ended: float) -> List[Dict[str, Any]]:
+        endpoint = {"serviceName": SERVICE_NAME}
+        spans = [{
+            "traceId": trace.trace_id,
+            "id": trace.root_id,
+            "name": name,
+            "kind": "SERVER",
+            "timestamp": int((started + _EPOCH_OFFSET) * 1e6),
+            "duration": max(1, int((ended - started) * 1e6)),
+            "localEndpoint": endpoint,
+            "tags": trace.tags,
+        }]
+        for span_name, span_start, span_end, span_tags in trace.spans:
+            spans.append({
+                "traceId": trace.trace_id,
+                "id": "%016x" % random.getrandbits(64),
+                "parentId": trace.root_id,
+                "name": span_name,
+                "timestamp": int((span_start + _EPOCH_OFFSET) * 1e6),
+                "duration": max(1, int((span_end - span_start) * 1e6)),
+                "localEndpoint": endpoint,
+                "tags": span_tags or {},
+            })
+        return spans
+
+
+def record_span(name: str, start: float, end: float, tags: Optional[Dict[str, str]] = None):
+    """Record a finished stage from perf_counter marks if the request is traced"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append((name, start, end, tags))
+
+
+def annotate(key: str, value: Any):
+    """Attach a tag to the current request's root span"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.tags[key] = str(value)
+
+
+def tracer_from_env() -> Tracer:
+    """Build the process tracer from PARKING_TRACE_* environment variables"""
+    exporters = []
+    trace_file = os.getenv("PARKING_TRACE_FILE")
+    if trace_file:
+        exporters.append(FileExporter(trace_file))
+    endpoint = os.getenv("PARKING_TRACE_ENDPOINT")
+    if endpoint:
+        exporters.append(ZipkinExporter(endpoint))
+
+    processor = BatchProcessor(exporters) if exporters else None
+    return Tracer(
+        sample_rate=float(os.getenv("PARKING_TRACE_SAMPLE_RATE", "0.01")),
+        slow_threshold=float(os.getenv("PARKING_TRACE_SLOW_MS", "0")) / 1000.0,
+        processor=processor,
+    )
+
+
+tracer = tracer_from_env()
@@ -0,0 +1,233 @@
+"""
+Melbourne Parking Agent - Moving-User Tracking
+Sessions that keep a moving user's nearest free bays up to date incrementally.
+
+A session holds the free bays of every snapshot grid cell within its radius,
+keyed by cell. When the user moves, only the cells that entered the radius are
+read from the snapshot and the cells that left are dropped; cells that stay
+covered are not touched. Sessions are also indexed by cell, so when a snapshot
+is installed its diff is applied once per changed bay to the sessions covering
+that bay's cell instead of re-reading every session's area. Ranking the
+candidates by distance is the only per-update work that scales with the radius.
+
+Session ids carry the session's radius and limit ("<radius>-<limit>-<random>"),
+and the rest of a session's state can be rebuilt from the snapshot. A worker
+that receives a position update for a session it does not hold - another
+uvicorn worker created it, or it expired - adopts it instead of answering 404,
+so sessions work behind any process or instance routing.
+"""
+
+import heapq
+import secrets
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from parking_agent import metrics
+from parking_agent.snapshot import STATUS_FREE, Snapshot
+from parking_agent.spatial import Cell, haversine_meters
+from parking_agent.streaming import bay_json
+
+SESSION_TTL_SECONDS = 600.0
+MAX_SESSIONS = 10000
+MIN_RADIUS_METERS = 50
+MAX_RADIUS_METERS = 2000
+MAX_LIMIT = 100
+
+TRACKING_SESSIONS = metrics.Gauge("parking_tracking_sessions", "Open moving-user tracking sessions")
+TRACKING_CELLS = metrics.Counter("parking_tracking_cells_loaded", "Grid cells read for tracking sessions", ["reason"])
+TRACKING_ADOPTED = metrics.Counter(
+    "parking_tracking_sessions_adopted", "Position updates for sessions created elsewhere or expired")
+
+
+class TrackingSession:
+    """One moving user: position, radius and the free bays of the covered cells"""
+
+    __slots__ = ("id", "latitude", "longitude", "radius", "limit", "version", "cells", "last_seen", "last_result")
+
+    def __init__(self, session_id: str, latitude: float, longitude: float, radius: int, limit: int):
+        self.id = session_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius
+        self.limit = limit
+        self.version: Optional[int] = None
+        # cell -> {bay_id: (lat, lon)} of the free bays in it
+        self.cells: Dict[Cell, Dict[int, Tuple[float, float]]] = {}
+        self.last_seen = time.monotonic()
+        self.last_result: Tuple[int, ...] = ()
+
+
+def parse_session_id(session_id: str) -> Optional[Tuple[int, int]]:
+    """(radius, limit) encoded in a session id; None when the id is malformed"""
+    parts = session_id.split("-", 2)
+    if len(parts) != 3 or not parts[0].isdigit() or not parts[1].isdigit() or not parts[2]:
+        return None
+    radius, limit = int(parts[0]), int(parts[1])
+    if not (MIN_RADIUS_METERS <= radius <= MAX_RADIUS_METERS) or not (1 <= limit <= MAX_LIMIT):
+        return None
+    return radius, limit
+
+
+def _free_bays(snapshot: Snapshot, cell: Cell) -> Dict[int, Tuple[float, float]]:
+    bay_ids, lats, lons, status = snapshot.bay_ids, snapshot.lats, snapshot.lons, snapshot.status
+    return {bay_ids[row]: (lats[row], lons[row])
+            for row in snapshot.grid.cells.get(cell, ()) if status[row] == STATUS_FREE}
+
+
+class TrackingRegistry:
+    """Tracking sessions plus a reverse index of the cells each one covers"""
+
+    def __init__(self, ttl_seconds: float = SESSION_TTL_SECONDS, max_sessions: int = MAX_SESSIONS):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.sessions: Dict[str, TrackingSession] = {}
+        self.watchers: Dict[Cell, Set[str]] = {}
+        # Version the sessions' cells reflect, advanced by on_snapshot
+        self.version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _cover(self, session: TrackingSession, snapshot: Snapshot, reload: bool = False):
+        """Bring the session's cells in line with its position; only entered cells are read"""
+        wanted = set(snapshot.grid.cells_in_radius(session.latitude, session.longitude, session.radius))
+        covered = session.cells
+        if reload:
+            for cell in covered:
+                covered[cell] = _free_bays(snapshot, cell)
+            TRACKING_CELLS.labels("resync").inc(len(covered))
+        for cell in [cell for cell in covered if cell not in wanted]:
+            del covered[cell]
+            watchers = self.watchers.get(cell)
+            if watchers is not None:
+                watchers.discard(session.id)
+                if not watchers:
+                    del self.watchers[cell]
+        entered = wanted.difference(covered)
+        for cell in entered:
+            covered[cell] = _free_bays(snapshot, cell)
+            self.watchers.setdefault(cell, set()).add(session.id)
+        TRACKING_CELLS.labels("entered").inc(len(entered))
+        session.version = snapshot.version
+
+    def _expire(self, now: float):
+        stale = [sid for sid, session in self.sessions.items() if now - session.last_seen > self.ttl_seconds]
+        for sid in stale:
+            self._drop(sid)
+
+    def _drop(self, session_id: str) -> bool:
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        for cell in session.cells:
+            watchers = self.watchers.get(cell)
+            if watchers is not None:
+                watchers.discard(session_id)
+                if not watchers:
+                    del self.watchers[cell]
+        TRACKING_SESSIONS.set(len(self.sessions))
+        return True
+
+    def _open(self, session_id: str, snapshot: Snapshot, latitude: float, longitude: float, radius: int,
+              limit: int) -> TrackingSession:
+        self._expire(time.monotonic())
+        if len(self.sessions) >= self.max_sessions:
+            raise ValueError("Too many tracking sessions")
+        session = TrackingSession(session_id, latitude, longitude, radius, limit)
+        self.sessions[session.id] = session
+        self._cover(session, snapshot)
+        TRACKING_SESSIONS.set(len(self.sessions))
+        return session
+
+    def create(self, snapshot: Snapshot, latitude: float, longitude: float, radius: int,
+               limit: int = 20) -> TrackingSession:
+        session_id = f"{radius}-{limit}-{secrets.token_urlsafe(12)}"
+        with self._lock:
+            return self._open(session_id, snapshot, latitude, longitude, radius, limit)
+
+    def move(self, session_id: str, snapshot: Snapshot, latitude: float, longitude: float) -> Optional[TrackingSession]:
+        """
+        Update a session's position. A well-formed id this registry does not
+        hold is adopted with a fresh cover; None only for malformed ids.
+        """
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                described = parse_session_id(session_id)
+                if described is None:
+                    return None
+                TRACKING_ADOPTED.inc()
+                return self._open(session_id, snapshot, latitude, longitude, *described)
+            session.latitude, session.longitude = latitude, longitude
+            session.last_seen = time.monotonic()
+            # Diffs were not applied to this session (missed version or lagging listener)
+            self._cover(session, snapshot, reload=session.version != snapshot.version)
+            return session
+
+    def remove(self, session_id: str) -> bool:
+        """
+        Drop the session here; False only for malformed ids. Copies adopted by
+        other workers are not reachable from this one and expire after the TTL.
+        """
+        with self._lock:
+            return self._drop(session_id) or parse_session_id(session_id) is not None
+
+    def on_snapshot(self, previous: Optional[Snapshot], current: Snapshot):
+        """Store listener: apply the diff to the sessions covering each changed bay"""
+        with self._lock:
+            if previous is None or self.version != previous.version:
+                # Sessions resync lazily on their next move
+                self.version = current.version
+                return
+            self.version = current.version
+            if not self.sessions:
+                return
+            diff = current.diff(previous)
+            grid = current.grid
+            bay_ids, lats, lons, status = current.bay_ids, current.lats, current.lons, current.status
+            # A moved bay leaves its old cell and is filed again under the new one
+            for row, lat, lon in diff.moved:
+                if lat != lat:
+                    continue
+                cell = grid.cell_of(lat, lon)
+                for sid in self.watchers.get(cell, ()):
+                    self.sessions[sid].cells[cell].pop(bay_ids[row], None)
+            for row in set(diff.changed_rows).union(row for row, _lat, _lon in diff.moved):
+                cell = grid.cell_of(lats[row], lons[row])
+                for sid in self.watchers.get(cell, ()):
+                    bays = self.sessions[sid].cells[cell]
+                    if status[row] == STATUS_FREE:
+                        bays[bay_ids[row]] = (lats[row], lons[row])
+                    else:
+                        bays.pop(bay_ids[row], None)
+            for bay_id, lat, lon in diff.removed:
+                if lat != lat:
+                    continue
+                cell = grid.cell_of(lat, lon)
+                for sid in self.watchers.get(cell, ()):
+                    self.sessions[sid].cells[cell].pop(bay_id, None)
+            for session in self.sessions.values():
+                if session.version == previous.version:
+                    session.version = current.version
+
+    def nearest(self, session: TrackingSession) -> List[Tuple[float, int]]:
+        """(distance meters, bay_id) of the session's nearest free bays within its radius"""
+        lat, lon, radius = session.latitude, session.longitude, session.radius
+        with self._lock:
+            candidates = [(haversine_meters(lat, lon, bay_lat, bay_lon), bay_id)
+                          for bays in session.cells.values() for bay_id, (bay_lat, bay_lon) in bays.items()]
+        return heapq.nsmallest(session.limit, (c for c in candidates if c[0] <= radius))
+
+    def response(self, session: TrackingSession, snapshot: Snapshot) -> bytes:
+        """Pre-serialized session state; `changed` tells clients whether the ranking moved"""
+        nearest = self.nearest(session)
+        rows = snapshot.row_by_bay
+        bays = []
+        for distance, bay_id in nearest:
+            row = rows.get(bay_id)
+            if row is not None:
+                bays.append('%s,"distance_meters":%d}' % (bay_json(snapshot, row)[:-1], int(round(distance))))
+        ranking = tuple(bay_id for _distance, bay_id in nearest)
+        changed = ranking != session.last_result
+        session.last_result = ranking
+        return ('{"session_id":"%s","version":%d,"changed":%s,"count":%d,"bays":[%s]}' % (
+            session.id, snapshot.version, "true" if changed else "false", len(bays), ",".join(bays))).encode()
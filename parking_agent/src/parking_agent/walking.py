@@ -0,0 +1,244 @@
+"""
+Melbourne Parking Agent - Walking Distances
+Street-graph walking distances for ranking bays, from a local OpenStreetMap extract.
+
+Straight-line distance misranks bays on the other side of the Yarra or of a
+rail corridor. When PARKING_STREET_GRAPH points to an OSM extract (.osm XML or
+Overpass .json), walkable ways are compiled into a compact undirected graph:
+node coordinates in typed arrays and adjacency in CSR form (offsets, targets,
+edge lengths in meters).
+
+A ranked search snaps the query point and the top straight-line candidates to
+their nearest graph nodes and runs one Dijkstra from the query node. The search
+is bounded by the radius times MAX_DETOUR and stops as soon as every candidate
+node is settled, so it only explores the streets around the query.
+"""
+
+import heapq
+import json
+import math
+import os
+import xml.etree.ElementTree as ElementTree
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from parking_agent import metrics
+from parking_agent.spatial import METERS_PER_DEGREE_LAT, METERS_PER_DEGREE_LON, GridIndex
+
+# Ways a pedestrian can use; motorways and their ramps are excluded
+WALKABLE_HIGHWAYS = frozenset((
+    "trunk", "trunk_link", "primary", "primary_link", "secondary", "secondary_link", "tertiary",
+    "tertiary_link", "unclassified", "residential", "living_street", "service", "pedestrian",
+    "footway", "path", "steps", "cycleway", "track", "corridor", "crossing",
+))
+# Candidates further than this from any street node keep their straight-line distance
+SNAP_METERS = 150.0
+# Paths longer than radius * MAX_DETOUR are not explored
+MAX_DETOUR = 2.5
+# Straight-line candidates re-ranked by walking distance
+RERANK_CANDIDATES = 60
+
+GRAPH_NODES = metrics.Gauge("parking_street_graph_nodes", "Nodes in the walking street graph")
+DIJKSTRA_SETTLED = metrics.Histogram(
+    "parking_walking_settled_nodes", "Graph nodes settled per walking-distance search",
+    buckets=(100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000))
+
+
+def _flat_meters(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    return math.hypot((lat2 - lat1) * METERS_PER_DEGREE_LAT, (lon2 - lon1) * METERS_PER_DEGREE_LON)
+
+
+def _walkable(tags: Dict[str, str]) -> bool:
+    if tags.get("highway") not in WALKABLE_HIGHWAYS:
+        return False
+    return tags.get("foot") not in ("no", "private") and tags.get("access") not in ("no", "private")
+
+
+def read_osm_xml(path: str) -> Tuple[Dict[int, Tuple[float, float]], List[List[int]]]:
+    """(node id -> (lat, lon), walkable ways as node id lists) from an .osm file"""
+    nodes: Dict[int, Tuple[float, float]] = {}
+    ways: List[List[int]] = []
+    refs: List[int] = []
+    tags: Dict[str, str] = {}
+    for _event, element in ElementTree.iterparse(path, events=("end",)):
+        tag = element.tag
+        if tag == "node":
+            nodes[int(element.get("id"))] = (float(element.get("lat")), float(element.get("lon")))
+            tags = {}
+            element.clear()
+        elif tag == "nd":
+            refs.append(int(element.get("ref")))
+        elif tag == "tag":
+            tags[element.get("k")] = element.get("v")
+        elif tag == "way":
+            if _walkable(tags):
+                ways.append(refs)
+            refs, tags = [], {}
+            element.clear()
+        elif tag == "relation":
+            refs, tags = [], {}
+            element.clear()
+    return nodes, ways
+
+
+def read_overpass_json(path: str) -> Tuple[Dict[int, Tuple[float, float]], List[List[int]]]:
+    """Same as read_osm_xml, for Overpass API JSON output"""
+    with open(path, encoding="utf-8") as f:
+        elements = json.load(f).get("elements", [])
+    nodes = {e["id"]: (e["lat"], e["lon"]) for e in elements if e.get("type") == "node"}
+    ways = [e["nodes"] for e in elements if e.get("type") == "way" and _walkable(e.get("tags", {}))]
+    return nodes, ways
+
+
+class StreetGraph:
+    """Undirected walking graph in CSR form with a grid index over its nodes"""
+
+    def __init__(self, lats: array, lons: array, offsets: array, targets: array, lengths: array):
+        self.lats = lats
+        self.lons = lons
+        self.offsets = offsets
+        self.targets = targets
+        self.lengths = lengths
+        self.grid = GridIndex.from_points(lats, lons)
+        GRAPH_NODES.set(len(lats))
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    @classmethod
+    def from_ways(cls, nodes: Dict[int, Tuple[float, float]], ways: Sequence[Sequence[int]]) -> "StreetGraph":
+        index: Dict[int, int] = {}
+        lats, lons = array('d'), array('d')
+        edges: List[Tuple[int, int, float]] = []
+        for way in ways:
+            previous = None
+            for node_id in way:
+                point = nodes.get(node_id)
+                if point is None:
+                    # Clipped extracts reference nodes outside the extract
+                    previous = None
+                    continue
+                node = index.get(node_id)
+                if node is None:
+                    node = index[node_id] = len(lats)
+                    lats.append(point[0])
+                    lons.append(point[1])
+                if previous is not None and previous != node:
+                    edges.append((previous, node, _flat_meters(lats[previous], lons[previous], point[0], point[1])))
+                previous = node
+
+        degree = [0] * (len(lats) + 1)
+        for a, b, _length in edges:
+            degree[a + 1] += 1
+            degree[b + 1] += 1
+        for i in range(len(lats)):
+            degree[i + 1] += degree[i]
+        offsets = array('I', degree)
+        fill = list(degree[:-1])
+        targets = array('I', bytes(4 * 2 * len(edges)))
+        lengths = array('f', bytes(4 * 2 * len(edges)))
+        for a, b, length in edges:
+            for u, v in ((a, b), (b, a)):
+                targets[fill[u]] = v
+                lengths[fill[u]] = length
+                fill[u] += 1
+        return cls(lats, lons, offsets, targets, lengths)
+
+    @classmethod
+    def from_file(cls, path: str) -> "StreetGraph":
+        reader = read_overpass_json if path.lower().endswith(".json") else read_osm_xml
+        return cls.from_ways(*reader(path))
+
+    def snap(self, lat: float, lon: float, max_meters: float = SNAP_METERS) -> Optional[Tuple[int, float]]:
+        """(nearest node, meters to it), or None when no node is within max_meters"""
+        best, best_distance = None, max_meters
+        lats, lons = self.lats, self.lons
+        for node in self.grid.query_radius(lat, lon, max_meters):
+            distance = _flat_meters(lat, lon, lats[node], lons[node])
+            if distance <= best_distance:
+                best, best_distance = node, distance
+        return None if best is None else (best, best_distance)
+
+    def shortest_paths(self, source: int, goals: set, max_meters: float) -> Dict[int, float]:
+        """
+        Dijkstra from `source`, stopping once every goal node is settled or the
+        frontier passes max_meters. Returns settled distances of the goal nodes.
+        """
+        offsets, targets, lengths = self.offsets, self.targets, self.lengths
+        best: Dict[int, float] = {source: 0.0}
+        found: Dict[int, float] = {}
+        remaining = len(goals)
+        heap = [(0.0, source)]
+        settled = 0
+        while heap and remaining:
+            distance, node = heapq.heappop(heap)
+            if distance > best[node]:
+                continue
+            if distance > max_meters:
+                break
+            settled += 1
+            if node in goals and node not in found:
+                found[node] = distance
+                remaining -= 1
+            for edge in range(offsets[node], offsets[node + 1]):
+                target = targets[edge]
+                candidate = distance + lengths[edge]
+                if candidate < best.get(target, math.inf):
+                    best[target] = candidate
+                    heapq.heappush(heap, (candidate, target))
+        DIJKSTRA_SETTLED.observe(settled)
+        return found
+
+    def walking_distances(self, lat: float, lon: float, points: Sequence[Tuple[float, float]],
+                          max_meters: float) -> List[Optional[float]]:
+        """
+        Walking meters from (lat, lon) to each point: None when the origin or the
+        point is off the graph, inf when the path is longer than max_meters.
+        """
+        origin = self.snap(lat, lon)
+        if origin is None:
+            return [None] * len(points)
+        snapped = [self.snap(point_lat, point_lon) for point_lat, point_lon in points]
+        goals = {hit[0] for hit in snapped if hit is not None}
+        paths = self.shortest_paths(origin[0], goals, max_meters)
+        distances: List[Optional[float]] = []
+        for hit in snapped:
+            if hit is None:
+                distances.append(None)
+            else:
+                path = paths.get(hit[0])
+                distances.append(math.inf if path is None else origin[1] + path + hit[1])
+        return distances
+
+    def rerank(self, lat: float, lon: float, candidates: Sequence[Tuple[int, int]], lats: Sequence[float],
+               lons: Sequence[float], radius: float, limit: int = 20) -> List[Tuple[int, int]]:
+        """
+        Top `limit` (walking meters, row) among the nearest straight-line (meters,
+        row) candidates, nearest first. Bays beyond the detour bound are dropped;
+        bays off the graph keep their straight-line distance.
+        """
+        candidates = candidates[:max(limit, RERANK_CANDIDATES)]
+        walked = self.walking_distances(lat, lon, [(lats[row], lons[row]) for _d, row in candidates],
+                                        radius * MAX_DETOUR)
+        ranked = []
+        for (straight, row), distance in zip(candidates, walked):
+            if distance is None:
+                ranked.append((straight, row))
+            elif distance != math.inf:
+                ranked.append((max(straight, int(round(distance))), row))
+        ranked.sort(key=lambda x: x[0])
+        return ranked[:limit]
+
+
+def load_street_graph() -> Optional[StreetGraph]:
+    """Compile PARKING_STREET_GRAPH into a StreetGraph; None when it is not set"""
+    path = os.getenv("PARKING_STREET_GRAPH")
+    if not path:
+        return None
+    try:
+        graph = StreetGraph.from_file(path)
+    except (OSError, ValueError, KeyError, ElementTree.ParseError) as e:
+        print(f"Could not load street graph: {e}")
+        return None
+    print(f"Loaded street graph with {len(graph)} nodes")
+    return graph
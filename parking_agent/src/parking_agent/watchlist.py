@@ -0,0 +1,400 @@
+"""
+Melbourne Parking Agent - Watchlist Alerts
+Notify saved locations when a bay frees up within their radius.
+
+Subscriptions (location, radius, delivery target) are held in a reverse
+spatial index: each one is registered in every grid cell its circle touches.
+On each snapshot the bays that became unoccupied are matched in one pass -
+one cell lookup and a few flat-distance checks per freed bay - instead of a
+radius search per subscription. Matches are deduplicated per (subscription,
+bay) over a cooldown window and delivered in one batch per target.
+
+Matching and delivery run on their own thread, never on the store listener
+thread that also feeds streams, tiles and the changelog. When a refresh lands
+while the previous one is still being matched, the two are merged into one
+diff against the last matched snapshot. Adding a subscription only touches the
+grid cells its circle covers; there is no index rebuild. At the default cap of
+100000 subscriptions a refresh freeing 270 bays takes about 3 s to match, well
+inside the 30 s refresh interval; new subscriptions are refused while matching
+takes longer than half the interval.
+
+Targets are either "webhook:https://..." (POSTed JSON) or "queue:<name>"
+(kept in memory and drained with GET /watchlist/queues/<name>). Webhooks are
+only sent over HTTPS to hosts listed in PARKING_WEBHOOK_HOSTS, so the service
+cannot be pointed at internal addresses.
+
+Every subscription has a secret, generated here and returned once when it is
+created, needed to delete it or read its queue. Batches are kept per target and secret owner,
+so knowing a queue name is not enough to read someone else's alerts.
+Subscriptions live in the memory of one process: the API refuses them when
+workers share a snapshot file (PARKING_SNAPSHOT_PATH).
+"""
+
+import hashlib
+import hmac
+import itertools
+import json
+import math
+import os
+import queue
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+from parking_agent import metrics
+from parking_agent.snapshot import DEFAULT_REFRESH_SECONDS, Snapshot, SnapshotDiff
+from parking_agent.spatial import METERS_PER_DEGREE_LAT, REFERENCE_LATITUDE, GridIndex
+
+MAX_RADIUS_METERS = 2000
+MAX_SUBSCRIPTIONS = int(os.getenv("PARKING_WATCHLIST_MAX", "100000"))
+MAX_LABEL_LENGTH = 200
+# Webhook hosts: "example.com" matches that host, ".example.com" its subdomains; none by default
+WEBHOOK_HOSTS = tuple(host.strip().lower() for host in os.getenv("PARKING_WEBHOOK_HOSTS", "").split(",")
+                      if host.strip())
+DEFAULT_COOLDOWN_SECONDS = 600.0
+QUEUE_MAX_MESSAGES = 1000
+# Nearest freed bays reported per subscription and refresh
+MAX_BAYS_PER_ALERT = 5
+
+# Flat-earth scale factors; accurate to well under a meter across the city
+_KY = METERS_PER_DEGREE_LAT
+_KX = METERS_PER_DEGREE_LAT * math.cos(math.radians(REFERENCE_LATITUDE))
+
+WATCHLIST_SUBSCRIPTIONS = metrics.Gauge("parking_watchlist_subscriptions", "Registered watchlist subscriptions")
+WATCHLIST_MATCH_SECONDS = metrics.Histogram(
+    "parking_watchlist_match_seconds", "Time to match one snapshot diff against all subscriptions")
+WATCHLIST_ALERTS = metrics.Counter("parking_watchlist_alerts", "Bay-freed alerts delivered", ["target_type"])
+WATCHLIST_DELIVERY_ERRORS = metrics.Counter("parking_watchlist_delivery_errors", "Failed watchlist deliveries")
+WATCHLIST_MERGED = metrics.Counter(
+    "parking_watchlist_merged_refreshes", "Refreshes merged into the next diff because matching was behind")
+
+
+class Subscription:
+    """A saved location watching for freed bays"""
+
+    __slots__ = ("id", "latitude", "longitude", "radius", "target", "label", "owner", "cells")
+
+    def __init__(self, subscription_id: int, latitude: float, longitude: float, radius: float,
+                 target: str, label: str = "", owner: str = ""):
+        self.id = subscription_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius
+        self.target = target
+        self.label = label
+        # Hash of the subscription secret; the secret itself is never stored
+        self.owner = owner
+        self.cells: List = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "radius": self.radius,
+            "target": self.target,
+            "label": self.label,
+        }
+
+
+def owner_of(secret: str) -> str:
+    """Owner key of a subscription secret"""
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+def secret_from_header(authorization: str) -> Optional[str]:
+    """Secret from an 'Authorization: Bearer <secret>' header"""
+    scheme, _, supplied = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not supplied.strip():
+        return None
+    return supplied.strip()
+
+
+def webhook_allowed(url: str, hosts: Sequence[str] = WEBHOOK_HOSTS) -> bool:
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    if parsed.scheme != "https" or not host or parsed.username or parsed.password:
+        return False
+    return any(host == allowed or (allowed.startswith(".") and host.endswith(allowed)) for allowed in hosts)
+
+
+def parse_target(target: str, hosts: Sequence[str] = WEBHOOK_HOSTS) -> Tuple[str, str]:
+    """Split 'webhook:<url>' / 'queue:<name>' into (type, address)"""
+    kind, _, address = target.partition(":")
+    if kind == "webhook":
+        if not webhook_allowed(address, hosts):
+            raise ValueError("webhook targets must be https:// URLs on a host listed in PARKING_WEBHOOK_HOSTS")
+        return kind, address
+    if kind == "queue" and address:
+        return kind, address
+    raise ValueError("target must be 'webhook:https://...' or 'queue:<name>'")
+
+
+class WatchlistRegistry:
+    """Subscriptions plus the reverse spatial index used to match freed bays"""
+
+    def __init__(self, cell_meters: float = 400.0, cooldown_seconds: float = DEFAULT_COOLDOWN_SECONDS,
+                 max_subscriptions: int = MAX_SUBSCRIPTIONS):
+        self.index = GridIndex(cell_meters)
+        self.cooldown_seconds = cooldown_seconds
+        self.max_subscriptions = max_subscriptions
+        self.subscriptions: Dict[int, Subscription] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # (subscription id, bay id) -> time of the last alert, for deduplication
+        self._recent: Dict[Tuple[int, int], float] = {}
+        # Owner -> live subscriptions; only secrets issued here and still in use are accepted
+        self._owners: Dict[str, int] = {}
+        # Set by the dispatcher while matching cannot keep up with the refresh interval
+        self.saturated = False
+
+    def __len__(self) -> int:
+        return len(self.subscriptions)
+
+    def add(self, latitude: float, longitude: float, radius: float, target: str, label: str = "",
+            secret: Optional[str] = None) -> Tuple[Subscription, str]:
+        """
+        Register a subscription; returns it with its secret. Secrets are always
+        generated here; passing the secret of a live subscription files the new
+        one under the same owner, so their alerts share one queue.
+        """
+        if not 0 < radius <= MAX_RADIUS_METERS:
+            raise ValueError(f"radius must be between 1 and {MAX_RADIUS_METERS} meters")
+        if len(label) > MAX_LABEL_LENGTH:
+            raise ValueError(f"label must be at most {MAX_LABEL_LENGTH} characters")
+        parse_target(target)
+        with self._lock:
+            if len(self.subscriptions) >= self.max_subscriptions:
+                raise OverflowError("Too many watchlist subscriptions")
+            if self.saturated:
+                raise OverflowError("Watchlist matching is behind the refresh interval; try again later")
+            if secret is None:
+                secret = secrets.token_urlsafe(24)
+            elif owner_of(secret) not in self._owners:
+                raise PermissionError("Unknown watchlist secret")
+            sub = Subscription(next(self._ids), latitude, longitude, radius, target, label, owner_of(secret))
+            self._owners[sub.owner] = self._owners.get(sub.owner, 0) + 1
+            # Index entries are flat tuples so matching avoids attribute lookups
+            entry = (sub.id, latitude, longitude, radius * radius)
+            sub.cells = self.index.cells_in_radius(latitude, longitude, radius)
+            for cell in sub.cells:
+                self.index.add(cell, entry)
+            self.subscriptions[sub.id] = sub
+            WATCHLIST_SUBSCRIPTIONS.set(len(self.subscriptions))
+        return sub, secret
+
+    def remove(self, subscription_id: int, secret: str) -> Optional[bool]:
+        """True when removed, False for a wrong secret, None for an unknown subscription"""
+        with self._lock:
+            sub = self.subscriptions.get(subscription_id)
+            if sub is None:
+                return None
+            if not hmac.compare_digest(sub.owner, owner_of(secret)):
+                return False
+            del self.subscriptions[subscription_id]
+            if self._owners[sub.owner] == 1:
+                del self._owners[sub.owner]
+            else:
+                self._owners[sub.owner] -= 1
+            entry = (sub.id, sub.latitude, sub.longitude, sub.radius * sub.radius)
+            for cell in sub.cells:
+                self.index.discard(cell, entry)
+            WATCHLIST_SUBSCRIPTIONS.set(len(self.subscriptions))
+        return True
+
+    def match(self, snapshot: Snapshot, rows: List[int]) -> Dict[int, List[Tuple[float, int]]]:
+        """
+        Match freed bay rows against all subscriptions in one pass.
+
+        Returns {subscription id: [(squared distance m^2, row), ...]}; the
+        square root is left until a match survives deduplication.
+        """
+        matches: Dict[int, List[Tuple[float, int]]] = {}
+        cells = self.index.cells
+        cell_of = self.index.cell_of
+        lats, lons = snapshot.lats, snapshot.lons
+        with self._lock:
+            for row in rows:
+                lat, lon = lats[row], lons[row]
+                bucket = cells.get(cell_of(lat, lon))
+                if not bucket:
+                    continue
+                for sub_id, sub_lat, sub_lon, radius2 in bucket:
+                    dy = (lat - sub_lat) * _KY
+                    dx = (lon - sub_lon) * _KX
+                    d2 = dx * dx + dy * dy
+                    if d2 <= radius2:
+                        found = matches.get(sub_id)
+                        if found is None:
+                            matches[sub_id] = [(d2, row)]
+                        else:
+                            found.append((d2, row))
+        return matches
+
+    def deduplicate(self, snapshot: Snapshot, matches: Dict[int, List[Tuple[float, int]]],
+                    now: Optional[float] = None) -> Dict[int, List[Tuple[float, int]]]:
+        """Drop (subscription, bay) pairs alerted within the cooldown window"""
+        now = time.time() if now is None else now
+        horizon = now - self.cooldown_seconds
+        recent = self._recent
+        if len(recent) > 4 * max(1, len(self.subscriptions)):
+            self._recent = recent = {key: ts for key, ts in recent.items() if ts > horizon}
+
+        fresh: Dict[int, List[Tuple[float, int]]] = {}
+        bay_ids = snapshot.bay_ids
+        for sub_id, found in matches.items():
+            kept = []
+            for match in found:
+                key = (sub_id, bay_ids[match[1]])
+                if recent.get(key, 0.0) > horizon:
+                    continue
+                recent[key] = now
+                kept.append(match)
+            if kept:
+                fresh[sub_id] = kept
+        return fresh
+
+    def batches(self, snapshot: Snapshot,
+                matches: Dict[int, List[Tuple[float, int]]]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """
+        Group alerts by delivery target and owner.
+
+        Returns {(target, owner): {"bays": {bay_id: bay}, "alerts": [alert, ...]}}. Each
+        freed bay is described once per batch and alerts refer to it by id, so
+        a bay matched by many subscriptions is not repeated in the payload.
+        """
+        grouped: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        described: Dict[int, Tuple[str, Dict[str, Any]]] = {}
+        lats, lons = snapshot.lats, snapshot.lons
+        subscriptions = self.subscriptions
+        for sub_id, found in matches.items():
+            sub = subscriptions.get(sub_id)
+            if sub is None:
+                continue
+            key = (sub.target, sub.owner)
+            batch = grouped.get(key)
+            if batch is None:
+                batch = grouped[key] = {"bays": {}, "alerts": []}
+            bays = batch["bays"]
+            if len(found) > 1:
+                found.sort()
+            nearest = []
+            for d2, row in found[:MAX_BAYS_PER_ALERT]:
+                bay = described.get(row)
+                if bay is None:
+                    lat, lon = lats[row], lons[row]
+                    bay = described[row] = (snapshot.bay_id(row), {
+                        "latitude": lat,
+                        "longitude": lon,
+                        "google_maps_link": f"https://www.google.com/maps/?q={lat},{lon}",
+                    })
+                bays[bay[0]] = bay[1]
+                nearest.append([bay[0], int(math.sqrt(d2) + 0.5)])
+            batch["alerts"].append({"subscription_id": sub_id, "label": sub.label, "bays": nearest})
+        return grouped
+
+
+class AlertDispatcher:
+    """Matches each snapshot diff on a background thread and delivers batched alerts"""
+
+    def __init__(self, registry: WatchlistRegistry, max_workers: int = 8, webhook_timeout: float = 5.0,
+                 budget_seconds: float = DEFAULT_REFRESH_SECONDS / 2):
+        self.registry = registry
+        self.webhook_timeout = webhook_timeout
+        # Matching slower than this refuses new subscriptions until it catches up
+        self.budget_seconds = budget_seconds
+        # (queue name, owner) -> pending batches
+        self.queues: Dict[Tuple[str, str], Deque[Dict]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="watchlist")
+        # (oldest unmatched previous, newest current); later refreshes replace the current side
+        self._pending: Optional[Tuple[Snapshot, Snapshot]] = None
+        self._pending_lock = threading.Lock()
+        self._wake: "queue.Queue[Any]" = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, name="parking-watchlist", daemon=True)
+        self._thread.start()
+
+    def on_snapshot(self, previous: Optional[Snapshot], current: Snapshot):
+        """Store listener: hand the refresh to the matching thread and return"""
+        if previous is None or not len(self.registry):
+            return
+        with self._pending_lock:
+            if self._pending is not None:
+                # Still matching an earlier refresh: diff from where it left off
+                WATCHLIST_MERGED.inc()
+                self._pending = (self._pending[0], current)
+                return
+            self._pending = (previous, current)
+        self._wake.put(None)
+
+    def _worker(self):
+        while self._wake.get() is not _STOP:
+            with self._pending_lock:
+                pending, self._pending = self._pending, None
+            if pending is None:
+                continue
+            previous, current = pending
+            try:
+                self.process(current.diff(previous))
+            except Exception as e:
+                print(f"Watchlist matching failed: {e}")
+
+    def process(self, diff: SnapshotDiff) -> int:
+        """Match, deduplicate and deliver one diff; returns the number of alerts"""
+        started = time.perf_counter()
+        snapshot = diff.snapshot
+        matches = self.registry.match(snapshot, diff.freed_rows)
+        matches = self.registry.deduplicate(snapshot, matches)
+        batches = self.registry.batches(snapshot, matches)
+        elapsed = time.perf_counter() - started
+        WATCHLIST_MATCH_SECONDS.observe(elapsed)
+        self.registry.saturated = elapsed > self.budget_seconds
+
+        for (target, owner), batch in batches.items():
+            self.deliver(target, owner, {"version": diff.version, **batch})
+        return sum(len(batch["alerts"]) for batch in batches.values())
+
+    def deliver(self, target: str, owner: str, payload: Dict[str, Any]):
+        try:
+            kind, address = parse_target(target)
+        except ValueError:
+            # The host was removed from PARKING_WEBHOOK_HOSTS after subscribing
+            WATCHLIST_DELIVERY_ERRORS.inc()
+            return
+        WATCHLIST_ALERTS.labels(kind).inc(len(payload["alerts"]))
+        if kind == "queue":
+            queue = self.queues.get((address, owner))
+            if queue is None:
+                queue = self.queues.setdefault((address, owner), deque(maxlen=QUEUE_MAX_MESSAGES))
+            queue.append(payload)
+        else:
+            self._executor.submit(self._post, address, payload)
+
+    def _post(self, url: str, payload: Dict[str, Any]):
+        import requests
+        try:
+            # Redirects could lead off the allowed hosts
+            response = requests.post(url, data=json.dumps(payload), timeout=self.webhook_timeout,
+                                     headers={"Content-Type": "application/json"}, allow_redirects=False)
+            response.raise_for_status()
+        except Exception as e:
+            WATCHLIST_DELIVERY_ERRORS.inc()
+            print(f"Watchlist webhook to {url} failed: {e}")
+
+    def close(self):
+        self._wake.put(_STOP)
+        self._executor.shutdown(wait=False)
+
+    def drain(self, name: str, secret: str, limit: int = 100) -> List[Dict]:
+        """Pop up to `limit` pending messages from the queue target of the secret's owner"""
+        queue = self.queues.get((name, owner_of(secret)))
+        messages = []
+        while queue and len(messages) < limit:
+            messages.append(queue.popleft())
+        return messages
+
+
+_STOP = object()
@@ -0,0 +1,182 @@
+"""
+Area and route search tests: geometry, and cached selections served with the
+current snapshot's version and bay fields.
+"""
+
+import json
+
+import pytest
+
+from parking_agent import area
+from parking_agent.cache import InProcessCache, ParkingCache
+from parking_agent.engine import ParkingEngine
+from parking_agent.shards import ShardIndex
+from parking_agent.snapshot import Snapshot, SnapshotStore
+
+CENTRE = (-37.8136, 144.9631)
+FAR = (-37.7900, 144.9631)
+STAMP = "2025-01-01T00:00:00+00:00"
+
+
+def _snapshot(bays, fetched_at=1_735_700_000.0):
+    """bays: {bay_id: (lat, lon, status name)}"""
+    return Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": status, "location": {"lat": lat, "lon": lon},
+        "status_timestamp": STAMP, "lastupdated": STAMP,
+    } for bay_id, (lat, lon, status) in bays.items()], fetched_at=fetched_at)
+
+
+def _square(centre, half_degrees=0.002):
+    lat, lon = centre
+    return {"type": "Polygon", "coordinates": [[
+        [lon - half_degrees, lat - half_degrees], [lon + half_degrees, lat - half_degrees],
+        [lon + half_degrees, lat + half_degrees], [lon - half_degrees, lat + half_degrees],
+    ]]}
+
+
+class Feed:
+    """SnapshotStore fetch that serves the snapshot set by the test"""
+
+    def __init__(self):
+        self.snapshot = None
+
+    def __call__(self):
+        return self.snapshot
+
+
+@pytest.fixture
+def world():
+    feed = Feed()
+    store = SnapshotStore(feed)
+    shards = ShardIndex()
+    store.add_listener(shards.on_snapshot)
+    cache = ParkingCache(InProcessCache(), 60.0)
+    engine = ParkingEngine(store=store, cache=cache, shards=shards)
+
+    def install(snapshot):
+        feed.snapshot = snapshot
+        return store.refresh()
+
+    return install, engine
+
+
+def _bays(overrides=None):
+    bays = {
+        1: (CENTRE[0], CENTRE[1], "Unoccupied"),
+        2: (CENTRE[0] + 0.0005, CENTRE[1], "Unoccupied"),
+        3: (FAR[0], FAR[1], "Unoccupied"),
+    }
+    bays.update(overrides or {})
+    return bays
+
+
+# Geometry
+
+def test_polygon_holes_and_multipolygons():
+    snapshot = _snapshot(_bays({4: (CENTRE[0] + 0.0015, CENTRE[1], "Present")}))
+    outer = _square(CENTRE)["coordinates"][0]
+    hole = _square((CENTRE[0] + 0.0005, CENTRE[1]), 0.0002)["coordinates"][0]
+    with_hole = area.parse_polygon({"type": "Polygon", "coordinates": [outer, hole]})
+    assert [snapshot.bay_ids[row] for row in area.rows_in_polygon(snapshot, with_hole)] == [1]
+
+    both = area.parse_polygon({"type": "Feature", "geometry": {"type": "MultiPolygon", "coordinates": [
+        _square(CENTRE)["coordinates"], _square(FAR)["coordinates"]]}})
+    assert sorted(snapshot.bay_ids[row] for row in area.rows_in_polygon(snapshot, both)) == [1, 2, 3]
+    # Occupied bays only when asked for
+    assert sorted(snapshot.bay_ids[row] for row in area.rows_in_polygon(snapshot, both, free_only=False)) == \
+        [1, 2, 3, 4]
+
+
+def test_polygon_input_is_validated():
+    with pytest.raises(ValueError):
+        area.parse_polygon({"type": "Point", "coordinates": [144.96, -37.81]})
+    with pytest.raises(ValueError):
+        area.parse_polygon({"type": "Polygon", "coordinates": [[[144.96, -37.81], [144.97, -37.81],
+                                                                 [144.96, -37.81]]]})
+
+
+def test_segments_keep_bays_within_the_width_nearest_first():
+    snapshot = _snapshot(_bays())
+    # A west-east street 20 m north of bay 2 (about 75 m north of bay 1)
+    street = CENTRE[0] + 0.0005 + 20 / 111_000
+    segments = area.parse_segments([[[CENTRE[1] - 0.001, street], [CENTRE[1] + 0.001, street]]])
+    found = area.rows_along_segments(snapshot, segments, width=30)
+    assert [(snapshot.bay_ids[row], round(distance)) for distance, row in found] == [(2, 20)]
+    found = area.rows_along_segments(snapshot, segments, width=100)
+    assert [snapshot.bay_ids[row] for _distance, row in found] == [2, 1]
+
+
+def test_polyline_decoding():
+    # The example from the polyline algorithm's documentation
+    assert area.decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@") == [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    with pytest.raises(ValueError):
+        area.decode_polyline("_p~iF~ps|U_ulL")
+    with pytest.raises(ValueError):
+        area.parse_route(points=[[144.96, -37.81]])
+
+
+def test_route_lists_corridor_bays_in_driving_order():
+    snapshot = _snapshot(_bays({4: (CENTRE[0] + 0.0010, CENTRE[1] + 0.0001, "Unoccupied")}))
+    # Driving north past bays 1, 2 and 4, then east away from them; bay 3 is off the corridor
+    route = area.parse_route(points=[[CENTRE[1], CENTRE[0] - 0.001], [CENTRE[1], CENTRE[0] + 0.002],
+                                     [CENTRE[1] + 0.002, CENTRE[0] + 0.002]])
+    found = area.rows_along_route(snapshot, route, width=20)
+    assert [snapshot.bay_ids[row] for _along, _distance, row in found] == [1, 2, 4]
+    along = [position for position, _distance, _row in found]
+    assert [round(b - a) for a, b in zip(along, along[1:])] == [56, 56]
+    assert [round(distance) for _along, distance, _row in found] == [0, 0, 9]
+
+    body = json.loads(area.search(snapshot, "route", route, 20))
+    assert [(b["bay_id"], b["distance_meters"]) for b in body["bays"]] == [("1", 0), ("2", 0), ("4", 9)]
+    assert [b["route_meters"] for b in body["bays"]] == [round(position) for position in along]
+
+
+# Cached selections
+
+def test_cached_area_selection_is_served_with_the_current_version(world, monkeypatch):
+    install, engine = world
+    polygon = area.parse_polygon(_square(CENTRE))
+
+    first = install(_snapshot(_bays()))
+    body = json.loads(area.search(first, "polygon", polygon, 0.0, engine.cache, engine.shards))
+    assert (body["version"], sorted(b["bay_id"] for b in body["bays"])) == (1, ["1", "2"])
+
+    # An unrelated bay changes: the shards under the polygon keep their token
+    second = install(_snapshot(_bays({3: (FAR[0], FAR[1], "Present")}), fetched_at=1_735_700_060.0))
+    selections = []
+    monkeypatch.setattr(area, "select", lambda *args: selections.append(args) or pytest.fail("recomputed"))
+    body = json.loads(area.search(second, "polygon", polygon, 0.0, engine.cache, engine.shards))
+    assert (body["version"], sorted(b["bay_id"] for b in body["bays"])) == (2, ["1", "2"])
+    assert selections == []
+
+
+def test_change_inside_the_area_recomputes(world):
+    install, engine = world
+    polygon = area.parse_polygon(_square(CENTRE))
+    area.search(install(_snapshot(_bays())), "polygon", polygon, 0.0, engine.cache, engine.shards)
+
+    third = install(_snapshot(_bays({2: (CENTRE[0] + 0.0005, CENTRE[1], "Present")})))
+    body = json.loads(area.search(third, "polygon", polygon, 0.0, engine.cache, engine.shards))
+    assert (body["version"], [b["bay_id"] for b in body["bays"]]) == (2, ["1"])
+
+
+def test_bay_moving_into_the_area_appears(world):
+    install, engine = world
+    polygon = area.parse_polygon(_square(CENTRE))
+    area.search(install(_snapshot(_bays())), "polygon", polygon, 0.0, engine.cache, engine.shards)
+
+    moved = install(_snapshot(_bays({3: (CENTRE[0] - 0.0005, CENTRE[1], "Unoccupied")})))
+    body = json.loads(area.search(moved, "polygon", polygon, 0.0, engine.cache, engine.shards))
+    assert sorted(b["bay_id"] for b in body["bays"]) == ["1", "2", "3"]
+
+
+def test_shard_scoped_search_refreshes_ages(world):
+    install, engine = world
+    install(_snapshot(_bays()))
+    first = engine.search(*CENTRE, radius=200, prefer_fresh=False)
+    install(_snapshot(_bays({3: (FAR[0], FAR[1], "Present")}), fetched_at=1_735_700_600.0))
+    second = engine.search(*CENTRE, radius=200, prefer_fresh=False)
+
+    assert [s["bay_id"] for s in second["parking_spots"]] == [s["bay_id"] for s in first["parking_spots"]]
+    assert [s["age_seconds"] - t["age_seconds"] for s, t in zip(second["parking_spots"], first["parking_spots"])] \
+        == [600, 600]
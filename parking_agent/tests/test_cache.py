@@ -0,0 +1,308 @@
+"""
+Cache backend and ParkingCache tests against a fake Redis server.
+
+FakeRedis speaks enough RESP2 (GET, SET with PX/NX, AUTH, SELECT) for
+RedisCache, over a real socket, and expires keys on a clock the tests
+advance by hand.
+"""
+
+import socket
+import socketserver
+import threading
+
+import pytest
+
+from parking_agent import cache
+from parking_agent.cache import (KEY_PREFIX, SCOPED_TTL_REFRESHES, InProcessCache, ParkingCache, RedisCache,
+                                 decode_value, encode_value)
+from parking_agent.snapshot import Snapshot
+
+REFRESH_SECONDS = 60.0
+
+
+class FakeClock:
+    """Stands in for the time module inside cache.py; sleep() advances the clock"""
+
+    def __init__(self, now: float = 1_700_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, clock: FakeClock):
+        self.clock = clock
+        self.data = {}
+        self.commands = []
+        # Close the next connection instead of replying, like a restarting server
+        self.drop_next = False
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), _FakeRedisHandler)
+        self.thread = threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        return "redis://127.0.0.1:%d/0" % self.server_address[1]
+
+    def execute(self, args):
+        name = args[0].upper()
+        with self.lock:
+            self.commands.append([name] + args[1:])
+            if name in (b"AUTH", b"SELECT"):
+                return b"+OK\r\n"
+            if name == b"GET":
+                value = self._live(args[1])
+                return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+            if name == b"SET":
+                key, value, options = args[1], args[2], [arg.upper() for arg in args[3:]]
+                if b"NX" in options and self._live(key) is not None:
+                    return b"$-1\r\n"
+                expires = None
+                if b"PX" in options:
+                    expires = self.clock.now + int(args[3 + options.index(b"PX") + 1]) / 1000
+                self.data[key] = (expires, value)
+                return b"+OK\r\n"
+        return b"-ERR unknown command\r\n"
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires <= self.clock.now:
+            del self.data[key]
+            return None
+        return value
+
+    def ttl_ms(self, key: str) -> int:
+        """PX of the last SET of `key` (without the cache key prefix)"""
+        full = f"{KEY_PREFIX}:{key}".encode()
+        for command in reversed(self.commands):
+            if command[0] == b"SET" and command[1] == full:
+                return int(command[command.index(b"PX") + 1])
+        raise KeyError(key)
+
+
+class _FakeRedisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            count = int(line[1:-2])
+            args = []
+            for _ in range(count):
+                length = int(self.rfile.readline()[1:-2])
+                args.append(self.rfile.read(length + 2)[:-2])
+            if self.server.drop_next:
+                self.server.drop_next = False
+                return
+            self.wfile.write(self.server.execute(args))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def redis(clock):
+    server = FakeRedis(clock)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _closed_port_url() -> str:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return "redis://127.0.0.1:%d/0" % port
+
+
+def _snapshot(free: int = 3) -> Snapshot:
+    records = [{"kerbsideid": i, "status_description": "Unoccupied" if i < free else "Present",
+                "location": {"lat": -37.81 + i * 1e-4, "lon": 144.96},
+                "lastupdated": "2025-01-01T00:00:00+00:00"} for i in range(5)]
+    return Snapshot.from_records(records, fetched_at=1_700_000_000.0)
+
+
+class CountingFetch:
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot if snapshot is not None else _snapshot()
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.snapshot
+
+
+# Value encoding
+
+def test_values_compress_only_when_large():
+    small, large = b"x" * 10, b"y" * 4096
+    assert encode_value(small) == b"r" + small
+    assert len(encode_value(large)) < len(large)
+    assert decode_value(encode_value(small)) == small
+    assert decode_value(encode_value(large)) == large
+
+
+# Key scoping
+
+def test_search_keys_are_scoped_by_version_and_variant(redis):
+    parking = ParkingCache(RedisCache(redis.url), REFRESH_SECONDS)
+    parking.set_search(1, -37.81, 144.96, 500, {"spots": [1]})
+    parking.set_search(1, -37.81, 144.96, 500, {"spots": [2]}, variant="fresh")
+
+    assert parking.get_search(1, -37.81, 144.96, 500) == {"spots": [1]}
+    assert parking.get_search(1, -37.81, 144.96, 500, variant="fresh") == {"spots": [2]}
+    assert parking.get_search(2, -37.81, 144.96, 500) is None
+    assert parking.get_search(1, -37.81, 144.96, 800) is None
+    assert all(key.startswith(KEY_PREFIX.encode() + b":v1:search:") for key in redis.data)
+
+
+def test_shard_token_scope_is_separate_from_versions(redis):
+    parking = ParkingCache(RedisCache(redis.url), REFRESH_SECONDS)
+    parking.set_area("r4f:abc", "digest", b"token")
+    parking.set_area(4, "digest", b"version")
+
+    assert parking.get_area("r4f:abc", "digest") == b"token"
+    assert parking.get_area(4, "digest") == b"version"
+    assert parking.get_area("r4f:abd", "digest") is None
+
+
+# TTLs
+
+def test_response_ttls(redis):
+    parking = ParkingCache(RedisCache(redis.url), REFRESH_SECONDS)
+    parking.set_search(7, 0.0, 0.0, 100, {})
+    parking.set_search("tok", 0.0, 0.0, 100, {})
+
+    assert redis.ttl_ms(ParkingCache.search_key(7, 0.0, 0.0, 100)) == REFRESH_SECONDS * 2 * 1000
+    assert redis.ttl_ms(ParkingCache.search_key("tok", 0.0, 0.0, 100)) == \
+        REFRESH_SECONDS * SCOPED_TTL_REFRESHES * 1000
+
+
+def test_redis_entries_expire(redis, clock):
+    parking = ParkingCache(RedisCache(redis.url), REFRESH_SECONDS)
+    parking.set_search(7, 0.0, 0.0, 100, {"n": 1})
+    clock.sleep(REFRESH_SECONDS * 2 - 1)
+    assert parking.get_search(7, 0.0, 0.0, 100) == {"n": 1}
+    clock.sleep(1)
+    assert parking.get_search(7, 0.0, 0.0, 100) is None
+
+
+def test_in_process_entries_expire_and_evict(clock):
+    backend = InProcessCache(max_entries=2)
+    backend.set("a", b"1", ttl=10)
+    clock.sleep(10.5)
+    assert backend.get("a") is None
+
+    backend.set("a", b"1", ttl=10)
+    backend.set("b", b"2", ttl=10)
+    backend.get("a")
+    backend.set("c", b"3", ttl=10)
+    assert backend.get("b") is None
+    assert backend.get("a") == b"1"
+
+
+def test_add_only_sets_missing_keys(redis, clock):
+    backend = RedisCache(redis.url)
+    assert backend.add("lock", b"1", ttl=5)
+    assert not backend.add("lock", b"2", ttl=5)
+    clock.sleep(5)
+    assert backend.add("lock", b"3", ttl=5)
+
+
+# Redis outages
+
+def test_unreachable_redis_degrades_to_misses(clock, capsys):
+    parking = ParkingCache(RedisCache(_closed_port_url(), timeout=0.5), REFRESH_SECONDS)
+    parking.set_search(1, 0.0, 0.0, 100, {"n": 1})
+    assert parking.get_search(1, 0.0, 0.0, 100) is None
+    assert "Cache get failed" in capsys.readouterr().out
+
+
+def test_unreachable_redis_fetches_locally(clock):
+    parking = ParkingCache(RedisCache(_closed_port_url(), timeout=0.5), REFRESH_SECONDS)
+    fetch = CountingFetch()
+    snapshot = parking.shared_fetch(fetch)()
+
+    assert fetch.calls == 1
+    assert snapshot.version == parking.interval()
+    assert snapshot.epoch == parking.fleet_epoch
+
+
+def test_reconnects_after_redis_error(redis):
+    backend = RedisCache(redis.url)
+    backend.set("k", b"v", ttl=10)
+    redis.drop_next = True
+    with pytest.raises(ConnectionError):
+        backend.get("k")
+    assert backend.get("k") == b"v"
+
+
+# Snapshot sharing
+
+def test_one_instance_fetches_per_interval(redis):
+    first = ParkingCache(RedisCache(redis.url), REFRESH_SECONDS)
+    second = ParkingCache(RedisCache(redis.url), REFRESH_SECONDS)
+    first_fetch, second_fetch = CountingFetch(), CountingFetch()
+
+    published = first.shared_fetch(first_fetch)()
+    loaded = second.shared_fetch(second_fetch)()
+
+    assert (first_fetch.calls, second_fetch.calls) == (1, 0)
+    assert loaded.token == published.token
+    assert loaded.version == first.interval()
+    assert list(loaded.bay_ids) == list(published.bay_ids)
+    assert second.latest_snapshot().token == published.token
+
+
+def test_next_interval_fetches_again(redis, clock):
+    parking = ParkingCache(RedisCache(redis.url), REFRESH_SECONDS)
+    fetch = CountingFetch()
+    first = parking.shared_fetch(fetch)()
+    clock.sleep(REFRESH_SECONDS)
+    second = parking.shared_fetch(fetch)()
+
+    assert fetch.calls == 2
+    assert second.version == first.version + 1
+
+
+def test_stalled_fetcher_falls_back_to_fleet_numbering(redis):
+    parking = ParkingCache(RedisCache(redis.url), REFRESH_SECONDS)
+    interval = parking.interval()
+    # Another instance holds the fetch lock but never publishes
+    assert parking._add(f"lock:fetch:{interval}", b"other", ttl=REFRESH_SECONDS)
+    fetch = CountingFetch()
+
+    snapshot = parking.shared_fetch(fetch, wait_seconds=1.0)()
+
+    assert fetch.calls == 1
+    assert (snapshot.version, snapshot.epoch) == (interval, parking.fleet_epoch)
+    assert parking.get_snapshot(interval).token == snapshot.token
+
+
+def test_first_published_snapshot_wins(redis):
+    parking = ParkingCache(RedisCache(redis.url), REFRESH_SECONDS)
+    interval = parking.interval()
+    early = parking.put_snapshot(_snapshot(free=1).with_version(interval, parking.fleet_epoch))
+    late = parking.put_snapshot(_snapshot(free=4).with_version(interval, parking.fleet_epoch))
+
+    assert len(early.free_rows) == len(late.free_rows) == 1
+    assert len(parking.get_snapshot(interval).free_rows) == 1
@@ -0,0 +1,27 @@
+"""
+Changelog tests: a mirror following the deltas ends up with the current state.
+"""
+
+import json
+
+from parking_agent.changelog import ChangeLog
+from parking_agent.snapshot import Snapshot
+
+
+def _snapshot(bays, version):
+    """bays: {bay_id: (lat, lon, status name)}"""
+    return Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": status, "location": {"lat": lat, "lon": lon},
+    } for bay_id, (lat, lon, status) in bays.items()], version=version, fetched_at=1_700_000_000.0)
+
+
+def test_moved_bay_is_reported_as_changed():
+    log = ChangeLog()
+    first = _snapshot({1: (-37.81, 144.96, "Present"), 2: (-37.82, 144.97, "Present")}, 1)
+    second = _snapshot({1: (-37.81, 144.965, "Present"), 2: (-37.82, 144.97, "Present")}, 2)
+    log.on_snapshot(None, first)
+    log.on_snapshot(first, second)
+
+    body = json.loads(log.changes_since(first.token))
+    assert [(bay["bay_id"], bay["longitude"]) for bay in body["bays"]] == [("1", 144.965)]
+    assert body["removed"] == []
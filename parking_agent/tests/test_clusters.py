@@ -0,0 +1,67 @@
+"""
+Cluster tests: union-find joins neighbouring bays, refuses joins past the span
+cap, and grouped results keep the nearest bay of each cluster.
+"""
+
+import math
+
+from parking_agent.clusters import LINK_METERS, MAX_SPAN_METERS, ClusterCache, Clusters, cluster_labels
+from parking_agent.snapshot import Snapshot
+from parking_agent.spatial import METERS_PER_DEGREE_LAT
+
+SOUTH = -37.8136
+LON = 144.9631
+
+
+def _lats(norths):
+    return [SOUTH + north / METERS_PER_DEGREE_LAT for north in norths]
+
+
+def test_neighbours_join_and_gaps_split():
+    norths = [0, 10, 20, 20 + LINK_METERS + 5, 45]
+    labels = cluster_labels(_lats(norths), [LON] * len(norths))
+    assert labels[0] == labels[1] == labels[2]
+    assert labels[3] == labels[4] != labels[0]
+
+
+def test_long_runs_split_at_the_span_cap():
+    norths = [10 * i for i in range(31)]
+    labels = cluster_labels(_lats(norths), [LON] * len(norths))
+    runs = {}
+    for north, label in zip(norths, labels):
+        runs.setdefault(label, []).append(north)
+    assert len(runs) >= 3
+    assert all(max(run) - min(run) <= MAX_SPAN_METERS for run in runs.values())
+    # Every run is contiguous: bays of one cluster never interleave with another
+    assert all(run == list(range(run[0], run[-1] + 1, 10)) for run in runs.values())
+
+
+def test_bays_without_coordinates_are_unlabelled():
+    labels = cluster_labels([SOUTH, math.nan, SOUTH], [LON, math.nan, LON])
+    assert list(labels) == [0, -1, 0]
+
+
+def _snapshot(statuses, version=1):
+    norths = [0, 8, 16, 200, 208]
+    return Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": status,
+        "location": {"lat": lat, "lon": LON},
+    } for bay_id, (lat, status) in enumerate(zip(_lats(norths), statuses), start=1)],
+        version=version, fetched_at=1_700_000_000.0)
+
+
+def test_group_keeps_the_nearest_bay_per_cluster():
+    snapshot = _snapshot(["Unoccupied", "Unoccupied", "Present", "Unoccupied", "Unoccupied"])
+    clusters = Clusters.build(snapshot)
+    grouped = clusters.group([(5, 0), (10, 1), (190, 3), (198, 4)])
+    assert [(row, free) for _distance, row, _label, free in grouped] == [(0, 2), (3, 2)]
+    assert clusters.describe(grouped[0][2], grouped[0][3])["bays"] == 3
+    assert clusters.describe(grouped[0][2], grouped[0][3])["free"] == 2
+
+
+def test_cache_reuses_labels_while_positions_are_unchanged():
+    cache = ClusterCache()
+    first = cache.get(_snapshot(["Unoccupied"] * 5, version=1))
+    second = cache.get(_snapshot(["Present"] * 5, version=2))
+    assert second.labels is first.labels
+    assert list(second.free) == [0, 0]
@@ -0,0 +1,41 @@
+"""
+Search engine tests: availability rings are cumulative, sampled between
+radii, and answered from the same pass as the results.
+"""
+
+from parking_agent.engine import ParkingEngine
+from parking_agent.snapshot import Snapshot, SnapshotStore
+
+HERE = (-37.8136, 144.9631)
+
+
+def _engine(bays):
+    """bays: {bay_id: (meters north of HERE, status name)}"""
+    snapshot = Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": status,
+        "location": {"lat": HERE[0] + north / 111_000, "lon": HERE[1]},
+    } for bay_id, (north, status) in bays.items()], fetched_at=1_700_000_000.0)
+    return ParkingEngine(SnapshotStore(lambda: snapshot))
+
+
+BAYS = {1: (50, "Unoccupied"), 2: (80, "Unoccupied"), 3: (120, "Present"), 4: (150, "Unoccupied"),
+        5: (300, "Unoccupied"), 6: (600, "Unoccupied")}
+
+
+def test_rings_count_free_bays_cumulatively():
+    result = _engine(BAYS).search(*HERE, radius=200, rings=[500, 100, 250, 100], prefer_fresh=False)
+    assert [(ring["radius"], ring["free"]) for ring in result["rings"]] == [(100, 2), (250, 3), (500, 4)]
+    assert "nearest" not in result["rings"][0]
+    # The results keep their own radius, not the widest ring's
+    assert [spot["bay_id"] for spot in result["parking_spots"]] == ["1", "2", "4"]
+
+
+def test_ring_samples_come_from_between_the_radii():
+    result = _engine(BAYS).search(*HERE, radius=200, rings=[100, 250, 500], ring_samples=1, prefer_fresh=False)
+    assert [[spot["bay_id"] for spot in ring["nearest"]] for ring in result["rings"]] == [["1"], ["4"], ["5"]]
+
+
+def test_rings_are_reported_without_results():
+    result = _engine({1: (400, "Unoccupied")}).search(*HERE, radius=100, rings=[100, 500], prefer_fresh=False)
+    assert result["status"] == "no_results"
+    assert [ring["free"] for ring in result["rings"]] == [0, 1]
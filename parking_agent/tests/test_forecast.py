@@ -0,0 +1,38 @@
+"""
+Forecast table tests: slots must be readable as soon as their key is published.
+"""
+
+from parking_agent.forecast import WEEK_HOURS, ForecastModel, RateTable
+
+
+class CheckedKeys(dict):
+    """Records, at publication time, whether the new slot was already indexable"""
+
+    def __init__(self, check):
+        super().__init__()
+        self.check = check
+        self.published = []
+
+    def __setitem__(self, key, slot):
+        self.published.append(self.check(slot))
+        super().__setitem__(key, slot)
+
+
+def test_rate_table_extends_arrays_before_publishing():
+    table = RateTable()
+    table.keys = CheckedKeys(lambda slot: len(table.free) >= (slot + 1) * WEEK_HOURS
+                             and len(table.observed) >= (slot + 1) * WEEK_HOURS)
+    for key in range(3):
+        slot = table.slot(key)
+        assert table.rate(slot, WEEK_HOURS - 1, 0.5) == 0.5
+    assert table.keys.published == [True, True, True]
+
+
+def test_bay_slot_arrays_exist_before_the_bay_is_published():
+    model = ForecastModel()
+    model.bays.keys = CheckedKeys(lambda slot: len(model.bay_cell) > slot
+                                  and len(model.last_epoch) > slot and len(model.last_status) > slot)
+    model.observe(101, -37.81, 144.96, [(1_700_000_000.0, 1)])
+    model.observe(102, -37.82, 144.97, [(1_700_000_000.0, 0)])
+    assert model.bays.keys.published == [True, True]
+    assert len(model.bay_cell) == len(model.bays) == 2
@@ -0,0 +1,34 @@
+"""
+Binary frame tests: Accept negotiation and the round trip through decode_frame.
+"""
+
+from parking_agent.engine import ParkingEngine
+from parking_agent.frame import FRAME_MEDIA_TYPE, decode_frame, encode_frame, wants_frame
+from parking_agent.snapshot import Snapshot
+
+
+def test_accept_q_values_pick_the_format():
+    assert wants_frame(FRAME_MEDIA_TYPE)
+    assert wants_frame(f"application/json;q=0.5, {FRAME_MEDIA_TYPE}")
+    assert wants_frame(f"application/json, {FRAME_MEDIA_TYPE}")
+    assert not wants_frame(f"application/json, {FRAME_MEDIA_TYPE};q=0.9")
+    assert not wants_frame(f"{FRAME_MEDIA_TYPE};q=0")
+    assert not wants_frame(f"{FRAME_MEDIA_TYPE};q=bogus")
+    # Wildcards alone keep JSON, and */* does not outrank a JSON preference
+    assert not wants_frame("*/*")
+    assert not wants_frame("application/*")
+    assert wants_frame(f"{FRAME_MEDIA_TYPE}, */*;q=0.1")
+
+
+def test_frame_rows_follow_the_search_order():
+    snapshot = Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": "Unoccupied",
+        "location": {"lat": -37.81 + bay_id * 1e-4, "lon": 144.96},
+        "status_timestamp": "2025-01-01T00:%02d:00+00:00" % bay_id,
+    } for bay_id in range(1, 6)], version=3, fetched_at=1_735_690_000.0)
+    candidates = ParkingEngine().nearest_free(snapshot, -37.81, 144.96, 1000, prefer_fresh=True)
+
+    decoded = decode_frame(encode_frame(snapshot, candidates))
+    assert (decoded["version"], decoded["count"]) == (3, 5)
+    assert decoded["bay_ids"] == [snapshot.bay_ids[row] for _distance, row in candidates]
+    assert decoded["distances"] == [distance for distance, _row in candidates]
@@ -0,0 +1,54 @@
+"""
+Freshness tests: the age penalty, the blended ranking and the staleness cutoff.
+"""
+
+import time
+
+import pytest
+
+from parking_agent import freshness
+from parking_agent.snapshot import Snapshot
+
+FETCHED_AT = 1_735_700_000.0
+
+
+def _snapshot(ages):
+    """ages: {bay_id: seconds since the last update before the fetch, or None}; every bay is free"""
+    def stamp(age):
+        return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(FETCHED_AT - age))
+
+    return Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": "Unoccupied",
+        "location": {"lat": -37.81 + bay_id * 1e-4, "lon": 144.96},
+        **({"lastupdated": stamp(age)} if age is not None else {}),
+    } for bay_id, age in ages.items()], fetched_at=FETCHED_AT)
+
+
+def test_penalty_grows_per_hour_past_the_fresh_window():
+    assert freshness.penalty_meters(0) == 0
+    assert freshness.penalty_meters(freshness.FRESH_SECONDS) == 0
+    assert freshness.penalty_meters(freshness.FRESH_SECONDS + 3600) == pytest.approx(freshness.PENALTY_METERS_PER_HOUR)
+    assert freshness.penalty_meters(10 * 86400) == freshness.MAX_PENALTY_METERS
+    assert freshness.penalty_meters(None) == freshness.MAX_PENALTY_METERS
+    assert (freshness.score(60), freshness.score(None)) == (1.0, 0.0)
+
+
+def test_rank_blends_distance_with_age():
+    snapshot = _snapshot({1: 7200, 2: 60, 3: None, 4: 60})
+    rows = {snapshot.bay_ids[row]: row for row in range(len(snapshot))}
+    # Bay 1 is nearest but two hours stale: it ranks 262 m further away
+    candidates = [(100, rows[1]), (120, rows[3]), (250, rows[2]), (400, rows[4])]
+    ranked = freshness.rank(snapshot, candidates)
+    assert [snapshot.bay_ids[row] for _distance, row in ranked] == [2, 1, 4, 3]
+    # Distances are reported unchanged
+    assert sorted(ranked) == sorted(candidates)
+
+
+def test_staleness_cutoff_and_count():
+    snapshot = _snapshot({1: 7200, 2: 60, 3: None, 4: 1800})
+    fresh = freshness.fresh_rows(snapshot, 3600)
+    assert sorted(snapshot.bay_ids[row] for row in fresh) == [2, 4]
+    subset = [row for row in range(len(snapshot)) if snapshot.bay_ids[row] in (1, 2)]
+    assert [snapshot.bay_ids[row] for row in freshness.fresh_rows(snapshot, 3600, subset)] == [2]
+    # Bays without a timestamp count as stale
+    assert freshness.stale_count(snapshot, 3600) == 2
@@ -0,0 +1,39 @@
+"""
+Heatmap tests: requests serve what the listener built and never aggregate.
+"""
+
+import json
+
+from parking_agent import heatmap
+from parking_agent.heatmap import HeatmapCache
+from parking_agent.snapshot import Snapshot
+
+
+def _snapshot(free, version):
+    return Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": "Unoccupied" if bay_id in free else "Present",
+        "location": {"lat": -37.81 + bay_id * 1e-4, "lon": 144.96},
+    } for bay_id in range(1, 5)], version=version, fetched_at=1_700_000_000.0)
+
+
+def test_levels_sum_to_the_bay_counts():
+    levels = heatmap.aggregate(_snapshot({1, 2}, 1))
+    for counts in levels.values():
+        assert [sum(cell[0] for cell in counts.values()), sum(cell[1] for cell in counts.values())] == [2, 2]
+
+
+def test_get_serves_the_last_build_while_the_next_is_pending(monkeypatch):
+    cache = HeatmapCache()
+    assert cache.get(14) is None
+
+    first = _snapshot({1}, 1)
+    cache.on_snapshot(None, first)
+
+    def no_aggregation(snapshot):
+        raise AssertionError("requests must not aggregate")
+
+    monkeypatch.setattr(heatmap, "aggregate", no_aggregation)
+    version, body = cache.get(14)
+    assert version == 1 and json.loads(body)["version"] == 1
+    # Out-of-range zooms are clamped to a built level
+    assert cache.get(99)[1] == cache.get(heatmap.MAX_ZOOM)[1]
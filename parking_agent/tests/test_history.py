@@ -0,0 +1,80 @@
+"""
+History store tests: restarts continue from persisted state, and single-bay
+queries only open the segments that hold the bay.
+"""
+
+import time
+
+from parking_agent import history
+from parking_agent.history import HistoryStore, encode_segment, segment_bays
+from parking_agent.snapshot import STATUS_FREE, STATUS_OCCUPIED, Snapshot
+
+NOW = int(time.time())
+
+
+def _snapshot(statuses, at: int) -> Snapshot:
+    names = {STATUS_FREE: "Unoccupied", STATUS_OCCUPIED: "Present"}
+    stamp = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(at))
+    return Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": names[code], "status_timestamp": stamp,
+        "location": {"lat": -37.81 + bay_id * 1e-5, "lon": 144.96},
+    } for bay_id, code in statuses.items()], fetched_at=at)
+
+
+def test_segment_bays_reads_only_the_table():
+    bays = {bay_id: [(NOW + bay_id, STATUS_FREE)] for bay_id in range(1, 20001, 7)}
+    data = encode_segment(NOW, bays)
+    assert segment_bays(data) == frozenset(bays)
+
+
+def test_restart_records_only_real_changes(tmp_path):
+    first = HistoryStore(str(tmp_path), ring_size=4)
+    statuses = {bay_id: STATUS_FREE for bay_id in range(1, 6)}
+    first.on_snapshot(None, _snapshot(statuses, NOW - 600))
+    statuses[2] = STATUS_OCCUPIED
+    first.on_snapshot(None, _snapshot(statuses, NOW - 300))
+    assert first.flush(include_rings=True) is not None
+    assert first.ring(2) == []
+
+    restarted = HistoryStore(str(tmp_path), ring_size=4)
+    statuses[3] = STATUS_OCCUPIED
+    restarted.on_snapshot(None, _snapshot(statuses, NOW))
+
+    assert [bay_id for bay_id in statuses if restarted.ring(bay_id)] == [3]
+    assert [status for _epoch, status in restarted.history(2)] == [STATUS_FREE, STATUS_OCCUPIED]
+    assert [status for _epoch, status in restarted.history(3)] == [STATUS_FREE, STATUS_OCCUPIED]
+
+
+def test_seed_takes_the_latest_transition_across_segments(tmp_path):
+    store = HistoryStore(str(tmp_path), ring_size=1, segment_entries=1)
+    # A ring of one spills every earlier transition into its own segment
+    for offset, code in enumerate((STATUS_FREE, STATUS_OCCUPIED, STATUS_FREE, STATUS_OCCUPIED)):
+        store.record(7, NOW - 1000 + offset, code)
+    store.flush(include_rings=True)
+
+    restarted = HistoryStore(str(tmp_path))
+    restarted.seed([7])
+    assert not restarted.record(7, NOW, STATUS_OCCUPIED)
+    assert restarted.record(7, NOW, STATUS_FREE)
+
+
+def test_bay_query_skips_segments_without_the_bay(tmp_path, monkeypatch):
+    store = HistoryStore(str(tmp_path), ring_size=1)
+    for bay_id in (1, 2, 3):
+        store.record(bay_id, NOW - 500, STATUS_FREE)
+        store.record(bay_id, NOW - 400, STATUS_OCCUPIED)
+        store.flush()
+    assert len(store.segments()) == 3
+
+    opened = []
+    decode = history.decode_segment
+
+    def counting_decode(data, start, only_bay=None):
+        opened.append(only_bay)
+        return decode(data, start, only_bay)
+
+    monkeypatch.setattr(history, "decode_segment", counting_decode)
+    assert [status for _epoch, status in store.history(2)] == [STATUS_FREE, STATUS_OCCUPIED]
+    assert opened == [2]
+    assert store.history(2, since=NOW - 100) == []
+    assert opened == [2]
@@ -0,0 +1,38 @@
+"""
+Nearest table tests: lookups agree with a full search of the free bays.
+"""
+
+import random
+
+from parking_agent.engine import ParkingEngine
+from parking_agent.nearest import NearestTable
+from parking_agent.snapshot import Snapshot
+from parking_agent.spatial import haversine_meters
+
+SOUTH, WEST, NORTH, EAST = -37.825, 144.945, -37.805, 144.975
+
+
+def _snapshot(count: int, seed: int, free_share: float = 0.3) -> Snapshot:
+    rng = random.Random(seed)
+    return Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": "Unoccupied" if rng.random() < free_share else "Present",
+        "location": {"lat": rng.uniform(SOUTH, NORTH), "lon": rng.uniform(WEST, EAST)},
+    } for bay_id in range(1, count + 1)], version=1, fetched_at=1_700_000_000.0)
+
+
+def test_lookups_are_exact():
+    snapshot = _snapshot(1500, seed=7)
+    table = NearestTable(snapshot)
+    lats, lons = snapshot.lats, snapshot.lons
+    rng = random.Random(8)
+    for _ in range(500):
+        lat, lon = rng.uniform(SOUTH, NORTH), rng.uniform(WEST, EAST)
+        truth = sorted((haversine_meters(lat, lon, lats[row], lons[row]), row) for row in snapshot.free_rows)
+        assert [row for _distance, row in table.nearest(snapshot, lat, lon)] == \
+            [row for _distance, row in truth[:table.k]]
+
+
+def test_no_free_bays_finds_nothing():
+    snapshot = _snapshot(50, seed=3, free_share=0.0)
+    assert NearestTable(snapshot).nearest(snapshot, -37.815, 144.96) is None
+    assert ParkingEngine().nearest_free(snapshot, -37.815, 144.96, 5000) == []
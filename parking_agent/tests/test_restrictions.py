@@ -0,0 +1,55 @@
+"""
+Restriction tests: day ranges wrap across the week and filters select rows
+through the per-slot bitmasks.
+"""
+
+from datetime import datetime
+
+from parking_agent.engine import MELBOURNE_TZ
+from parking_agent.restrictions import UNLIMITED, RestrictionIndex, SearchFilters, _day_mask, parse_rules, rows_of
+from parking_agent.snapshot import Snapshot
+
+MONDAY_10AM = datetime(2025, 1, 6, 10, 0, tzinfo=MELBOURNE_TZ).timestamp()
+SUNDAY_10AM = datetime(2025, 1, 5, 10, 0, tzinfo=MELBOURNE_TZ).timestamp()
+
+WEEKDAYS = {"fromday1": 1, "today1": 5, "starttime1": "07:30:00", "endtime1": "18:30:00"}
+RECORDS = [
+    {"kerbsideid": 1, "typedesc1": "2P Meter", "duration1": 120, **WEEKDAYS},
+    {"kerbsideid": 2, "typedesc1": "2P DIS Only", "duration1": 120, "disabilityext1": "1", **WEEKDAYS},
+    {"kerbsideid": 4, "typedesc1": "1/4P", "duration1": 15, **WEEKDAYS},
+]
+
+
+def test_day_ranges_wrap_across_sunday():
+    # The dataset counts from 0 = Sunday, masks from 0 = Monday
+    assert _day_mask(1, 5) == 0b0011111
+    assert _day_mask(6, 0) == 0b1100000
+    assert _day_mask(5, 1) == 0b1110001
+    assert _day_mask(3, 3) == 0b0000100
+    assert _day_mask("", None) == 0b1111111
+
+
+def test_rules_parse_durations_and_overnight_ends():
+    [rule] = parse_rules({"typedesc1": "Loading Zone", "starttime1": "22:00:00", "endtime1": "06:00:00",
+                          "fromday1": 0, "today1": 6, "disabilityext1": "0"})
+    assert (rule.start, rule.end, rule.duration, rule.disabled) == (22 * 60, 24 * 60, UNLIMITED, False)
+
+
+def test_filters_select_rows_by_slot():
+    index = RestrictionIndex.from_records(RECORDS)
+    # Bays 1-4 free, bay 5 occupied; bay 3 and 5 have no rules
+    snapshot = Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": "Present" if bay_id == 5 else "Unoccupied",
+        "location": {"lat": -37.81, "lon": 144.96},
+    } for bay_id in range(1, 6)], version=4101, fetched_at=MONDAY_10AM)
+
+    def bays(**filters):
+        return [snapshot.bay_ids[row] for row in index.free_rows(snapshot, SearchFilters(**filters))]
+
+    assert bays(min_duration=60, at_time=MONDAY_10AM) == [1, 2, 3]
+    assert bays(accessible=True, at_time=MONDAY_10AM) == [2]
+    assert bays(accessible=False, min_duration=60, at_time=MONDAY_10AM) == [1, 3]
+    # Weekday signs are not in force on Sunday
+    assert bays(min_duration=60, at_time=SUNDAY_10AM) == [1, 2, 3, 4]
+    assert bays(accessible=True, at_time=SUNDAY_10AM) == []
+    assert rows_of(index.mask(snapshot, SearchFilters())) == [0, 1, 2, 3, 4]
@@ -0,0 +1,71 @@
+"""
+Shard index tests: a token changes exactly when a bay in its area changes.
+"""
+
+from parking_agent.shards import ShardIndex, cell_degrees, covering, geohash
+from parking_agent.snapshot import Snapshot
+
+# Two points about 1.5 km apart, in different precision-7 shards
+HERE = (-37.8136, 144.9631)
+THERE = (-37.8000, 144.9631)
+
+
+def _snapshot(bays, version):
+    """bays: {bay_id: (lat, lon, status name)}"""
+    return Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": status, "location": {"lat": lat, "lon": lon},
+    } for bay_id, (lat, lon, status) in bays.items()], version=version, fetched_at=1_700_000_000.0)
+
+
+def _bbox(point, meters=50):
+    dlat, dlon = meters / 111_000, meters / 88_000
+    return (point[0] - dlat, point[1] - dlon, point[0] + dlat, point[1] + dlon)
+
+
+def _tokens(bays_by_version):
+    """Install snapshots in order; tokens of the HERE and THERE areas after each"""
+    index = ShardIndex()
+    previous = None
+    tokens = []
+    for version, bays in enumerate(bays_by_version, start=1):
+        current = _snapshot(bays, version)
+        index.on_snapshot(previous, current)
+        tokens.append((index.token(current, _bbox(HERE)), index.token(current, _bbox(THERE))))
+        previous = current
+    return tokens
+
+
+def test_geohash_and_covering_agree():
+    bbox = _bbox(HERE, 300)
+    cells = covering(bbox)
+    assert geohash(*HERE) in cells
+    dlat, dlon = cell_degrees()
+    assert len(cells) <= (int((bbox[2] - bbox[0]) / dlat) + 2) * (int((bbox[3] - bbox[1]) / dlon) + 2)
+
+
+def test_unrelated_change_keeps_the_token():
+    tokens = _tokens([
+        {1: (*HERE, "Unoccupied"), 2: (*THERE, "Unoccupied")},
+        {1: (*HERE, "Unoccupied"), 2: (*THERE, "Present")},
+    ])
+    assert tokens[1][0] == tokens[0][0]
+    assert tokens[1][1] != tokens[0][1]
+
+
+def test_moved_bay_bumps_its_old_and_new_shards():
+    tokens = _tokens([
+        {1: (*HERE, "Unoccupied"), 2: (*THERE, "Present")},
+        {1: (*THERE, "Unoccupied"), 2: (*THERE, "Present")},
+    ])
+    assert tokens[1][0] != tokens[0][0]
+    assert tokens[1][1] != tokens[0][1]
+
+
+def test_missed_version_resets_every_shard():
+    index = ShardIndex()
+    first = _snapshot({1: (*HERE, "Unoccupied")}, 1)
+    index.on_snapshot(None, first)
+    third = _snapshot({1: (*HERE, "Unoccupied")}, 3)
+    index.on_snapshot(_snapshot({1: (*HERE, "Unoccupied")}, 2), third)
+    assert index.epoch == 3
+    assert index.token(first, _bbox(HERE)) is None
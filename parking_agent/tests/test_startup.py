@@ -0,0 +1,16 @@
+"""
+Startup budget test: importing the HTTP API in a fresh interpreter stays fast
+and never pulls in the agent framework.
+"""
+
+import os
+
+from parking_agent import startup_check
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def test_api_import_holds_the_startup_budget(monkeypatch):
+    # The probe runs in a subprocess, which only sees the package through PYTHONPATH
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(filter(None, (SRC, os.getenv("PYTHONPATH")))))
+    assert startup_check.check_startup(budget_ms=startup_check.DEFAULT_BUDGET_MS) == []
@@ -0,0 +1,64 @@
+"""
+Stream hub tests: every viewport hears about a bay moving across its edge.
+"""
+
+import asyncio
+import json
+
+from parking_agent.snapshot import Snapshot
+from parking_agent.streaming import StreamHub
+
+WEST = (-37.815, 144.955, -37.810, 144.960)
+EAST = (-37.815, 144.965, -37.810, 144.970)
+
+
+def _snapshot(bays, version):
+    """bays: {bay_id: (lat, lon, status name)}"""
+    return Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": status, "location": {"lat": lat, "lon": lon},
+    } for bay_id, (lat, lon, status) in bays.items()], version=version, fetched_at=1_700_000_000.0)
+
+
+def _messages(sub):
+    messages = []
+    while not sub.queue.empty():
+        event = sub.queue.get_nowait()
+        messages.append(json.loads(event.split("data: ", 1)[1]))
+    return messages
+
+
+def _fan_out(hub, previous, current):
+    """Run the store listener and the loop callback it schedules"""
+    loop = asyncio.new_event_loop()
+    try:
+        hub._loop = loop
+        hub.on_snapshot(previous, current)
+        loop.run_until_complete(asyncio.sleep(0))
+    finally:
+        loop.close()
+
+
+def test_moved_bay_is_removed_from_its_old_viewport():
+    hub = StreamHub()
+    west, east = hub.subscribe(WEST), hub.subscribe(EAST)
+    before = _snapshot({1: (-37.812, 144.957, "Present"), 2: (-37.812, 144.958, "Present")}, 1)
+    # Same status, new position: the diff has no changed rows, only a move
+    after = _snapshot({1: (-37.812, 144.967, "Present"), 2: (-37.812, 144.958, "Present")}, 2)
+    _fan_out(hub, before, after)
+
+    [west_message] = _messages(west)
+    assert west_message["bays"] == [] and west_message["removed"] == ["1"]
+    [east_message] = _messages(east)
+    assert [bay["bay_id"] for bay in east_message["bays"]] == ["1"] and east_message["removed"] == []
+
+
+def test_move_within_a_viewport_is_a_change():
+    hub = StreamHub()
+    west = hub.subscribe(WEST)
+    before = _snapshot({1: (-37.812, 144.957, "Present")}, 1)
+    after = _snapshot({1: (-37.813, 144.956, "Unoccupied")}, 2)
+    _fan_out(hub, before, after)
+
+    [message] = _messages(west)
+    assert message["removed"] == []
+    assert [(bay["bay_id"], bay["latitude"]) for bay in message["bays"]] == [("1", -37.813)]
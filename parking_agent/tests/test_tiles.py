@@ -0,0 +1,36 @@
+"""
+Tile cache tests: a cached tile is dropped exactly when one of its bays changes.
+"""
+
+from parking_agent.snapshot import Snapshot
+from parking_agent.tiles import TILE_HEADER, TileCache, tile_of
+
+ZOOM = 16
+HERE = (-37.8136, 144.9631)
+THERE = (-37.8000, 144.9800)
+
+
+def _snapshot(bays, version):
+    """bays: {bay_id: (lat, lon, status name)}"""
+    return Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": status, "location": {"lat": lat, "lon": lon},
+    } for bay_id, (lat, lon, status) in bays.items()], version=version, fetched_at=1_700_000_000.0)
+
+
+def test_moved_bay_drops_its_old_and_new_tiles():
+    cache = TileCache()
+    before = _snapshot({1: (*HERE, "Present"), 2: (*THERE, "Present")}, 1)
+    cache.on_snapshot(None, before)
+    here, there = tile_of(*HERE, ZOOM), tile_of(*THERE, ZOOM)
+    assert here != there
+    for tile in (here, there):
+        cache.get(before, "bin", ZOOM, *tile)
+
+    # Bay 1 keeps its status but moves next to bay 2
+    after = _snapshot({1: (THERE[0] + 1e-5, THERE[1], "Present"), 2: (*THERE, "Present")}, 2)
+    cache.on_snapshot(before, after)
+
+    assert not cache._by_tile.keys() & {(ZOOM,) + here, (ZOOM,) + there}
+    _version, body = cache.get(after, "bin", ZOOM, *there)
+    _magic, version, count, _zoom = TILE_HEADER.unpack_from(body)
+    assert (version, count) == (2, 2)
@@ -0,0 +1,80 @@
+"""
+Tracking tests: snapshot diffs are applied to open sessions, including bays
+that move between cells, and unknown session ids are adopted.
+"""
+
+from parking_agent import tracking
+from parking_agent.snapshot import Snapshot
+from parking_agent.tracking import TrackingRegistry
+
+HERE = (-37.8136, 144.9631)
+
+
+def _snapshot(bays, version):
+    """bays: {bay_id: (meters north of HERE, status name)}"""
+    return Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": status,
+        "location": {"lat": HERE[0] + north / 111_000, "lon": HERE[1]},
+    } for bay_id, (north, status) in bays.items()], version=version, fetched_at=1_700_000_000.0)
+
+
+def _ranking(registry, session):
+    return [(round(distance), bay_id) for distance, bay_id in registry.nearest(session)]
+
+
+def _reread(*args):
+    raise AssertionError("cells were re-read")
+
+
+def test_diffs_update_sessions_without_rereading_cells(monkeypatch):
+    registry = TrackingRegistry()
+    first = _snapshot({1: (50, "Unoccupied"), 2: (120, "Present"), 3: (150, "Unoccupied")}, 1)
+    registry.on_snapshot(None, first)
+    session = registry.create(first, *HERE, radius=200)
+    assert _ranking(registry, session) == [(50, 1), (150, 3)]
+
+    monkeypatch.setattr(tracking, "_free_bays", _reread)
+    second = _snapshot({1: (50, "Present"), 2: (120, "Unoccupied"), 3: (150, "Unoccupied")}, 2)
+    registry.on_snapshot(first, second)
+    assert registry.move(session.id, second, *HERE) is session
+    assert _ranking(registry, session) == [(120, 2), (150, 3)]
+
+
+def test_moved_bay_is_refiled_under_its_new_cell():
+    registry = TrackingRegistry()
+    first = _snapshot({1: (30, "Unoccupied"), 2: (180, "Unoccupied")}, 1)
+    registry.on_snapshot(None, first)
+    session = registry.create(first, *HERE, radius=1500)
+
+    # Bay 1 keeps its status but its sensor is reported 1 km further north
+    second = _snapshot({1: (1030, "Unoccupied"), 2: (180, "Unoccupied")}, 2)
+    registry.on_snapshot(first, second)
+    assert [bay_id for _distance, bay_id in _ranking(registry, session)] == [2, 1]
+
+    # And moving back out of the radius drops it
+    third = _snapshot({1: (3000, "Unoccupied"), 2: (180, "Unoccupied")}, 3)
+    registry.on_snapshot(second, third)
+    assert _ranking(registry, session) == [(180, 2)]
+
+
+def test_missed_version_resyncs_on_the_next_move():
+    registry = TrackingRegistry()
+    first = _snapshot({1: (50, "Unoccupied")}, 1)
+    registry.on_snapshot(None, first)
+    session = registry.create(first, *HERE, radius=200)
+
+    # Version 2 never reaches this registry
+    third = _snapshot({1: (50, "Present"), 2: (80, "Unoccupied")}, 3)
+    registry.on_snapshot(_snapshot({1: (50, "Unoccupied")}, 2), third)
+    registry.move(session.id, third, *HERE)
+    assert _ranking(registry, session) == [(80, 2)]
+
+
+def test_unknown_session_ids_are_adopted():
+    registry = TrackingRegistry()
+    snapshot = _snapshot({1: (50, "Unoccupied")}, 1)
+    adopted = registry.move("300-5-elsewhere", snapshot, *HERE)
+    assert (adopted.radius, adopted.limit) == (300, 5)
+    assert _ranking(registry, adopted) == [(50, 1)]
+    assert registry.move("not-a-session", snapshot, *HERE) is None
+    assert registry.move("9000-5-toolarge", snapshot, *HERE) is None
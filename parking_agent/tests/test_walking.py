@@ -0,0 +1,67 @@
+"""
+Walking graph tests: OSM parsing keeps only walkable ways, and Dijkstra
+re-ranks bays that are close in a straight line but far on foot.
+"""
+
+import pytest
+
+from parking_agent.spatial import METERS_PER_DEGREE_LAT, METERS_PER_DEGREE_LON
+from parking_agent.walking import StreetGraph
+
+BASE = (-37.8200, 144.9600)
+
+
+def _point(east: float, north: float):
+    """(lat, lon) of a point given in meters from BASE"""
+    return BASE[0] + north / METERS_PER_DEGREE_LAT, BASE[1] + east / METERS_PER_DEGREE_LON
+
+
+# A river runs north-south between x = 0 and x = 60, crossed by a footbridge
+# 200 m north. Node 5 faces node 1 across the water.
+NODES = {1: _point(0, 0), 2: _point(0, 100), 3: _point(0, 200), 4: _point(60, 200), 5: _point(60, 0)}
+
+OSM = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+%s
+  <way id="10"><nd ref="1"/><nd ref="2"/><nd ref="3"/><tag k="highway" v="residential"/></way>
+  <way id="11"><nd ref="3"/><nd ref="4"/><tag k="highway" v="footway"/></way>
+  <way id="12"><nd ref="4"/><nd ref="5"/><tag k="highway" v="path"/></way>
+  <way id="13"><nd ref="1"/><nd ref="5"/><tag k="highway" v="motorway"/></way>
+  <way id="14"><nd ref="2"/><nd ref="5"/><tag k="highway" v="service"/><tag k="foot" v="no"/></way>
+  <way id="15"><nd ref="1"/><nd ref="99"/><nd ref="2"/><tag k="highway" v="path"/></way>
+</osm>
+""" % "\n".join('  <node id="%d" lat="%r" lon="%r"/>' % (node, lat, lon) for node, (lat, lon) in NODES.items())
+
+
+@pytest.fixture
+def graph(tmp_path):
+    path = tmp_path / "streets.osm"
+    path.write_text(OSM)
+    return StreetGraph.from_file(str(path))
+
+
+def test_only_walkable_ways_become_edges(graph):
+    assert len(graph) == 5
+    origin, _ = graph.snap(*NODES[1])
+    across, _ = graph.snap(*NODES[5])
+    # Around by the footbridge, not over the motorway or the foot=no service road
+    assert graph.shortest_paths(origin, {across}, 1000)[across] == pytest.approx(460, abs=0.1)
+
+
+def test_dijkstra_stops_at_the_bound(graph):
+    origin, _ = graph.snap(*NODES[1])
+    nodes = {graph.snap(*NODES[node])[0]: node for node in (2, 3, 5)}
+    found = graph.shortest_paths(origin, set(nodes), 250)
+    assert {nodes[node]: round(distance) for node, distance in found.items()} == {2: 100, 3: 200}
+
+
+def test_rerank_orders_by_walking_distance(graph):
+    lats, lons = zip(NODES[5], NODES[2])
+    # Row 0 is 60 m away across the river, row 1 is 100 m away on the same bank
+    candidates = [(60, 0), (100, 1)]
+    assert graph.rerank(*NODES[1], candidates, lats, lons, radius=500) == [(100, 1), (460, 0)]
+    # Beyond radius x MAX_DETOUR the bay across the river is dropped
+    assert graph.rerank(*NODES[1], candidates, lats, lons, radius=100) == [(100, 1)]
+    # Off the graph the straight-line distance is kept
+    far = _point(5000, 5000)
+    assert graph.rerank(*far, candidates, lats, lons, radius=500) == candidates
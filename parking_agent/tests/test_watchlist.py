@@ -0,0 +1,102 @@
+"""
+Watchlist tests: server-issued secrets, matching off the listener thread and
+merging of refreshes that arrive while matching is still running.
+"""
+
+import threading
+
+import pytest
+
+from parking_agent.snapshot import Snapshot
+from parking_agent.watchlist import AlertDispatcher, WatchlistRegistry
+
+
+def _snapshot(free, version: int) -> Snapshot:
+    return Snapshot.from_records([{
+        "kerbsideid": bay_id, "status_description": "Unoccupied" if bay_id in free else "Present",
+        "location": {"lat": -37.81 + bay_id * 1e-4, "lon": 144.96},
+        "lastupdated": "2025-01-01T00:00:00+00:00",
+    } for bay_id in range(1, 6)], version=version, fetched_at=1_700_000_000.0)
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = AlertDispatcher(WatchlistRegistry())
+    yield dispatcher
+    dispatcher.close()
+
+
+def test_secrets_are_issued_by_the_server():
+    registry = WatchlistRegistry()
+    first, secret = registry.add(-37.81, 144.96, 200, "queue:home")
+    second, same = registry.add(-37.81, 144.96, 200, "queue:home", secret=secret)
+    assert same == secret and second.owner == first.owner
+
+    with pytest.raises(PermissionError):
+        registry.add(-37.81, 144.96, 200, "queue:home", secret="chosen-by-the-caller")
+
+    assert registry.remove(first.id, secret) and registry.remove(second.id, secret)
+    # Once its last subscription is gone the secret no longer names an owner
+    with pytest.raises(PermissionError):
+        registry.add(-37.81, 144.96, 200, "queue:home", secret=secret)
+
+
+def test_saturated_matching_refuses_new_subscriptions(dispatcher):
+    dispatcher.budget_seconds = -1.0
+    dispatcher.process(_snapshot({1}, 2).diff(_snapshot(set(), 1)))
+    with pytest.raises(OverflowError):
+        dispatcher.registry.add(-37.81, 144.96, 200, "queue:home")
+
+    dispatcher.budget_seconds = 60.0
+    dispatcher.process(_snapshot({1}, 3).diff(_snapshot({1}, 2)))
+    dispatcher.registry.add(-37.81, 144.96, 200, "queue:home")
+
+
+def test_listener_returns_before_matching(dispatcher, monkeypatch):
+    _sub, secret = dispatcher.registry.add(-37.8099, 144.96, 500, "queue:home")
+    release, matched = threading.Event(), threading.Event()
+    match = dispatcher.registry.match
+
+    def blocked_match(snapshot, rows):
+        release.wait(5)
+        try:
+            return match(snapshot, rows)
+        finally:
+            matched.set()
+
+    monkeypatch.setattr(dispatcher.registry, "match", blocked_match)
+    dispatcher.on_snapshot(_snapshot(set(), 1), _snapshot({1}, 2))
+    assert dispatcher.drain("home", secret) == []
+
+    release.set()
+    assert matched.wait(5)
+    dispatcher.close()
+    dispatcher._thread.join(5)
+    [batch] = dispatcher.drain("home", secret)
+    assert batch["version"] == 2 and [bay for bay, _ in batch["alerts"][0]["bays"]] == ["1"]
+
+
+def test_refreshes_during_a_match_are_merged(dispatcher, monkeypatch):
+    _sub, secret = dispatcher.registry.add(-37.8099, 144.96, 500, "queue:home")
+    started, release = threading.Event(), threading.Event()
+    match = dispatcher.registry.match
+
+    def blocked_match(snapshot, rows):
+        started.set()
+        release.wait(5)
+        return match(snapshot, rows)
+
+    monkeypatch.setattr(dispatcher.registry, "match", blocked_match)
+    first, second, third, fourth = (_snapshot(set(), 1), _snapshot({1}, 2),
+                                    _snapshot({1, 2}, 3), _snapshot({1, 2, 3}, 4))
+    dispatcher.on_snapshot(first, second)
+    assert started.wait(5)
+    dispatcher.on_snapshot(second, third)
+    dispatcher.on_snapshot(third, fourth)
+
+    release.set()
+    dispatcher.close()
+    dispatcher._thread.join(5)
+    batches = dispatcher.drain("home", secret)
+    assert [batch["version"] for batch in batches] == [2, 4]
+    assert sorted(bay for bay, _ in batches[1]["alerts"][0]["bays"]) == ["2", "3"]